@@ -0,0 +1,111 @@
+# bench/bench_ingest_rpc.py
+# Round trips and latency to persist one signal: legacy PostgREST sequence vs
+# rpc_ingest_signal (sql/004_rpc_ingest_signal.sql), for N followers on one source.
+#
+#   python -m bench.bench_ingest_rpc [--followers 1,50,500] [--reps 5] [--keep]
+#
+# Needs SUPABASE_URL / SUPABASE_SERVICE_ROLE_KEY of a scratch project (a local
+# `supabase start` stack is ideal) with the sql/ migrations applied. Creates bench
+# users (telegram ids 990000000000+i), one bench group_sources row and its
+# copy_routes; inbound/user_inbound rows written by the run are deleted afterwards
+# unless --keep is given. Both modes are checked to return the same follower set.
+import sys
+import time
+import statistics
+from datetime import datetime, timezone
+
+from lib.supa import service_client
+from lib.ingest_db import IngestDB
+
+BENCH_TG_BASE = 990000000000
+BENCH_CHAT_ID = "-990000000001"
+
+
+def ensure_fixtures(sb, n_max: int):
+    users = []
+    for i in range(n_max):
+        users.append(sb.rpc("rpc_upsert_user_by_telegram", {
+            "p_telegram_id": str(BENCH_TG_BASE + i), "p_username": f"bench_{i}",
+        }).execute().data)
+    source = next(iter(sb.table("group_sources").select("*")
+                       .eq("chat_id", BENCH_CHAT_ID).eq("owner_user_id", users[0])
+                       .limit(1).execute().data or []), None)
+    if source is None:
+        source = sb.table("group_sources").insert({
+            "owner_user_id": users[0], "chat_id": BENCH_CHAT_ID,
+            "platform": "bench", "title": "bench source",   # not "telegram": the agent ignores it
+        }).execute().data[0]
+    return users, source
+
+
+def set_followers(sb, source_id, users, n: int):
+    rows = [{"source_id": source_id, "follower_user_id": u, "target_chat_id": "0", "active": i < n}
+            for i, u in enumerate(users)]
+    for k in range(0, len(rows), 500):
+        sb.table("copy_routes").upsert(rows[k:k + 500], on_conflict="source_id,follower_user_id").execute()
+
+
+def run_mode(db: IngestDB, source_id, n: int, reps: int, created: list):
+    lat, rtts, followers = [], [], None
+    for rep in range(reps):
+        payload = {
+            "source_id": source_id,
+            "message_id": f"bench-{db.mode}-{n}-{rep}-{time.time_ns()}",
+            "message_ts": datetime.now(timezone.utc).isoformat(),
+            "raw_text": "BUY XAUUSD 2350-2360 SL 2340 TP 2370",
+            "normalized_json": {"symbol": "XAUUSD", "side": "LONG", "entry": [2350, 2360]},
+            "parsed_json": {"symbol": "XAUUSD", "action": "buy", "entry_min": 2350, "entry_max": 2360,
+                            "sl": 2340, "tp": [2370]},
+        }
+        rt0 = db.stats.round_trips
+        t0 = time.perf_counter()
+        res = db.ingest(payload)   # legacy: no route cache, copy_routes is queried like before
+        lat.append((time.perf_counter() - t0) * 1000)
+        rtts.append(db.stats.round_trips - rt0)
+        created.append(res.inbound_id)
+        followers = sorted(str(r.follower_user_id) for r in res.routes)
+    return lat, rtts, followers
+
+
+def cleanup(sb, source_id, created):
+    for k in range(0, len(created), 100):
+        chunk = created[k:k + 100]
+        sb.table("user_inbound_messages").delete().in_("inbound_message_id", chunk).execute()
+        sb.table("inbound_messages").delete().in_("id", chunk).execute()
+    sb.table("copy_routes").delete().eq("source_id", source_id).execute()
+    sb.table("group_sources").delete().eq("id", source_id).execute()
+
+
+def main(argv):
+    ns = [1, 50, 500]
+    reps, keep = 5, "--keep" in argv
+    if "--followers" in argv:
+        ns = [int(x) for x in argv[argv.index("--followers") + 1].split(",")]
+    if "--reps" in argv:
+        reps = int(argv[argv.index("--reps") + 1])
+
+    sb = service_client()
+    users, source = ensure_fixtures(sb, max(ns))
+    created = []
+    failed = False
+    print(f"{'N':>5} {'mode':>7} {'round_trips':>12} {'p50_ms':>9} {'mean_ms':>9} {'max_ms':>9}")
+    try:
+        for n in ns:
+            set_followers(sb, source["id"], users, n)
+            seen = {}
+            for mode in ("legacy", "rpc"):
+                lat, rtts, followers = run_mode(IngestDB(sb, mode), source["id"], n, reps, created)
+                seen[mode] = followers
+                print(f"{n:>5} {mode:>7} {statistics.mean(rtts):>12.1f} {statistics.median(lat):>9.1f} "
+                      f"{statistics.mean(lat):>9.1f} {max(lat):>9.1f}")
+            if seen["legacy"] != seen["rpc"] or len(seen["rpc"]) != n:
+                print(f"[ERR] N={n}: follower sets differ (legacy={len(seen['legacy'])}, rpc={len(seen['rpc'])})")
+                failed = True
+    finally:
+        if not keep:
+            cleanup(sb, source["id"], created)
+    sys.exit(1 if failed else 0)
+
+
+if __name__ == "__main__":
+    main(sys.argv[1:])
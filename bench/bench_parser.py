@@ -0,0 +1,132 @@
+# bench/bench_parser.py
+# Per-message cost of parse_trade_signal before/after the single-pass extraction.
+#
+#   python -m bench.bench_parser [bench/corpus.jsonl] [--secs 2]
+#
+# "legacy" is the multi-walk implementation this replaced (kept here verbatim, run
+# against the spaCy backend's nlp/matcher objects); the run aborts if any result differs.
+import re
+import sys
+import json
+import time
+from typing import Any, Dict, List, Optional, Tuple
+
+from lib import parser as P
+
+_HINTS = {"symbol": "WLDUSDT", "side": "LONG", "entry": [1.1045, 1.0413], "targets": [], "stop": None}
+
+
+def legacy_parse_trade_signal(raw_text: str, hints: Optional[Dict[str, Any]] = None) -> Optional[Dict[str, Any]]:
+    spacy_backend = P.get_backend("spacy")
+    nlp, matcher, _f = spacy_backend.nlp, spacy_backend.matcher, P._f
+    hints = hints or {}
+    text_norm = raw_text.replace("–", "-").replace("—", "-")
+    doc = nlp(text_norm)
+    upper = text_norm.upper()
+    symbol = (hints.get("symbol") or "").upper() or P._extract_symbol(upper)
+    timeframe = (hints.get("timeframe") or None)
+    side = hints.get("side") or _legacy_first_match(doc, "SIDE")
+    entry = hints.get("entry")
+    entry_tuple: Tuple[Optional[float], Optional[float]] = (None, None)
+    matches = matcher(doc)
+    targets: List[float] = list(hints.get("targets") or [])
+    stop = hints.get("stop")
+    if not entry:
+        for mid, s, e in matches:
+            name = nlp.vocab.strings[mid]
+            span = doc[s:e]
+            if name == "ENTRY_RANGE" and entry_tuple == (None, None):
+                nums = [t.text for t in span if re.match(r"^[0-9]+(?:[.,][0-9]+)?$", t.text)]
+                if len(nums) >= 2:
+                    a, b = _f(nums[0]), _f(nums[1])
+                    entry_tuple = (min(a, b), max(a, b))
+            elif name == "ENTRY_SINGLE" and entry_tuple == (None, None):
+                nums = [t.text for t in span if re.match(r"^[0-9]+(?:[.,][0-9]+)?$", t.text)]
+                if nums:
+                    p = _f(nums[0])
+                    entry_tuple = (p, p)
+    else:
+        if len(entry) == 1:
+            entry_tuple = (float(entry[0]), float(entry[0]))
+        elif len(entry) >= 2:
+            a, b = float(entry[0]), float(entry[1])
+            entry_tuple = (min(a, b), max(a, b))
+    if not targets:
+        for mid, s, e in matches:
+            if nlp.vocab.strings[mid] == "TARGET":
+                nums = [t.text for t in doc[s:e] if re.match(r"^[0-9]+(?:[.,][0-9]+)?$", t.text)]
+                if nums:
+                    targets.append(_f(nums[-1]))
+    if stop is None:
+        for mid, s, e in matches:
+            if nlp.vocab.strings[mid] == "STOP":
+                nums = [t.text for t in doc[s:e] if re.match(r"^[0-9]+(?:[.,][0-9]+)?$", t.text)]
+                if nums:
+                    stop = _f(nums[-1])
+    if not (symbol and side and entry_tuple[0] is not None):
+        return None
+    if any(x is not None and x <= 0 for x in [entry_tuple[0], entry_tuple[1] or entry_tuple[0], stop or 1]):
+        return None
+    action = "buy" if side.upper() in {"LONG", "BUY"} else "sell"
+    return {
+        "action": action,
+        "symbol": symbol,
+        "entry_min": entry_tuple[0],
+        "entry_max": entry_tuple[1] if entry_tuple[1] is not None else entry_tuple[0],
+        "sl": stop,
+        "tp": targets,
+        "timeframe": timeframe,
+    }
+
+
+def _legacy_first_match(doc, name: str) -> Optional[str]:
+    nlp, matcher = P.get_backend("spacy").nlp, P.get_backend("spacy").matcher
+    for mid, s, e in matcher(doc):
+        if nlp.vocab.strings[mid] == name:
+            return doc[s:e].text
+    return None
+
+
+def load_corpus(path: str) -> List[str]:
+    with open(path, encoding="utf-8") as f:
+        return [json.loads(l)["text"] for l in f if l.strip()]
+
+
+def per_message_us(fn, texts: List[str], hints, secs: float) -> float:
+    for t in texts:  # warm-up
+        fn(t, hints)
+    n = 0
+    t0 = time.perf_counter()
+    while time.perf_counter() - t0 < secs:
+        for t in texts:
+            fn(t, hints)
+        n += len(texts)
+    return (time.perf_counter() - t0) / n * 1e6
+
+
+def main():
+    args = sys.argv[1:]
+    path = args[0] if args and not args[0].startswith("--") else "bench/corpus.jsonl"
+    secs = float(args[args.index("--secs") + 1]) if "--secs" in args else 2.0
+    texts = load_corpus(path)
+
+    diffs = 0
+    for hints in (None, _HINTS):
+        for t in texts:
+            if legacy_parse_trade_signal(t, hints) != P.parse_trade_signal(t, hints, backend="spacy"):
+                diffs += 1
+                print("[DIFF]", json.dumps(t[:80], ensure_ascii=False))
+    if diffs:
+        print(f"{diffs} result(s) differ; not benchmarking")
+        sys.exit(1)
+
+    print(f"corpus={path} messages={len(texts)} (identical results)")
+    for label, hints in (("no hints", None), ("with hints", _HINTS)):
+        before = per_message_us(legacy_parse_trade_signal, texts, hints, secs)
+        after = per_message_us(lambda t, h: P.parse_trade_signal(t, h, backend="spacy"), texts, hints, secs)
+        print(f"{label:>10}: legacy {before:8.1f} us/msg | single-pass {after:8.1f} us/msg "
+              f"| {before / after:4.2f}x")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,93 @@
+# bench/bench_sizing.py
+# Per-follower lot sizing for one signal: lib/sizing.py (one NumPy pass) vs the same
+# rules applied follower by follower in plain Python. Both must agree exactly.
+#
+#   python -m bench.bench_sizing [--followers 10000] [--reps 20] [--seed 7]
+#
+# Offline: random follower settings/balances, brokers from the bundled symbol catalog.
+import sys
+import math
+import time
+import random
+import statistics
+
+from lib.sizing import SizingEngine, SIZING_DEFAULT_LOTS, quote_rate
+from lib.symbols import get_catalog
+
+SIGNAL = {"symbol": "XAUUSD", "action": "buy", "entry_min": 2350, "entry_max": 2360, "sl": 2340, "tp": [2370]}
+
+
+def make_followers(n: int, seed: int):
+    rnd = random.Random(seed)
+    out = []
+    for i in range(n):
+        risk = rnd.random() < 0.6
+        out.append({
+            "user_id": f"u{i}",
+            "broker": rnd.choice(["default", "default", "exness", "icmarkets"]),
+            "sizing_mode": "risk" if risk else "fixed",
+            "fixed_lots": None if rnd.random() < 0.3 else round(rnd.uniform(0.01, 3), 2),
+            "risk_pct": round(rnd.uniform(0.1, 5), 2) if risk and rnd.random() < 0.95 else None,
+            "max_symbol_lots": None if rnd.random() < 0.5 else round(rnd.uniform(0.005, 5), 2),
+            "balance": None if rnd.random() < 0.05 else round(rnd.lognormvariate(8, 1.5), 2),
+        })
+    return out
+
+
+def size_scalar(parsed: dict, f: dict) -> float:
+    """Reference: the sizing rules, one follower at a time."""
+    symbol = parsed["symbol"].upper()
+    lo, hi = parsed["entry_min"], parsed.get("entry_max")
+    entry = (float(lo) + float(hi if hi is not None else lo)) / 2.0
+    spec = get_catalog(str(f.get("broker") or "default").lower()).contract(symbol)
+    contract, min_lot = spec.get("contract_size", 1), spec.get("min_lot", 0.01)
+    step, max_lot = spec.get("lot_step", 0.01), spec.get("max_lot", math.inf)
+    rate = quote_rate(symbol, entry, spec.get("quote")) or 0.0
+    loss = abs(entry - float(parsed["sl"])) * contract * rate if parsed.get("sl") is not None else 0.0
+
+    lots, usable = f["fixed_lots"] if f["fixed_lots"] is not None else SIZING_DEFAULT_LOTS, False
+    if f["sizing_mode"] == "risk" and f["balance"] is not None and f["risk_pct"] is not None and loss > 0:
+        lots, usable = f["balance"] * f["risk_pct"] / 100.0 / loss, True
+    cap = min(f["max_symbol_lots"] if f["max_symbol_lots"] is not None else math.inf, max_lot)
+    lots = round(math.floor(min(lots, cap) / step + 1e-9) * step, 8)
+    if lots < min_lot - 1e-12:
+        lots = 0.0 if usable or cap < min_lot - 1e-12 else min_lot
+    return lots
+
+
+def timed(fn, reps: int):
+    lat = []
+    for _ in range(reps):
+        t0 = time.perf_counter()
+        res = fn()
+        lat.append((time.perf_counter() - t0) * 1000)
+    return res, lat
+
+
+def main(argv):
+    n, reps, seed = 10000, 20, 7
+    if "--followers" in argv:
+        n = int(argv[argv.index("--followers") + 1])
+    if "--reps" in argv:
+        reps = int(argv[argv.index("--reps") + 1])
+    if "--seed" in argv:
+        seed = int(argv[argv.index("--seed") + 1])
+
+    followers = make_followers(n, seed)
+    engine = SizingEngine()
+    vec, vec_lat = timed(lambda: engine.size(SIGNAL, followers), reps)
+    ref, ref_lat = timed(lambda: {f["user_id"]: size_scalar(SIGNAL, f) for f in followers}, reps)
+
+    print(f"{'impl':>8} {'N':>7} {'p50_ms':>9} {'mean_ms':>9} {'max_ms':>9}")
+    for name, lat in (("numpy", vec_lat), ("scalar", ref_lat)):
+        print(f"{name:>8} {n:>7} {statistics.median(lat):>9.2f} {statistics.mean(lat):>9.2f} {max(lat):>9.2f}")
+    print(f"speedup x{statistics.median(ref_lat) / statistics.median(vec_lat):.1f}; stats:", engine.snapshot())
+
+    diff = [uid for uid in ref if abs(ref[uid] - vec[uid]) > 1e-9]
+    if diff:
+        print(f"[ERR] {len(diff)} follower sizes differ, e.g. {diff[0]}: numpy={vec[diff[0]]} scalar={ref[diff[0]]}")
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main(sys.argv[1:])
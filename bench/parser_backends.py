@@ -0,0 +1,152 @@
+# bench/parser_backends.py
+# Equivalence + throughput harness for the parse_trade_signal backends.
+#
+#   python -m bench.parser_backends [bench/corpus.jsonl] [--fuzz 2000] [--secs 2]
+#
+# 1. Runs spaCy and regex backends over the corpus plus fuzzed variants of it
+#    (case, punctuation, dashes, whitespace, emoji, thousands separators) and diffs
+#    the tokens, the matches and the final parse_trade_signal dicts.
+# 2. In a fresh interpreter per backend (so imports are not shared) measures
+#    startup (import + build), messages/sec and peak memory (tracemalloc + maxrss).
+# Exits non-zero if any output differs.
+import sys
+import json
+import time
+import random
+import resource
+import subprocess
+import tracemalloc
+from typing import List
+
+_HINTS = {"symbol": "WLDUSDT", "side": "LONG", "entry": [1.1045, 1.0413], "targets": [], "stop": None}
+_NOISE = [":", ";", "-", "–", "—", "/", "@", "(", ")", ".", "..", ",", "!", "?", "#", "$", "'", '"',
+          "🚀", "🔥", "✅", "📈", "\n", "\n\n", "\t", "  ", " ", "\xa0", "x", "k", "%", "'s", "n't"]
+_WORDS = ["entry", "Entry:", "ENTRY", "entryzone", "entry-area", "tp", "TP1", "tp2:", "target", "take",
+          "sl", "SL:", "stop", "stop-loss", "stoploss", "long", "SHORT", "Buy", "sell", "e.g.", "U.S.",
+          "can't", "I'm", "1.2345", "1,234.5", "2350-2360", "0.00012", "10k", "5x", "BTC/USDT", "#XAUUSD",
+          "https://t.me/x", "(1.08)", "[2]", "1st", "p.m.", "vs.", ":)", "<3"]
+
+
+def load_corpus(path: str) -> List[str]:
+    with open(path, encoding="utf-8") as f:
+        return [json.loads(l)["text"] for l in f if l.strip()]
+
+
+def fuzz(texts: List[str], n: int, seed: int = 7) -> List[str]:
+    """Mutated copies of corpus messages that stress tokenizer edge cases."""
+    rnd = random.Random(seed)
+    out = []
+    for _ in range(n):
+        chars = list(rnd.choice(texts))
+        for _ in range(rnd.randint(1, 8)):
+            op = rnd.random()
+            pos = rnd.randint(0, len(chars))
+            if op < 0.35:
+                chars[pos:pos] = list(rnd.choice(_NOISE))
+            elif op < 0.6:
+                chars[pos:pos] = list(" " + rnd.choice(_WORDS) + rnd.choice(["", " ", "\n"]))
+            elif op < 0.75 and chars:
+                del chars[min(pos, len(chars) - 1)]
+            elif op < 0.9 and chars:
+                i = min(pos, len(chars) - 1)
+                chars[i] = chars[i].swapcase()
+            else:
+                chars = list("".join(chars).replace(" ", rnd.choice(["", "  ", "\n", ":", " - "]), 1))
+        out.append("".join(chars))
+    return out
+
+
+def diff_backends(texts: List[str]) -> int:
+    from lib import parser as P
+    spacy_b, regex_b = P.get_backend("spacy"), P.get_backend("regex")
+    diffs = 0
+    for t in texts:
+        norm = t.replace("–", "-").replace("—", "-")
+        a, b = spacy_b.scan(norm), regex_b.scan(norm)
+        results = [(P.parse_trade_signal(t, h, backend="spacy"), P.parse_trade_signal(t, h, backend="regex"))
+                   for h in (None, _HINTS)]
+        if a != b or any(x != y for x, y in results):
+            diffs += 1
+            if diffs <= 10:
+                print("[DIFF]", json.dumps(t[:120], ensure_ascii=False))
+                if a[0] != b[0]:
+                    print("   spacy tokens:", a[0])
+                    print("   regex tokens:", b[0])
+                elif a[1] != b[1]:
+                    print("   spacy matches:", a[1])
+                    print("   regex matches:", b[1])
+    return diffs
+
+
+def measure(name: str, path: str, secs: float, traced: bool) -> dict:
+    """
+    Runs in a child interpreter: nothing imported yet except the stdlib. tracemalloc
+    slows Python allocations several-fold, so speed and memory come from separate runs.
+    """
+    if traced:
+        tracemalloc.start()
+    t0 = time.perf_counter()
+    from lib import parser as P
+    P.get_backend(name)
+    startup = time.perf_counter() - t0
+
+    texts = load_corpus(path)
+    for t in texts:  # warm-up (fills tokenizer caches)
+        P.parse_trade_signal(t, backend=name)
+    n = 0
+    t0 = time.perf_counter()
+    while time.perf_counter() - t0 < secs:
+        for t in texts:
+            P.parse_trade_signal(t, backend=name)
+        n += len(texts)
+    elapsed = time.perf_counter() - t0
+    if traced:
+        return {"peak_traced_mb": round(tracemalloc.get_traced_memory()[1] / 2 ** 20, 1)}
+    return {
+        "backend": name,
+        "startup_ms": round(startup * 1000, 1),
+        "msgs_per_sec": int(n / elapsed),
+        "us_per_msg": round(elapsed / n * 1e6, 1),
+        "maxrss_mb": round(resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024, 1),
+    }
+
+
+def _child(name: str, path: str, secs: float, traced: bool) -> dict:
+    cmd = [sys.executable, "-m", "bench.parser_backends", "--measure", name, path, str(secs)]
+    if traced:
+        cmd.append("--traced")
+    out = subprocess.run(cmd, capture_output=True, text=True, check=True)
+    return json.loads(out.stdout.strip().splitlines()[-1])
+
+
+def main():
+    args = sys.argv[1:]
+    if args and args[0] == "--measure":
+        print(json.dumps(measure(args[1], args[2], float(args[3]), "--traced" in args)))
+        return
+
+    path = args[0] if args and not args[0].startswith("--") else "bench/corpus.jsonl"
+    secs = float(args[args.index("--secs") + 1]) if "--secs" in args else 2.0
+    n_fuzz = int(args[args.index("--fuzz") + 1]) if "--fuzz" in args else 2000
+
+    # children first: maxrss survives fork/exec, so spawn them before this process loads spaCy
+    rows = []
+    for name in ("spacy", "regex"):
+        r = _child(name, path, secs, traced=False)
+        r.update(_child(name, path, 0.2, traced=True))
+        rows.append(r)
+
+    texts = load_corpus(path)
+    variants = fuzz(texts, n_fuzz)
+    diffs = diff_backends(texts + variants)
+    print(f"corpus={path} messages={len(texts)} fuzzed={len(variants)} differing={diffs}")
+    for r in rows:
+        print(f"{r['backend']:>6}: {r['msgs_per_sec']:>7} msgs/s ({r['us_per_msg']:6.1f} us/msg) "
+              f"| startup {r['startup_ms']:7.1f} ms | peak traced {r['peak_traced_mb']:5.1f} MB "
+              f"| maxrss {r['maxrss_mb']:6.1f} MB")
+    if diffs:
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
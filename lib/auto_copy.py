@@ -0,0 +1,175 @@
+# lib/auto_copy.py
+# Auto copy-mode fast path: signal -> order without the review card.
+#
+# main.set_copy_mode stores user_settings.copy_mode; followers with "auto" and an
+# account (user_settings.default_account_id, else their first active account) get their
+# signal + order created by rpc_auto_copy_orders (sql/005_rpc_auto_copy_orders.sql) in
+# one call per message, and a confirmation instead of a review card. Everyone else, and
+# any auto follower whose order fails, keeps the review flow.
+#
+# Lot sizes come from lib/sizing.py for all auto followers at once; a follower whose
+# risk settings give less than the broker minimum gets the review card instead.
+#
+# Signal-to-order latency (Telegram post time -> order committed) is recorded per
+# follower.
+import os
+import time
+from collections import deque
+from dataclasses import dataclass, asdict
+from typing import Callable, Deque, Dict, Iterable, List, Optional, Tuple
+
+try:
+    from lib.sizing import SizingEngine
+except ImportError:  # running from lib/ (tele_agent.py)
+    from sizing import SizingEngine
+
+# ---------- ENV ----------
+AUTO_COPY_ENABLED = os.getenv("AUTO_COPY", "1") not in ("0", "false", "no")
+FOLLOWER_PROFILE_TTL_SECS = float(os.getenv("FOLLOWER_PROFILE_TTL_SECS", "60"))
+
+REQUIRED = ("symbol", "action", "entry_min")
+SETTINGS_COLS = "user_id,copy_mode,default_account_id,sizing_mode,fixed_lots,risk_pct,max_symbol_lots"
+ACCOUNT_COLS = "id,user_id,broker,balance"
+
+
+@dataclass
+class FollowerProfile:
+    copy_mode: str = "pending"
+    account_id: Optional[str] = None
+    sizing: Optional[dict] = None   # lib/sizing.py follower row (settings + account balance/broker)
+
+    @property
+    def auto(self) -> bool:
+        return self.copy_mode == "auto" and self.account_id is not None
+
+
+class FollowerProfiles:
+    """copy_mode + account per follower, two batched queries per miss set, cached for a TTL."""
+
+    def __init__(self, fetch_settings: Callable[[List[str]], Iterable[dict]],
+                 fetch_accounts: Callable[[List[str]], Iterable[dict]], ttl_secs: float = None):
+        self.fetch_settings = fetch_settings   # user_ids -> user_settings rows (SETTINGS_COLS)
+        self.fetch_accounts = fetch_accounts   # user_ids -> active accounts rows (ACCOUNT_COLS)
+        self.ttl_secs = FOLLOWER_PROFILE_TTL_SECS if ttl_secs is None else ttl_secs
+        self._cache: Dict[str, Tuple[float, FollowerProfile]] = {}
+
+    def get_many(self, user_ids: Iterable[str]) -> Dict[str, FollowerProfile]:
+        now = time.monotonic()
+        out, missing = {}, []
+        for uid in set(user_ids):
+            hit = self._cache.get(uid)
+            if hit and now - hit[0] < self.ttl_secs:
+                out[uid] = hit[1]
+            else:
+                missing.append(uid)
+        if not missing:
+            return out
+        try:
+            settings = {r["user_id"]: r for r in (self.fetch_settings(missing) or [])}
+            auto = [uid for uid in missing if (settings.get(uid) or {}).get("copy_mode") == "auto"]
+            accounts: Dict[str, List[dict]] = {}
+            if auto:
+                for a in self.fetch_accounts(auto) or []:
+                    accounts.setdefault(a["user_id"], []).append(a)
+        except Exception as e:
+            print("[WARN] follower profiles load failed; review cards for everyone:", repr(e))
+            return {uid: out.get(uid, FollowerProfile()) for uid in set(user_ids)}
+        for uid in missing:
+            s = settings.get(uid) or {}
+            active = accounts.get(uid) or []
+            account_id = s.get("default_account_id") or (active[0]["id"] if active else None)
+            account = next((a for a in active if a["id"] == account_id), {})
+            prof = FollowerProfile(s.get("copy_mode") or "pending", account_id,
+                                   {**s, "user_id": uid, "balance": account.get("balance"),
+                                    "broker": account.get("broker")})
+            self._cache[uid] = (now, prof)
+            out[uid] = prof
+        return out
+
+    def invalidate(self, user_id: Optional[str] = None):
+        if user_id is None:
+            self._cache.clear()
+        else:
+            self._cache.pop(user_id, None)
+
+
+@dataclass
+class AutoCopyStats:
+    batches: int = 0
+    orders: int = 0
+    failed: int = 0
+    skipped_invalid: int = 0   # parsed signal lacks symbol/side/entry
+    skipped_size: int = 0      # sized to 0 lots (risk below broker minimum)
+
+
+@dataclass
+class AutoOrder:
+    user_id: str
+    uim_id: int
+    ok: bool
+    signal_id: Optional[str] = None
+    order_id: Optional[str] = None
+    error: Optional[str] = None
+    latency_ms: Optional[float] = None   # Telegram post -> order committed
+
+
+class AutoCopy:
+    def __init__(self, sb):
+        self.sb = sb
+        self.sizing = SizingEngine()
+        self.stats = AutoCopyStats()
+        self.latency: Deque[float] = deque(maxlen=1000)   # seconds, per follower order
+
+    @staticmethod
+    def valid(parsed: dict) -> bool:
+        return all(parsed.get(k) for k in REQUIRED)
+
+    def place(self, source_id, parsed: dict, followers: List[Tuple[str, int, FollowerProfile]],
+              sent_at: float) -> Dict[str, AutoOrder]:
+        """followers: (user_id, uim_id, profile). Sizes them in one pass, orders them in one RPC."""
+        if not followers:
+            return {}
+        if not self.valid(parsed):
+            self.stats.skipped_invalid += len(followers)
+            return {}
+        sizes = self.sizing.size(parsed, [prof.sizing or {"user_id": uid} for uid, _, prof in followers])
+        too_small = [uid for uid, _, _ in followers if sizes.get(uid, 0) <= 0]
+        if too_small:
+            self.stats.skipped_size += len(too_small)
+            print(f"[INFO] auto copy: size below broker minimum for {len(too_small)} follower(s); review cards instead")
+        followers = [f for f in followers if sizes.get(f[0], 0) > 0]
+        if not followers:
+            return {}
+        self.stats.batches += 1
+        rows = self.sb.rpc("rpc_auto_copy_orders", {
+            "p_group_source_id": source_id,
+            "p_parsed": parsed,
+            "p_orders": [{"user_id": uid, "account_id": prof.account_id, "uim_id": uim_id, "size": sizes[uid]}
+                         for uid, uim_id, prof in followers],
+        }).execute().data or []
+        out = {}
+        for r in rows:
+            res = AutoOrder(r["user_id"], r["uim_id"], bool(r.get("ok")), r.get("signal_id"), error=r.get("error"))
+            if res.ok:
+                order = r.get("order")
+                res.order_id = order.get("id") if isinstance(order, dict) else order
+                lag = max(0.0, (r.get("created_at") or time.time()) - sent_at)
+                res.latency_ms = round(lag * 1000, 1)
+                self.latency.append(lag)
+                self.stats.orders += 1
+            else:
+                self.stats.failed += 1
+                print(f"[ERROR] auto copy for user={res.user_id} failed:", res.error)
+            out[res.user_id] = res
+        return out
+
+    def snapshot(self) -> dict:
+        snap = asdict(self.stats)
+        snap["sizing"] = self.sizing.snapshot()
+        if self.latency:
+            ordered = sorted(self.latency)
+            pick = lambda p: round(ordered[min(len(ordered) - 1, int(p * (len(ordered) - 1)))] * 1000, 1)
+            snap["signal_to_order"] = {"p50_ms": pick(0.5), "p99_ms": pick(0.99), "max_ms": pick(1.0)}
+        else:
+            snap["signal_to_order"] = {"p50_ms": None, "p99_ms": None, "max_ms": None}
+        return snap
@@ -0,0 +1,261 @@
+# lib/entity_cache.py
+# Persistent Telethon entity cache (id -> access hash, username, phone, name) per
+# session, next to the StringSession kept in user_sessions.session_string.
+#
+# StringSession only stores the auth key, so after every restart each client starts
+# with no entities: the self user is fetched again and every chat/user has to be
+# resolved through API calls (get_dialogs and friends) before it can be used, which
+# for accounts in many groups is slow and invites FloodWaits.
+#
+# CachedStringSession preloads the rows saved for its telegram_user_id from a local
+# SQLite file (shared by every session and shard on the box, WAL), records new or
+# changed entities as Telethon processes them and hands them over in batches
+# (ENTITY_CACHE_BATCH rows or ENTITY_CACHE_FLUSH_SECS, whichever comes first, and on
+# disconnect). Id lookups go through a dict instead of MemorySession's scan.
+# SQLite writes happen on one writer thread, never on the event loop; whatever is still
+# queued at exit is written by an atexit hook.
+#
+# ENTITY_CACHE_PATH defaults to /data/entity_cache.sqlite, the Dockerfile's /data
+# volume, so the cache survives container rebuilds. Outside Docker point it at a
+# writable path (e.g. .cache/entity_cache.sqlite); if it can't be opened the cache is
+# disabled with a warning and sessions behave like plain StringSessions.
+import os
+import time
+import atexit
+import sqlite3
+import threading
+from collections import deque
+from dataclasses import dataclass, asdict
+from typing import Deque, Dict, List, Optional, Tuple
+
+from telethon import utils
+from telethon.sessions import StringSession
+from telethon.tl.types import PeerChannel, PeerChat, PeerUser
+
+# ---------- ENV ----------
+ENTITY_CACHE_ENABLED = os.getenv("ENTITY_CACHE", "1") not in ("0", "false", "no")
+ENTITY_CACHE_PATH = os.getenv("ENTITY_CACHE_PATH", "/data/entity_cache.sqlite")
+ENTITY_CACHE_BATCH = int(os.getenv("ENTITY_CACHE_BATCH", "200"))
+ENTITY_CACHE_FLUSH_SECS = float(os.getenv("ENTITY_CACHE_FLUSH_SECS", "30"))
+
+Row = Tuple[int, int, Optional[str], Optional[str], Optional[str]]   # MemorySession entity row
+
+
+@dataclass
+class EntityCacheStats:
+    sessions_loaded: int = 0
+    rows_loaded: int = 0
+    rows_written: int = 0
+    flushes: int = 0
+    errors: int = 0
+    load_ms: float = 0.0
+    flush_ms: float = 0.0
+
+
+class EntityStore:
+    def __init__(self, path: str = None):
+        path = path or ENTITY_CACHE_PATH
+        d = os.path.dirname(path)
+        if d:
+            os.makedirs(d, exist_ok=True)
+        self._db = sqlite3.connect(path, check_same_thread=False, isolation_level=None, timeout=10)
+        self._db.execute("PRAGMA journal_mode=WAL")
+        self._db.execute("PRAGMA synchronous=NORMAL")
+        self._db.execute(
+            "CREATE TABLE IF NOT EXISTS entities ("
+            " tg_user_id INTEGER NOT NULL, id INTEGER NOT NULL, hash INTEGER NOT NULL,"
+            " username TEXT, phone TEXT, name TEXT, updated_at REAL NOT NULL,"
+            " PRIMARY KEY (tg_user_id, id)) WITHOUT ROWID"
+        )
+        self._lock = threading.Lock()         # the connection; held across a whole write pass
+        self._wake = threading.Condition()    # guards _pending
+        self._pending: Dict[int, Dict[int, Row]] = {}
+        self._writer: Optional[threading.Thread] = None
+        self.stats = EntityCacheStats()
+
+    def load(self, tg_user_id: int) -> List[Row]:
+        t0 = time.perf_counter()
+        with self._lock:
+            rows = self._db.execute(
+                "SELECT id, hash, username, phone, name FROM entities WHERE tg_user_id = ?", (tg_user_id,)
+            ).fetchall()
+        self.stats.sessions_loaded += 1
+        self.stats.rows_loaded += len(rows)
+        self.stats.load_ms += (time.perf_counter() - t0) * 1000
+        return [tuple(r) for r in rows]
+
+    def save(self, tg_user_id: int, rows: List[Row]):
+        """Write now, in the calling thread (blocks up to the busy timeout)."""
+        with self._lock:
+            self._write(tg_user_id, rows)
+
+    def save_later(self, tg_user_id: int, rows: List[Row]):
+        """Queue rows for the writer thread; never touches SQLite."""
+        if not rows:
+            return
+        with self._wake:
+            self._pending.setdefault(tg_user_id, {}).update((r[0], r) for r in rows)
+            if self._writer is None:
+                self._writer = threading.Thread(target=self._write_loop, name="entity-cache-writer", daemon=True)
+                self._writer.start()
+            self._wake.notify()
+
+    def write_pending(self) -> bool:
+        """Write everything queued so far; False if a batch failed (it stays queued)."""
+        ok = True
+        with self._lock:   # one pass at a time, so an older batch never lands after a newer one
+            with self._wake:
+                batch, self._pending = self._pending, {}
+            for tg_user_id, rows in batch.items():
+                try:
+                    self._write(tg_user_id, list(rows.values()))
+                except Exception as e:
+                    ok = False
+                    self.stats.errors += 1
+                    print(f"[WARN] entity cache flush failed for tg_user={tg_user_id}:", repr(e))
+                    with self._wake:   # retry with the next pass; rows queued since are newer
+                        self._pending[tg_user_id] = {**rows, **self._pending.get(tg_user_id, {})}
+        return ok
+
+    def _write_loop(self):
+        while True:
+            with self._wake:
+                while not self._pending:
+                    self._wake.wait()
+            if not self.write_pending():
+                time.sleep(1.0)   # database locked/unwritable: don't spin
+
+    def _write(self, tg_user_id: int, rows: List[Row]):
+        if not rows:
+            return
+        t0 = time.perf_counter()
+        now = time.time()
+        self._db.execute("BEGIN")
+        try:
+            self._db.executemany(
+                "INSERT OR REPLACE INTO entities(tg_user_id, id, hash, username, phone, name, updated_at)"
+                " VALUES (?, ?, ?, ?, ?, ?, ?)",
+                [(tg_user_id, *r, now) for r in rows],
+            )
+            self._db.execute("COMMIT")
+        except Exception:
+            self._db.execute("ROLLBACK")
+            raise
+        self.stats.flushes += 1
+        self.stats.rows_written += len(rows)
+        self.stats.flush_ms += (time.perf_counter() - t0) * 1000
+
+    def snapshot(self) -> dict:
+        snap = asdict(self.stats)
+        snap["load_ms"] = round(self.stats.load_ms, 1)
+        snap["flush_ms"] = round(self.stats.flush_ms, 1)
+        snap["pending_rows"] = sum(len(rows) for rows in list(self._pending.values()))
+        return snap
+
+
+class CachedStringSession(StringSession):
+    def __init__(self, string: str, tg_user_id: int, store: Optional[EntityStore]):
+        super().__init__(string)
+        self.tg_user_id = tg_user_id
+        self.store = store
+        self._by_id: Dict[int, Row] = {}
+        self._dirty: Dict[int, Row] = {}
+        self._flushed_at = time.monotonic()
+        self.preloaded = 0
+        if store is not None:
+            try:
+                rows = store.load(tg_user_id)
+            except Exception as e:
+                store.stats.errors += 1
+                print(f"[WARN] entity cache load failed for tg_user={tg_user_id}:", repr(e))
+                rows = []
+            self._entities = set(rows)
+            self._by_id = {r[0]: r for r in rows}
+            self.preloaded = len(rows)
+
+    @property
+    def warm(self) -> bool:
+        return self.preloaded > 0
+
+    def process_entities(self, tlo):
+        rows = self._entities_to_rows(tlo)
+        for row in rows:
+            old = self._by_id.get(row[0])
+            if old == row:
+                continue
+            if old is not None:
+                self._entities.discard(old)   # same id, new hash/username/name: keep one row
+            self._entities.add(row)
+            self._by_id[row[0]] = row
+            self._dirty[row[0]] = row
+        if self._dirty and (len(self._dirty) >= ENTITY_CACHE_BATCH
+                            or time.monotonic() - self._flushed_at >= ENTITY_CACHE_FLUSH_SECS):
+            self.flush()
+
+    def get_entity_rows_by_id(self, id, exact=True):
+        if exact:
+            row = self._by_id.get(id)
+            return (row[0], row[1]) if row else None
+        for peer in (PeerUser(id), PeerChat(id), PeerChannel(id)):
+            row = self._by_id.get(utils.get_peer_id(peer))
+            if row:
+                return row[0], row[1]
+        return None
+
+    def flush(self):
+        """Hand the changed rows to the store's writer thread (called on the event loop)."""
+        self._flushed_at = time.monotonic()
+        if self.store is None or not self._dirty:
+            return
+        rows, self._dirty = list(self._dirty.values()), {}
+        self.store.save_later(self.tg_user_id, rows)
+
+    def close(self):
+        self.flush()
+        super().close()
+
+
+class StartupTimes:
+    """Session startup (connect + authorize + whitelisted chats resolvable), cold vs warm cache."""
+
+    def __init__(self):
+        self.samples: Dict[str, Deque[float]] = {"cold": deque(maxlen=1000), "warm": deque(maxlen=1000)}
+        self.dialog_fetches = {"cold": 0, "warm": 0}
+
+    def record(self, warm: bool, ms: float, fetched_dialogs: bool):
+        kind = "warm" if warm else "cold"
+        self.samples[kind].append(ms)
+        self.dialog_fetches[kind] += int(fetched_dialogs)
+
+    def snapshot(self) -> dict:
+        snap = {}
+        for kind, samples in self.samples.items():
+            ordered = sorted(samples)
+            snap[kind] = {
+                "sessions": len(ordered),
+                "avg_ms": round(sum(ordered) / len(ordered), 1) if ordered else None,
+                "p50_ms": round(ordered[len(ordered) // 2], 1) if ordered else None,
+                "dialog_fetches": self.dialog_fetches[kind],
+            }
+        cold, warm = snap["cold"]["avg_ms"], snap["warm"]["avg_ms"]
+        snap["warm_speedup"] = round(cold / warm, 2) if cold and warm else None
+        return snap
+
+
+_store: Optional[EntityStore] = None
+_store_failed = False
+_store_lock = threading.Lock()   # sessions open concurrently, each in a worker thread
+
+
+def get_store() -> Optional[EntityStore]:
+    """Process-wide store, or None when disabled/unavailable (plain StringSession behaviour)."""
+    global _store, _store_failed
+    with _store_lock:
+        if _store is None and ENTITY_CACHE_ENABLED and ENTITY_CACHE_PATH and not _store_failed:
+            try:
+                _store = EntityStore()
+                atexit.register(_store.write_pending)
+            except Exception as e:
+                _store_failed = True
+                print(f"[WARN] entity cache disabled ({ENTITY_CACHE_PATH}):", e)
+    return _store
@@ -0,0 +1,84 @@
+# lib/fake_openrouter.py
+# Local stand-in for the OpenRouter chat/completions endpoint with injectable delays and failures.
+# Point the agent at it with OPENROUTER_URL=http://127.0.0.1:<port>/api/v1/chat/completions
+#
+#   python lib/fake_openrouter.py --port 8099 --delay 0.2 --slow-rate 0.1 --slow-delay 10 --fail-rate 0.05
+import sys
+import json
+import random
+import asyncio
+import argparse
+
+from aiohttp import web
+
+_REPLY = {
+    "symbol": None, "side": None, "entry": None, "targets": [], "stop": None,
+    "timeframe": None, "confidence": 0.5, "issues": ["fake_openrouter"],
+}
+
+
+class FakeOpenRouter:
+    def __init__(self, host: str = "127.0.0.1", port: int = 0, delay: float = 0.0,
+                 slow_rate: float = 0.0, slow_delay: float = 5.0, fail_rate: float = 0.0):
+        self.host, self.port = host, port
+        self.requests = 0
+        self._runner = None
+        self.configure(delay=delay, slow_rate=slow_rate, slow_delay=slow_delay, fail_rate=fail_rate)
+
+    def configure(self, delay: float = None, slow_rate: float = None,
+                  slow_delay: float = None, fail_rate: float = None):
+        """Change behaviour on the fly; unspecified knobs keep their value."""
+        if delay is not None: self.delay = delay
+        if slow_rate is not None: self.slow_rate = slow_rate
+        if slow_delay is not None: self.slow_delay = slow_delay
+        if fail_rate is not None: self.fail_rate = fail_rate
+
+    async def _handle(self, request: web.Request) -> web.Response:
+        self.requests += 1
+        body = await request.json()
+        await asyncio.sleep(self.slow_delay if random.random() < self.slow_rate else self.delay)
+        if random.random() < self.fail_rate:
+            return web.json_response({"error": "injected failure"}, status=503)
+        user = next((m["content"] for m in body.get("messages", []) if m.get("role") == "user"), "")
+        content = dict(_REPLY, raw_text=user.split("\n\nReturn only")[0])
+        return web.json_response({"choices": [{"message": {"content": json.dumps(content)}}]})
+
+    async def start(self) -> str:
+        app = web.Application()
+        app.router.add_post("/api/v1/chat/completions", self._handle)
+        self._runner = web.AppRunner(app)
+        await self._runner.setup()
+        site = web.TCPSite(self._runner, self.host, self.port)
+        await site.start()
+        self.port = site._server.sockets[0].getsockname()[1]
+        return f"http://{self.host}:{self.port}/api/v1/chat/completions"
+
+    async def stop(self):
+        if self._runner:
+            await self._runner.cleanup()
+            self._runner = None
+
+
+async def _serve(args):
+    fake = FakeOpenRouter(port=args.port, delay=args.delay, slow_rate=args.slow_rate,
+                          slow_delay=args.slow_delay, fail_rate=args.fail_rate)
+    url = await fake.start()
+    print(f"Fake OpenRouter listening on {url}")
+    await asyncio.Event().wait()
+
+
+def main():
+    ap = argparse.ArgumentParser(description="Fake OpenRouter with injected latency/failures")
+    ap.add_argument("--port", type=int, default=8099)
+    ap.add_argument("--delay", type=float, default=0.2, help="normal response delay (s)")
+    ap.add_argument("--slow-rate", type=float, default=0.0, help="fraction of requests that are slow")
+    ap.add_argument("--slow-delay", type=float, default=10.0, help="delay for slow requests (s)")
+    ap.add_argument("--fail-rate", type=float, default=0.0, help="fraction of requests answered with 503")
+    try:
+        asyncio.run(_serve(ap.parse_args(sys.argv[1:])))
+    except KeyboardInterrupt:
+        pass
+
+
+if __name__ == "__main__":
+    main()
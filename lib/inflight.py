@@ -0,0 +1,88 @@
+# lib/inflight.py
+# Process-wide single-flight + short-term memo for per-message work.
+#
+# When several owners' sessions sit in the same channel every TelegramClient gets the
+# same post. The first caller for a key runs the work; callers arriving while it is in
+# flight await the same future, and callers within INFLIGHT_TTL_SECS afterwards reuse
+# the finished result. Failures are not memoized: the entry is dropped so the next
+# caller retries.
+import os
+import copy
+import time
+import asyncio
+from collections import OrderedDict
+from dataclasses import dataclass, asdict
+from typing import Any, Awaitable, Callable, Hashable, Tuple
+
+# ---------- ENV ----------
+INFLIGHT_TTL_SECS = float(os.getenv("INFLIGHT_TTL_SECS", "300"))
+INFLIGHT_MAX = int(os.getenv("INFLIGHT_MAX", "5000"))
+
+
+@dataclass
+class InflightStats:
+    leaders: int = 0     # calls that did the work
+    joined: int = 0      # awaited a call still in flight
+    reused: int = 0      # got a finished result from the memo
+    failed: int = 0
+    expired: int = 0
+    evicted: int = 0     # dropped early to stay within max_entries
+
+
+class InflightMap:
+    def __init__(self, ttl_secs: float = None, max_entries: int = None):
+        self.ttl_secs = INFLIGHT_TTL_SECS if ttl_secs is None else ttl_secs
+        self.max_entries = max_entries or INFLIGHT_MAX
+        # key -> (created_at, future); insertion order == age order, so expiry pops the front
+        self._entries: "OrderedDict[Hashable, Tuple[float, asyncio.Future]]" = OrderedDict()
+        self.stats = InflightStats()
+
+    def __len__(self) -> int:
+        return len(self._entries)
+
+    def _sweep(self, now: float):
+        while self._entries:
+            key, (created, fut) = next(iter(self._entries.items()))
+            if now - created < self.ttl_secs:
+                break
+            self._entries.popitem(last=False)
+            self.stats.expired += 1
+        while len(self._entries) >= self.max_entries:
+            self._entries.popitem(last=False)
+            self.stats.evicted += 1
+
+    async def run(self, key: Hashable, work: Callable[[], Awaitable[Any]]) -> Any:
+        """Result of work() for key, computed at most once per TTL across all callers."""
+        now = time.monotonic()
+        self._sweep(now)
+        entry = self._entries.get(key)
+        if entry is not None:
+            fut = entry[1]
+            if fut.done():
+                self.stats.reused += 1
+            else:
+                self.stats.joined += 1
+            # shield: a cancelled follower must not cancel the leader's work;
+            # deep copy: callers may annotate their result without affecting the others
+            return copy.deepcopy(await asyncio.shield(fut))
+
+        fut = asyncio.get_running_loop().create_future()
+        self._entries[key] = (now, fut)
+        self.stats.leaders += 1
+        try:
+            result = await work()
+        except BaseException as e:
+            self.stats.failed += 1
+            if self._entries.get(key, (None, None))[1] is fut:
+                del self._entries[key]
+            fut.set_exception(e)
+            fut.exception()  # mark retrieved when nobody joined
+            raise
+        fut.set_result(result)
+        return copy.deepcopy(result)
+
+    def snapshot(self) -> dict:
+        snap = asdict(self.stats)
+        snap["size"] = len(self._entries)
+        snap["inflight"] = sum(1 for _, f in self._entries.values() if not f.done())
+        return snap
@@ -0,0 +1,169 @@
+# lib/ingest_db.py
+# Persistence for one parsed signal: inbound_messages row, follower inbox rows
+# (user_inbound_messages) for every active route, extra_sources for collapsed duplicates.
+#
+#   rpc     one call to rpc_ingest_signal (sql/004_rpc_ingest_signal.sql), one transaction
+#   legacy  the original PostgREST sequence: inbound upsert + re-select, copy_routes
+#           select, one upsert (sometimes + select) per follower -> 3 + 2N round trips
+#
+# INGEST_DB_MODE=rpc falls back to legacy (once, with a warning) when the function has
+# not been deployed yet.
+import os
+import time
+from dataclasses import dataclass, asdict, field
+from typing import Callable, Dict, List, Optional
+
+# ---------- ENV ----------
+INGEST_DB_MODE = os.getenv("INGEST_DB_MODE", "rpc").lower()   # rpc | legacy
+
+
+@dataclass
+class RouteRow:
+    follower_user_id: str
+    target_chat_id: str
+    uim_id: Optional[int]
+    collapsed: bool = False   # attached to the follower's existing card, no new row
+
+
+@dataclass
+class IngestResult:
+    inbound_id: int
+    routes: List[RouteRow] = field(default_factory=list)
+
+
+@dataclass
+class IngestDbStats:
+    signals: int = 0
+    round_trips: int = 0
+    failed: int = 0
+    rpc_fallbacks: int = 0
+    total_ms: float = 0.0
+
+
+class IngestDB:
+    def __init__(self, sb, mode: str = None):
+        self.sb = sb
+        self.mode = (mode or INGEST_DB_MODE).lower()
+        if self.mode not in ("rpc", "legacy"):
+            print(f"[WARN] Unknown INGEST_DB_MODE={self.mode!r}; using legacy")
+            self.mode = "legacy"
+        self.stats = IngestDbStats()
+
+    def _exec(self, query):
+        self.stats.round_trips += 1
+        return query.execute()
+
+    # ---- legacy steps ----
+    def upsert_inbound(self, payload: dict) -> Optional[int]:
+        self._exec(self.sb.table("inbound_messages").upsert(payload, on_conflict="source_id,message_id"))
+        inbound = self._exec(self.sb.table("inbound_messages")
+                             .select("id")
+                             .eq("source_id", payload["source_id"])
+                             .eq("message_id", payload["message_id"])
+                             .maybe_single()).data
+        if not inbound or "id" not in inbound:
+            return None
+        return inbound["id"]
+
+    def upsert_uim(self, follower_id: str, inbound_id: int) -> Optional[int]:
+        res = self._exec(self.sb.table("user_inbound_messages").upsert(
+            {"user_id": follower_id, "inbound_message_id": inbound_id, "status": "pending"},
+            on_conflict="user_id,inbound_message_id",
+            returning="representation",
+        ))
+        if res.data and "id" in res.data[0]:
+            return res.data[0]["id"]
+        # fallback to a select if representation wasn't returned
+        row = self._exec(self.sb.table("user_inbound_messages")
+                         .select("id")
+                         .eq("user_id", follower_id)
+                         .eq("inbound_message_id", inbound_id)
+                         .maybe_single()).data
+        return row["id"] if row and "id" in row else None
+
+    def active_routes(self, source_id) -> List[dict]:
+        return self._exec(self.sb.table("copy_routes")
+                          .select("*")
+                          .eq("source_id", source_id)
+                          .eq("active", True)).data or []
+
+    def ingest_legacy(self, payload: dict, collapse: Dict[str, Optional[int]], extra_source: Optional[dict],
+                      routes: Callable[[], List[dict]] = None) -> IngestResult:
+        inbound_id = self.upsert_inbound(payload)
+        if inbound_id is None:
+            raise RuntimeError("inbound_messages row not found after upsert")
+        result = IngestResult(inbound_id)
+        for r in (routes() if routes else self.active_routes(payload["source_id"])):
+            follower_id, target = r["follower_user_id"], r["target_chat_id"]
+            if follower_id in collapse:
+                if extra_source is not None and collapse[follower_id] is not None:
+                    self._exec(self.sb.rpc("rpc_uim_add_extra_source", {
+                        "p_uim_id": collapse[follower_id],
+                        "p_source": dict(extra_source, inbound_message_id=inbound_id),
+                    }))
+                result.routes.append(RouteRow(follower_id, target, collapse[follower_id], True))
+                continue
+            try:
+                uim_id = self.upsert_uim(follower_id, inbound_id)
+            except Exception as e:
+                print(f"[ERROR] Route fanout failed for user={follower_id}:", repr(e))
+                uim_id = None
+            if uim_id is None:
+                print(f"[ERROR] No uim row for user={follower_id}")
+            result.routes.append(RouteRow(follower_id, target, uim_id))
+        return result
+
+    # ---- single RPC ----
+    def ingest_rpc(self, payload: dict, collapse: Dict[str, Optional[int]], extra_source: Optional[dict]) -> IngestResult:
+        data = self._exec(self.sb.rpc("rpc_ingest_signal", {
+            "p_source_id": payload["source_id"],
+            "p_message_id": payload["message_id"],
+            "p_message_ts": payload["message_ts"],
+            "p_raw_text": payload["raw_text"],
+            "p_normalized": payload["normalized_json"],
+            "p_parsed": payload["parsed_json"],
+            "p_collapse": {str(k): v for k, v in collapse.items()},
+            "p_extra_source": extra_source,
+        })).data
+        return IngestResult(data["inbound_id"], [
+            RouteRow(r["follower_user_id"], r["target_chat_id"], r["uim_id"], bool(r["collapsed"]))
+            for r in data.get("routes") or []
+        ])
+
+    def ingest(self, payload: dict, collapse: Dict[str, Optional[int]] = None, extra_source: Optional[dict] = None,
+               routes: Callable[[], List[dict]] = None) -> IngestResult:
+        """
+        Persist a signal and its follower rows. collapse maps follower_user_id -> uim id
+        of an existing card for the same trade (None: create nothing for that follower
+        yet); routes (legacy only) supplies the active copy_routes, e.g. from the route
+        cache, instead of querying them.
+        """
+        collapse = collapse or {}
+        t0 = time.perf_counter()
+        try:
+            if self.mode == "rpc":
+                try:
+                    return self.ingest_rpc(payload, collapse, extra_source)
+                except Exception as e:
+                    if "PGRST202" not in str(e) and "Could not find the function" not in str(e):
+                        raise
+                    print("[WARN] rpc_ingest_signal unavailable (apply sql/004_rpc_ingest_signal.sql); "
+                          "using the legacy path:", repr(e))
+                    self.mode = "legacy"
+                    self.stats.rpc_fallbacks += 1
+            return self.ingest_legacy(payload, collapse, extra_source, routes)
+        except Exception:
+            self.stats.failed += 1
+            raise
+        finally:
+            self.stats.signals += 1
+            self.stats.total_ms += (time.perf_counter() - t0) * 1000
+
+    def snapshot(self) -> dict:
+        snap = asdict(self.stats)
+        snap["mode"] = self.mode
+        snap["total_ms"] = round(self.stats.total_ms, 1)
+        n = self.stats.signals
+        snap["avg_ms"] = round(self.stats.total_ms / n, 2) if n else None
+        snap["avg_round_trips"] = round(self.stats.round_trips / n, 2) if n else None
+        return snap
@@ -0,0 +1,155 @@
+# lib/ingest_queue.py
+# Bounded hand-off between the Telethon handlers and the ingest pipeline.
+#
+# Handlers only build a MessageRecord and put() it; INGEST_WORKERS pipeline workers
+# drain the queue (whitelist, source lookup, parse/LLM, DB writes, fan-out). When the
+# queue is full the overload policy decides what gives:
+#   block        the handler waits for space (nothing is lost, updates back up; default)
+#   drop_oldest  evict the oldest queued record
+# There is nothing cheaper to shed first: WhitelistedNewMessage drops non-whitelisted
+# chats before a record is ever built, so every queued record is a candidate signal.
+import os
+import time
+import asyncio
+from collections import deque
+from dataclasses import dataclass, asdict, field
+from typing import Any, Awaitable, Callable, Deque
+
+# ---------- ENV ----------
+INGEST_QUEUE_SIZE = int(os.getenv("INGEST_QUEUE_SIZE", "1000"))
+INGEST_WORKERS = int(os.getenv("INGEST_WORKERS", "4"))
+INGEST_OVERLOAD = os.getenv("INGEST_OVERLOAD", "block").lower()
+
+POLICIES = ("block", "drop_oldest")
+
+
+@dataclass
+class MessageRecord:
+    ctx: Any                 # tele_agent.SessionCtx of the receiving account
+    chat_id: int
+    message_id: int
+    text: str
+    message_ts: str          # ISO timestamp from Telegram
+    sent_at: float           # epoch seconds from Telegram (for end-to-end lag)
+    received_at: float = field(default_factory=time.monotonic)
+
+
+@dataclass
+class QueueStats:
+    enqueued: int = 0
+    processed: int = 0
+    failed: int = 0
+    dropped_oldest: int = 0
+    blocked: int = 0         # put() calls that had to wait for space
+    max_depth: int = 0
+
+
+class _Window:
+    """Recent samples (seconds) for percentile reporting."""
+
+    def __init__(self, size: int = 1000):
+        self.samples: Deque[float] = deque(maxlen=size)
+
+    def add(self, secs: float):
+        self.samples.append(secs)
+
+    def summary(self) -> dict:
+        if not self.samples:
+            return {"p50_ms": None, "p95_ms": None, "max_ms": None}
+        ordered = sorted(self.samples)
+        pick = lambda p: round(ordered[min(len(ordered) - 1, int(p * (len(ordered) - 1)))] * 1000, 1)
+        return {"p50_ms": pick(0.5), "p95_ms": pick(0.95), "max_ms": round(ordered[-1] * 1000, 1)}
+
+
+class IngestQueue:
+    def __init__(self, maxsize: int = None, policy: str = None):
+        self.maxsize = maxsize or INGEST_QUEUE_SIZE
+        self.policy = policy or INGEST_OVERLOAD
+        if self.policy not in POLICIES:
+            print(f"[WARN] Unknown INGEST_OVERLOAD={self.policy!r}; using block")
+            self.policy = "block"
+        self._items: Deque[MessageRecord] = deque()
+        lock = asyncio.Lock()
+        self._not_empty = asyncio.Condition(lock)
+        self._not_full = asyncio.Condition(lock)
+        self.stats = QueueStats()
+        self.busy = 0
+        self.tasks = []          # worker tasks (kept referenced so they are not collected)
+        self.wait = _Window()    # enqueue -> picked up by a worker
+        self.lag = _Window()     # Telegram send time -> picked up by a worker
+
+    def __len__(self) -> int:
+        return len(self._items)
+
+    def _evict(self) -> bool:
+        """Make room under the policy: True = room made, False = wait for a worker."""
+        if self.policy == "drop_oldest":
+            self._items.popleft()
+            self.stats.dropped_oldest += 1
+            return True
+        return False
+
+    async def put(self, rec: MessageRecord):
+        """Queue a record; waits for space unless the policy evicts the oldest one."""
+        async with self._not_full:
+            waited = False
+            while len(self._items) >= self.maxsize:
+                if self._evict():
+                    break
+                if not waited:
+                    self.stats.blocked += 1
+                    waited = True
+                await self._not_full.wait()
+            self._items.append(rec)
+            self.stats.enqueued += 1
+            self.stats.max_depth = max(self.stats.max_depth, len(self._items))
+            self._not_empty.notify()
+
+    async def get(self) -> MessageRecord:
+        async with self._not_empty:
+            while not self._items:
+                await self._not_empty.wait()
+            rec = self._items.popleft()
+            self._not_full.notify()
+        self.wait.add(time.monotonic() - rec.received_at)
+        self.lag.add(max(0.0, time.time() - rec.sent_at))
+        return rec
+
+    async def worker(self, process: Callable[[MessageRecord], Awaitable[None]]):
+        """Drain the queue forever; one failing record never stops the worker."""
+        while True:
+            rec = await self.get()
+            self.busy += 1
+            try:
+                await process(rec)
+                self.stats.processed += 1
+            except asyncio.CancelledError as e:
+                if asyncio.current_task().cancelling():
+                    raise   # the worker itself is being stopped
+                # a future cancelled under us (e.g. an executor shut down): this record only
+                self.stats.failed += 1
+                print(f"[ERR] ingest worker: chat={rec.chat_id} msg={rec.message_id} cancelled:", repr(e))
+            except Exception as e:
+                self.stats.failed += 1
+                print(f"[ERR] ingest worker failed on chat={rec.chat_id} msg={rec.message_id}:", repr(e))
+            finally:
+                self.busy -= 1
+
+    def start_workers(self, process: Callable[[MessageRecord], Awaitable[None]], n: int = None):
+        n = n or INGEST_WORKERS
+        self.tasks += [asyncio.create_task(self.worker(process)) for _ in range(max(1, n))]
+        return self.tasks
+
+    def snapshot(self) -> dict:
+        snap = {
+            "depth": len(self._items),
+            "capacity": self.maxsize,
+            "policy": self.policy,
+            "busy_workers": self.busy,
+            "oldest_age_ms": round((time.monotonic() - self._items[0].received_at) * 1000, 1)
+            if self._items else 0.0,
+        }
+        snap.update(asdict(self.stats))
+        snap["queue_wait"] = self.wait.summary()
+        snap["receive_lag"] = self.lag.summary()
+        return snap
@@ -0,0 +1,216 @@
+# lib/invalidation.py
+# Change notifications for the config tables both processes cache.
+#
+# sql/003_invalidation_notify.sql installs row triggers on group_sources, copy_routes,
+# user_settings and accounts that pg_notify() a small JSON payload (table, op, key
+# columns of the new and old row) on INVALIDATION_CHANNEL (fixed in that trigger
+# function, so not an env setting here). PostgresBus LISTENs on it through asyncpg
+# (DATABASE_URL, the direct Postgres connection string, not the REST URL) and hands
+# each change to the callbacks subscribed for that table, which drop or patch just the
+# affected cache entries.
+#
+# MemoryBus dispatches in-process publish() calls only (tests and local runs without
+# DATABASE_URL); it cannot see other processes' writes, so it never reports itself
+# live and callers keep their polling/TTL fallbacks.
+import os
+import json
+import time
+import asyncio
+from dataclasses import dataclass, asdict, field
+from typing import Callable, Dict, List, Optional
+
+# ---------- ENV ----------
+DATABASE_URL = os.getenv("DATABASE_URL", "")
+INVALIDATION_BACKEND = os.getenv("INVALIDATION_BACKEND", "postgres" if DATABASE_URL else "memory").lower()
+INVALIDATION_PING_SECS = float(os.getenv("INVALIDATION_PING_SECS", "30"))
+INVALIDATION_CONNECT_TIMEOUT = float(os.getenv("INVALIDATION_CONNECT_TIMEOUT", "5"))
+
+INVALIDATION_CHANNEL = "cache_invalidation"   # hard-coded in sql/003 tg_notify_invalidation()
+TABLES = ("group_sources", "copy_routes", "user_settings", "accounts")
+
+
+@dataclass
+class Change:
+    table: str
+    op: str                                        # INSERT | UPDATE | DELETE
+    row: dict = field(default_factory=dict)        # key columns after the change (empty on DELETE)
+    old: dict = field(default_factory=dict)        # key columns before it (empty on INSERT)
+    ts: Optional[float] = None                     # epoch seconds at commit (from the trigger)
+
+    def get(self, key: str):
+        """Column from the new row, falling back to the old one (DELETE)."""
+        value = self.row.get(key)
+        return self.old.get(key) if value is None else value
+
+
+@dataclass
+class BusStats:
+    received: int = 0
+    dispatched: int = 0
+    callback_errors: int = 0
+    bad_payloads: int = 0
+    connects: int = 0
+    disconnects: int = 0
+    last_lag_ms: Optional[float] = None
+
+
+class InvalidationBus:
+    """Subscribe callbacks per table; backends feed them Change objects."""
+    kind = "base"
+
+    def __init__(self):
+        self._subs: Dict[str, List[Callable[[Change], None]]] = {}
+        self._on_resync: List[Callable[[], None]] = []
+        self.connected = False
+        self.stats = BusStats()
+
+    @property
+    def live(self) -> bool:
+        """True while changes made by *other* processes are being delivered."""
+        return False
+
+    def subscribe(self, table: str, callback: Callable[[Change], None]):
+        self._subs.setdefault(table, []).append(callback)
+
+    def on_resync(self, callback: Callable[[], None]):
+        """Called after a reconnect: notifications may have been missed, drop everything."""
+        self._on_resync.append(callback)
+
+    def dispatch(self, change: Change):
+        self.stats.received += 1
+        if change.ts:
+            self.stats.last_lag_ms = round(max(0.0, time.time() - change.ts) * 1000, 1)
+        for cb in self._subs.get(change.table, ()):
+            try:
+                cb(change)
+                self.stats.dispatched += 1
+            except Exception as e:
+                self.stats.callback_errors += 1
+                print(f"[ERR] invalidation callback for {change.table} failed:", repr(e))
+
+    def _resync(self):
+        for cb in self._on_resync:
+            try:
+                cb()
+            except Exception as e:
+                self.stats.callback_errors += 1
+                print("[ERR] invalidation resync callback failed:", repr(e))
+
+    async def start(self):
+        pass
+
+    async def close(self):
+        pass
+
+    def snapshot(self) -> dict:
+        snap = asdict(self.stats)
+        snap["backend"] = self.kind
+        snap["live"] = self.live
+        return snap
+
+
+class MemoryBus(InvalidationBus):
+    kind = "memory"
+
+    def __init__(self):
+        super().__init__()
+        self.connected = True
+
+    def publish(self, table: str, op: str, row: dict = None, old: dict = None):
+        self.dispatch(Change(table, op.upper(), dict(row or {}), dict(old or {}), time.time()))
+
+
+class PostgresBus(InvalidationBus):
+    kind = "postgres"
+
+    def __init__(self, dsn: str = None, channel: str = None):
+        super().__init__()
+        self.dsn = dsn or DATABASE_URL
+        self.channel = channel or INVALIDATION_CHANNEL
+        self._task: Optional[asyncio.Task] = None
+        self._ready = asyncio.Event()
+
+    @property
+    def live(self) -> bool:
+        return self.connected
+
+    def _on_notify(self, conn, pid, channel, payload):
+        try:
+            d = json.loads(payload)
+            change = Change(d["table"], d["op"], d.get("row") or {}, d.get("old") or {}, d.get("ts"))
+        except Exception:
+            self.stats.bad_payloads += 1
+            print("[WARN] invalidation: bad payload:", payload[:200])
+            return
+        self.dispatch(change)
+
+    async def _run(self):
+        try:
+            import asyncpg  # optional: only the postgres backend needs it
+        except ImportError:
+            print("[ERR] INVALIDATION_BACKEND=postgres needs asyncpg (pip install asyncpg); polling stays on")
+            self._ready.set()
+            return
+
+        backoff = 1.0
+        while True:
+            conn = None
+            try:
+                conn = await asyncpg.connect(self.dsn, timeout=INVALIDATION_CONNECT_TIMEOUT)
+                await conn.add_listener(self.channel, self._on_notify)
+                self.connected = True
+                self.stats.connects += 1
+                backoff = 1.0
+                if self.stats.connects > 1:
+                    self._resync()
+                self._ready.set()
+                print(f"[INFO] invalidation: listening on {self.channel!r}")
+                while True:
+                    await asyncio.sleep(INVALIDATION_PING_SECS)
+                    await conn.fetchval("select 1")   # notices a dead connection
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                print(f"[WARN] invalidation listener down ({e!r}); retrying in {backoff:.0f}s")
+            finally:
+                if self.connected:
+                    self.stats.disconnects += 1
+                self.connected = False
+                if conn is not None:
+                    try:
+                        await conn.close()
+                    except Exception:
+                        pass
+            self._ready.set()  # don't hold start() up while the database is unreachable
+            await asyncio.sleep(backoff)
+            backoff = min(backoff * 2, 60.0)
+
+    async def start(self):
+        """Start listening; waits for the first connection attempt to finish."""
+        if self._task is None:
+            self._task = asyncio.create_task(self._run())
+            try:
+                await asyncio.wait_for(self._ready.wait(), INVALIDATION_CONNECT_TIMEOUT + 1)
+            except asyncio.TimeoutError:
+                pass
+
+    async def close(self):
+        if self._task is not None:
+            self._task.cancel()
+            self._task = None
+
+
+_bus: Optional[InvalidationBus] = None
+
+
+def get_bus() -> InvalidationBus:
+    """Process-wide bus for INVALIDATION_BACKEND (postgres | memory)."""
+    global _bus
+    if _bus is None:
+        if INVALIDATION_BACKEND == "postgres" and DATABASE_URL:
+            _bus = PostgresBus()
+        else:
+            if INVALIDATION_BACKEND == "postgres":
+                print("[WARN] INVALIDATION_BACKEND=postgres needs DATABASE_URL; using memory (polling stays on)")
+            _bus = MemoryBus()
+    return _bus
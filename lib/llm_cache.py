@@ -0,0 +1,272 @@
+# lib/llm_cache.py
+# Content-addressed cache for LLM normalization output.
+#   L1: bounded in-process LRU (per process)
+#   L2: SQLite file that survives restarts, with TTL and size-based eviction
+# Keyed on the normalized raw text + model + SYSTEM prompt version, so a reposted signal
+# (or the same post seen by several sessions) costs one OpenRouter round trip.
+#
+# From the event loop use aget(): L1 is checked inline, an L1 miss reads L2 in a worker
+# thread. put() never touches SQLite either: L2 writes (and eviction) go through one
+# writer thread; whatever is still queued at exit is written by an atexit hook.
+import os
+import re
+import json
+import time
+import atexit
+import asyncio
+import sqlite3
+import hashlib
+import threading
+from collections import OrderedDict
+from dataclasses import dataclass, asdict
+from typing import Dict, Optional
+
+# ---------- ENV ----------
+LLM_CACHE_ENABLED = os.getenv("LLM_CACHE", "1") not in ("0", "false", "no")
+LLM_CACHE_PATH = os.getenv("LLM_CACHE_PATH", ".cache/llm_cache.sqlite")   # "" -> memory tier only
+LLM_CACHE_TTL_SECS = float(os.getenv("LLM_CACHE_TTL_SECS", str(7 * 24 * 3600)))
+LLM_CACHE_LRU_SIZE = int(os.getenv("LLM_CACHE_LRU_SIZE", "2048"))
+LLM_CACHE_MAX_ROWS = int(os.getenv("LLM_CACHE_MAX_ROWS", "50000"))
+
+_WS = re.compile(r"[ \t\r\f\v]+")
+
+
+def normalize_text(raw_text: str) -> str:
+    """Whitespace/dash-insensitive form of a message, used only for the cache key."""
+    t = raw_text.replace("–", "-").replace("—", "-")
+    lines = (_WS.sub(" ", l).strip() for l in t.splitlines())
+    return "\n".join(l for l in lines if l)
+
+
+def cache_key(raw_text: str, model: str, prompt_version: str) -> str:
+    h = hashlib.sha256()
+    for part in (normalize_text(raw_text), model or "", prompt_version or ""):
+        h.update(part.encode("utf-8"))
+        h.update(b"\x1f")
+    return h.hexdigest()
+
+
+@dataclass
+class CacheStats:
+    l1_hits: int = 0
+    l2_hits: int = 0
+    misses: int = 0
+    writes: int = 0
+    l1_evictions: int = 0
+    l2_evictions: int = 0
+    expired: int = 0
+
+    def hit_rate(self) -> float:
+        total = self.l1_hits + self.l2_hits + self.misses
+        return (self.l1_hits + self.l2_hits) / total if total else 0.0
+
+
+class LRUTier:
+    def __init__(self, max_items: int, ttl_secs: float, stats: CacheStats):
+        self.max_items = max_items
+        self.ttl_secs = ttl_secs
+        self.stats = stats
+        self._items: "OrderedDict[str, tuple]" = OrderedDict()  # key -> (stored_at, json_str)
+        self._lock = threading.Lock()
+
+    def get(self, key: str) -> Optional[str]:
+        with self._lock:
+            item = self._items.get(key)
+            if item is None:
+                return None
+            if time.time() - item[0] > self.ttl_secs:
+                del self._items[key]
+                self.stats.expired += 1
+                return None
+            self._items.move_to_end(key)
+            return item[1]
+
+    def put(self, key: str, value: str, stored_at: float = None):
+        with self._lock:
+            self._items[key] = (stored_at or time.time(), value)
+            self._items.move_to_end(key)
+            while len(self._items) > self.max_items:
+                self._items.popitem(last=False)
+                self.stats.l1_evictions += 1
+
+    def __len__(self):
+        return len(self._items)
+
+
+class SqliteTier:
+    def __init__(self, path: str, ttl_secs: float, max_rows: int, stats: CacheStats):
+        self.ttl_secs = ttl_secs
+        self.max_rows = max_rows
+        self.stats = stats
+        d = os.path.dirname(path)
+        if d:
+            os.makedirs(d, exist_ok=True)
+        self._db = sqlite3.connect(path, check_same_thread=False, isolation_level=None)
+        self._db.execute("PRAGMA journal_mode=WAL")
+        self._db.execute("PRAGMA synchronous=NORMAL")
+        self._db.execute(
+            "CREATE TABLE IF NOT EXISTS llm_cache ("
+            " key TEXT PRIMARY KEY, value TEXT NOT NULL,"
+            " created_at REAL NOT NULL, accessed_at REAL NOT NULL)"
+        )
+        self._db.execute("CREATE INDEX IF NOT EXISTS llm_cache_accessed ON llm_cache(accessed_at)")
+        self._lock = threading.Lock()
+        self._rows = self._db.execute("SELECT COUNT(*) FROM llm_cache").fetchone()[0]
+        self._wake = threading.Condition()    # guards _pending
+        self._pending: Dict[str, str] = {}
+        self._writer: Optional[threading.Thread] = None
+
+    def get(self, key: str) -> Optional[tuple]:
+        now = time.time()
+        with self._lock:
+            row = self._db.execute("SELECT value, created_at FROM llm_cache WHERE key = ?", (key,)).fetchone()
+            if row is None:
+                return None
+            if now - row[1] > self.ttl_secs:
+                self._db.execute("DELETE FROM llm_cache WHERE key = ?", (key,))
+                self._rows -= 1
+                self.stats.expired += 1
+                return None
+            self._db.execute("UPDATE llm_cache SET accessed_at = ? WHERE key = ?", (now, key))
+            return row[0], row[1]
+
+    def put(self, key: str, value: str):
+        now = time.time()
+        with self._lock:
+            cur = self._db.execute(
+                "INSERT OR IGNORE INTO llm_cache(key, value, created_at, accessed_at) VALUES (?, ?, ?, ?)",
+                (key, value, now, now),
+            )
+            if cur.rowcount:
+                self._rows += 1
+            else:
+                self._db.execute(
+                    "UPDATE llm_cache SET value = ?, created_at = ?, accessed_at = ? WHERE key = ?",
+                    (value, now, now, key),
+                )
+            if self._rows > self.max_rows:
+                self._evict(now)
+
+    def put_later(self, key: str, value: str):
+        """Queue a write for the writer thread; never touches SQLite."""
+        with self._wake:
+            self._pending[key] = value
+            if self._writer is None:
+                self._writer = threading.Thread(target=self._write_loop, name="llm-cache-writer", daemon=True)
+                self._writer.start()
+            self._wake.notify()
+
+    def write_pending(self):
+        with self._wake:
+            batch, self._pending = self._pending, {}
+        for key, value in batch.items():
+            try:
+                self.put(key, value)
+            except Exception as e:
+                print("[WARN] LLM disk cache write failed:", e)
+
+    def _write_loop(self):
+        while True:
+            with self._wake:
+                while not self._pending:
+                    self._wake.wait()
+            self.write_pending()
+
+    def _evict(self, now: float):
+        # Drop expired rows first, then least-recently-used down to 90% of max_rows
+        # (batching the trim keeps eviction off the per-write path)
+        cur = self._db.execute("DELETE FROM llm_cache WHERE created_at < ?", (now - self.ttl_secs,))
+        self.stats.expired += cur.rowcount
+        self._rows -= cur.rowcount
+        excess = self._rows - int(self.max_rows * 0.9)
+        if excess > 0:
+            cur = self._db.execute(
+                "DELETE FROM llm_cache WHERE key IN ("
+                " SELECT key FROM llm_cache ORDER BY accessed_at ASC LIMIT ?)",
+                (excess,),
+            )
+            self.stats.l2_evictions += cur.rowcount
+            self._rows -= cur.rowcount
+
+    def __len__(self):
+        return self._rows
+
+
+class NormalizeCache:
+    def __init__(self, path: str = None, ttl_secs: float = None,
+                 lru_size: int = None, max_rows: int = None):
+        self.stats = CacheStats()
+        ttl = ttl_secs if ttl_secs is not None else LLM_CACHE_TTL_SECS
+        self.l1 = LRUTier(lru_size or LLM_CACHE_LRU_SIZE, ttl, self.stats)
+        path = LLM_CACHE_PATH if path is None else path
+        self.l2 = None
+        if path:
+            try:
+                self.l2 = SqliteTier(path, ttl, max_rows or LLM_CACHE_MAX_ROWS, self.stats)
+            except Exception as e:
+                print(f"[WARN] LLM disk cache disabled ({path}):", e)
+
+    def _get_l1(self, key: str) -> Optional[dict]:
+        value = self.l1.get(key)
+        if value is None:
+            return None
+        self.stats.l1_hits += 1
+        return json.loads(value)
+
+    def _get_l2(self, key: str) -> Optional[dict]:
+        """Blocking (SQLite): call from a worker thread when on the event loop."""
+        if self.l2 is not None:
+            try:
+                row = self.l2.get(key)
+            except Exception as e:
+                print("[WARN] LLM disk cache read failed:", e)
+                row = None
+            if row is not None:
+                self.stats.l2_hits += 1
+                self.l1.put(key, row[0], stored_at=row[1])
+                return json.loads(row[0])
+        self.stats.misses += 1
+        return None
+
+    def get(self, raw_text: str, model: str, prompt_version: str) -> Optional[dict]:
+        """Return a fresh copy of the cached model output, or None (blocks on an L1 miss)."""
+        key = cache_key(raw_text, model, prompt_version)
+        hit = self._get_l1(key)
+        return hit if hit is not None else self._get_l2(key)
+
+    async def aget(self, raw_text: str, model: str, prompt_version: str) -> Optional[dict]:
+        """get() for the event loop: the L2 read runs in a worker thread."""
+        key = cache_key(raw_text, model, prompt_version)
+        hit = self._get_l1(key)
+        if hit is not None:
+            return hit
+        return await asyncio.to_thread(self._get_l2, key)
+
+    def put(self, raw_text: str, model: str, prompt_version: str, parsed: dict):
+        key = cache_key(raw_text, model, prompt_version)
+        value = json.dumps(parsed, separators=(",", ":"))
+        self.l1.put(key, value)
+        if self.l2 is not None:
+            self.l2.put_later(key, value)
+        self.stats.writes += 1
+
+    def snapshot(self) -> dict:
+        snap = asdict(self.stats)
+        snap["hit_rate"] = round(self.stats.hit_rate(), 3)
+        snap["l1_items"] = len(self.l1)
+        snap["l2_rows"] = len(self.l2) if self.l2 is not None else 0
+        return snap
+
+
+_cache: Optional[NormalizeCache] = None
+
+def get_cache() -> Optional[NormalizeCache]:
+    """Process-wide cache (created on first use); None when LLM_CACHE=0."""
+    global _cache
+    if not LLM_CACHE_ENABLED:
+        return None
+    if _cache is None:
+        _cache = NormalizeCache()
+        if _cache.l2 is not None:
+            atexit.register(_cache.l2.write_pending)
+    return _cache
@@ -0,0 +1,259 @@
+# lib/llm_guard.py
+# Latency budget, hedged requests and a circuit breaker around the LLM normalization stage.
+#
+# While OpenRouter is healthy every message gets the LLM hints. When it is slow, a second
+# (hedged) request is fired once the running p95 has passed; whatever answers first wins.
+# When it keeps failing the breaker opens and messages go straight to the deterministic
+# parse_trade_signal path (fallback dict, no hints) until a probe request succeeds again.
+import os
+import sys
+import json
+import time
+import asyncio
+from collections import deque
+from dataclasses import dataclass, asdict
+from typing import Optional
+
+try:
+    from lib import llm_normalize as llm
+except ImportError:  # running from lib/ (tele_agent.py)
+    import llm_normalize as llm
+
+# ---------- ENV ----------
+LLM_BUDGET_SECS = float(os.getenv("LLM_BUDGET_SECS", "8"))                 # per-message ceiling for the LLM stage
+LLM_HEDGE_PERCENTILE = float(os.getenv("LLM_HEDGE_PERCENTILE", "95"))      # hedge once this latency percentile passes
+LLM_HEDGE_DEFAULT_SECS = float(os.getenv("LLM_HEDGE_DEFAULT_SECS", "3"))   # until we have enough samples
+LLM_HEDGE_MIN_SECS = float(os.getenv("LLM_HEDGE_MIN_SECS", "0.5"))         # never hedge earlier than this
+LLM_BREAKER_FAILURES = int(os.getenv("LLM_BREAKER_FAILURES", "5"))         # consecutive failures before tripping
+LLM_BREAKER_OPEN_SECS = float(os.getenv("LLM_BREAKER_OPEN_SECS", "30"))    # wait before a recovery probe
+
+
+class LatencyWindow:
+    """Rolling window of recent successful request latencies (seconds)."""
+
+    def __init__(self, size: int = 200, min_samples: int = 20):
+        self.samples = deque(maxlen=size)
+        self.min_samples = min_samples
+
+    def add(self, secs: float):
+        self.samples.append(secs)
+
+    def percentile(self, p: float) -> Optional[float]:
+        if len(self.samples) < self.min_samples:
+            return None
+        ordered = sorted(self.samples)
+        idx = min(len(ordered) - 1, int(round(p / 100.0 * (len(ordered) - 1))))
+        return ordered[idx]
+
+
+class CircuitBreaker:
+    """
+    closed    -> requests flow; N consecutive failures trip it open
+    open      -> requests short-circuit until open_secs have passed
+    half_open -> exactly one probe request; success closes, failure re-opens
+    """
+
+    def __init__(self, failure_threshold: int = None, open_secs: float = None):
+        self.failure_threshold = failure_threshold or LLM_BREAKER_FAILURES
+        self.open_secs = open_secs if open_secs is not None else LLM_BREAKER_OPEN_SECS
+        self.state = "closed"
+        self.failures = 0
+        self.opened_at = 0.0
+        self.trips = 0
+        self._probing = False
+
+    def allow(self) -> bool:
+        if self.state == "closed":
+            return True
+        if self.state == "open" and time.monotonic() - self.opened_at >= self.open_secs:
+            self.state = "half_open"
+        if self.state == "half_open" and not self._probing:
+            self._probing = True
+            return True
+        return False
+
+    @property
+    def probing(self) -> bool:
+        return self._probing
+
+    def record_success(self):
+        if self.state != "closed":
+            print("[INFO] LLM circuit closed (probe succeeded)")
+        self.state = "closed"
+        self.failures = 0
+        self._probing = False
+
+    def record_failure(self):
+        self.failures += 1
+        if self.state == "half_open" or self.failures >= self.failure_threshold:
+            if self.state != "open":
+                self.trips += 1
+                print(f"[WARN] LLM circuit open after {self.failures} failure(s); "
+                      f"deterministic parse only for {self.open_secs:.0f}s")
+            self.state = "open"
+            self.opened_at = time.monotonic()
+        self._probing = False
+
+    def release_probe(self):
+        """The probe ended without an outcome (cancelled): let the next request probe."""
+        self._probing = False
+
+
+@dataclass
+class GuardStats:
+    calls: int = 0
+    ok: int = 0
+    failures: int = 0
+    hedges: int = 0
+    hedge_wins: int = 0
+    budget_overruns: int = 0
+    short_circuits: int = 0
+    trips: int = 0
+
+
+class NormalizeGuard:
+    def __init__(self, client: "llm.OpenRouterClient" = None, budget_secs: float = None,
+                 hedge_percentile: float = None, breaker: CircuitBreaker = None):
+        self.client = client or llm.client
+        self.budget_secs = budget_secs if budget_secs is not None else LLM_BUDGET_SECS
+        self.hedge_percentile = hedge_percentile or LLM_HEDGE_PERCENTILE
+        self.breaker = breaker or CircuitBreaker()
+        self.latency = LatencyWindow()
+        self.stats = GuardStats()
+
+    def hedge_after(self) -> float:
+        p = self.latency.percentile(self.hedge_percentile)
+        return max(LLM_HEDGE_MIN_SECS, p if p is not None else LLM_HEDGE_DEFAULT_SECS)
+
+    async def _attempt(self, raw_text: str) -> dict:
+        t0 = time.monotonic()
+        parsed = await self.client.complete(raw_text)
+        self.latency.add(time.monotonic() - t0)
+        return parsed
+
+    async def _hedged(self, raw_text: str, allow_hedge: bool) -> dict:
+        first = asyncio.create_task(self._attempt(raw_text))
+        tasks = {first}
+        try:
+            done, _ = await asyncio.wait(tasks, timeout=self.hedge_after())
+            if done or not allow_hedge:
+                return await first
+
+            self.stats.hedges += 1
+            second = asyncio.create_task(self._attempt(raw_text))
+            tasks.add(second)
+            pending = set(tasks)
+            last_exc = None
+            while pending:
+                done, pending = await asyncio.wait(pending, return_when=asyncio.FIRST_COMPLETED)
+                for t in done:
+                    if t.exception() is None:
+                        if t is second:
+                            self.stats.hedge_wins += 1
+                        return t.result()
+                    last_exc = t.exception()
+            raise last_exc
+        finally:
+            for t in tasks:
+                if not t.done():
+                    t.cancel()
+
+    async def normalize(self, raw_text: str, group_id=None, message_id=None) -> dict:
+        """Same contract as llm_normalize.anormalize_message, bounded by the latency budget."""
+        fallback = llm._fallback(raw_text, group_id, message_id)
+        if not llm.OR_TOKEN:
+            return fallback
+
+        self.stats.calls += 1
+        cached = await llm.cache_lookup(raw_text)
+        if cached is not None:
+            return llm._postfix(cached, raw_text, group_id, message_id)
+        if not self.breaker.allow():
+            self.stats.short_circuits += 1
+            fallback["issues"].append("circuit_open")
+            return fallback
+
+        # A half-open probe is a single request: hedging it would double the load on a sick upstream
+        probe = self.breaker.probing
+        try:
+            parsed = await asyncio.wait_for(self._hedged(raw_text, not probe), timeout=self.budget_secs)
+        except asyncio.TimeoutError:
+            self.stats.budget_overruns += 1
+            self._fail()
+            print(f"[WARN] LLM budget {self.budget_secs:.1f}s exceeded; using deterministic parse")
+            fallback["issues"].append("budget_exceeded")
+            return fallback
+        except Exception as e:
+            self._fail()
+            print("[ERR] normalize_message failed:", e)
+            fallback["issues"].append(f"exception:{type(e).__name__}")
+            return fallback
+        finally:
+            if probe:
+                # cancelled (e.g. a session's workers stopped mid-probe): neither branch above
+                # ran, and a probe left in flight would short-circuit the LLM tier for good
+                self.breaker.release_probe()
+
+        self.stats.ok += 1
+        self.breaker.record_success()
+        llm.cache_store(raw_text, parsed)
+        return llm._postfix(parsed, raw_text, group_id, message_id)
+
+    def _fail(self):
+        self.stats.failures += 1
+        self.breaker.record_failure()
+        self.stats.trips = self.breaker.trips
+
+    def snapshot(self) -> dict:
+        snap = asdict(self.stats)
+        snap["state"] = self.breaker.state
+        snap["hedge_after_secs"] = round(self.hedge_after(), 3)
+        return snap
+
+
+# Shared guard for the agent's event loop (tele_agent)
+guard = NormalizeGuard()
+
+async def guarded_normalize(raw_text: str, group_id=None, message_id=None) -> dict:
+    return await guard.normalize(raw_text, group_id=group_id, message_id=message_id)
+
+
+async def _demo():
+    """Drive the guard against a local fake OpenRouter that slows down and then fails."""
+    try:
+        from lib.fake_openrouter import FakeOpenRouter
+    except ImportError:
+        from fake_openrouter import FakeOpenRouter
+
+    fake = FakeOpenRouter(delay=0.05)
+    url = await fake.start()
+    llm.OR_TOKEN = llm.OR_TOKEN or "fake"
+    client = llm.OpenRouterClient(url=url)
+    g = NormalizeGuard(client=client, budget_secs=1.0,
+                       breaker=CircuitBreaker(failure_threshold=3, open_secs=1.0))
+    sample = "#EURUSD buy entry 1.0850 sl 1.0800 tp 1.0900"
+
+    phases = [
+        ("healthy", dict(delay=0.05, slow_rate=0.0, fail_rate=0.0), 30),
+        ("tail latency", dict(delay=0.05, slow_rate=0.3, slow_delay=0.6), 30),
+        ("outage", dict(delay=0.05, slow_rate=0.0, fail_rate=1.0), 10),
+        ("recovered", dict(delay=0.05, fail_rate=0.0), 10),
+    ]
+    for name, cfg, n in phases:
+        fake.configure(**cfg)
+        if name == "recovered":
+            await asyncio.sleep(1.1)  # let the breaker go half-open
+        for i in range(n):
+            # distinct texts so the response cache does not answer for the fake upstream
+            await g.normalize(f"{sample} ({name} {i})", group_id=1, message_id=i)
+        print(f"{name:>12}: {json.dumps(g.snapshot())}")
+
+    await client.close()
+    await fake.stop()
+
+
+if __name__ == "__main__":
+    if len(sys.argv) > 1 and sys.argv[1] == "demo":
+        asyncio.run(_demo())
+    else:
+        print("Usage: python lib/llm_guard.py demo")
@@ -1,12 +1,20 @@
 # /mnt/data/llm_normalize.py
-import os, json, re, requests
+import os, json, re, asyncio, hashlib
 from datetime import datetime, timezone
+from typing import Optional
+
+import aiohttp
 from dotenv import load_dotenv
 
+try:
+    from lib.llm_cache import get_cache
+except ImportError:  # running from lib/ (tele_agent.py)
+    from llm_cache import get_cache
+
 load_dotenv()
 
 # ==== OpenRouter config ====
-OPENROUTER_URL = "https://openrouter.ai/api/v1/chat/completions"
+OPENROUTER_URL = os.getenv("OPENROUTER_URL", "https://openrouter.ai/api/v1/chat/completions")
 OR_TOKEN = os.getenv("OR_TOKEN")  # <- put your OpenRouter key in .env as OR_TOKEN=...
 MODEL = os.getenv("OPENROUTER_MODEL", "mistralai/mistral-7b-instruct-v0.3")  # default to the free tier
 
@@ -14,6 +22,11 @@ MODEL = os.getenv("OPENROUTER_MODEL", "mistralai/mistral-7b-instruct-v0.3")  # d
 OR_REFERER = os.getenv("OR_REFERER", "http://localhost")
 OR_TITLE   = os.getenv("OR_TITLE",   "Signal Normalizer")
 
+# ==== HTTP client tuning ====
+LLM_TIMEOUT_SECS = float(os.getenv("LLM_TIMEOUT_SECS", "30"))        # total time per request
+LLM_MAX_CONCURRENCY = int(os.getenv("LLM_MAX_CONCURRENCY", "8"))     # in-flight requests per client
+LLM_POOL_SIZE = int(os.getenv("LLM_POOL_SIZE", "16"))                # keep-alive sockets per client
+
 SYSTEM = """You are "SignalNormalizer", a deterministic converter that outputs ONLY one JSON object following this schema:
 {"symbol": "string|null","side": "LONG|SHORT|null","entry": [number,number?]|null,"targets": [number]|null,"stop": number|null,"timeframe":"string|null","confidence": number,"issues": [string]|null,"raw_text": "string","source":{"platform":"telegram","group_id":"string|null","message_id":"string|null","received_ts":"string|null"},"idempotency_key":"string"}
 Rules:
@@ -21,6 +34,7 @@ Rules:
 - UPPERCASE symbol. Remove leading '#'.
 - Return JSON only, no markdown or prose.
 """
+SYSTEM_VERSION = "1"  # bump whenever SYSTEM or _payload changes so cached outputs are not reused
 
 def _headers():
     if not OR_TOKEN:
@@ -36,13 +50,15 @@ def _headers():
 def _now_iso():
     return datetime.now(timezone.utc).isoformat()
 
-def normalize_message(raw_text: str, group_id=None, message_id=None):
-    """
-    Normalize a messy trade signal string into strict JSON via OpenRouter (gpt-oss-20b:free).
-    Falls back to a lightweight dict if no token is configured or on failure.
-    """
-    # Fallback (no key or any failure)
-    fallback = {
+def fingerprint(raw_text: str) -> str:
+    """Stable content hash (same across restarts and processes, unlike the salted hash())."""
+    return hashlib.blake2b(raw_text.encode("utf-8"), digest_size=8).hexdigest()
+
+def _idempotency_key(raw_text: str, group_id=None, message_id=None) -> str:
+    return f"{group_id or 'na'}:{message_id or 'na'}:{fingerprint(raw_text)}"
+
+def _fallback(raw_text: str, group_id=None, message_id=None) -> dict:
+    return {
         "symbol": None,
         "side": None,
         "entry": None,
@@ -58,18 +74,11 @@ def normalize_message(raw_text: str, group_id=None, message_id=None):
             "message_id": str(message_id) if message_id is not None else None,
             "received_ts": _now_iso(),
         },
-        "idempotency_key": f"{group_id or 'na'}:{message_id or 'na'}:{abs(hash(raw_text))%10**8}",
+        "idempotency_key": _idempotency_key(raw_text, group_id, message_id),
     }
 
-    if not OR_TOKEN:
-        return fallback
-
-    messages = [
-        {"role": "system", "content": SYSTEM},
-        {"role": "user", "content": f"{raw_text}\n\nReturn only the JSON object."}
-    ]
-
-    payload = {
+def _payload(raw_text: str) -> dict:
+    return {
         "model": MODEL,
         "messages": [
             {"role": "system", "content": SYSTEM},
@@ -80,41 +89,140 @@ def normalize_message(raw_text: str, group_id=None, message_id=None):
         "response_format": {"type": "json_object"},  # enforce clean JSON
     }
 
-    try:
-        resp = requests.post(OPENROUTER_URL, headers=_headers(), data=json.dumps(payload), timeout=30)
-        resp.raise_for_status()
-        data = resp.json()
+def _postfix(parsed: dict, raw_text: str, group_id=None, message_id=None) -> dict:
+    # Post-fix: add missing fields
+    src = parsed.get("source") or {}
+    src.setdefault("platform", "telegram")
+    src.setdefault("group_id", str(group_id) if group_id else None)
+    src.setdefault("message_id", str(message_id) if message_id else None)
+    src.setdefault("received_ts", _now_iso())
+    parsed["source"] = src
+
+    parsed.setdefault("raw_text", raw_text)
+    # ours, not whatever the model echoed back, so the key is the same for every path
+    parsed["idempotency_key"] = _idempotency_key(raw_text, group_id, message_id)
+
+    if isinstance(parsed.get("symbol"), str):
+        sym = parsed["symbol"].lstrip("#").upper()
+        parsed["symbol"] = sym if sym else None
+
+    return parsed
+
+def hints_from_parsed(parsed: Optional[dict], raw_text: str, group_id=None, message_id=None,
+                      confidence: float = 0, issues=None) -> dict:
+    """Same schema as the LLM output, filled from a deterministic parse_trade_signal result."""
+    hints = _fallback(raw_text, group_id, message_id)
+    hints["issues"] = list(issues or [])
+    hints["confidence"] = confidence
+    if parsed:
+        hints["symbol"] = parsed.get("symbol")
+        hints["side"] = "LONG" if parsed.get("action") == "buy" else "SHORT"
+        lo, hi = parsed.get("entry_min"), parsed.get("entry_max")
+        hints["entry"] = [lo] if hi in (None, lo) else [lo, hi]
+        hints["targets"] = list(parsed.get("tp") or [])
+        hints["stop"] = parsed.get("sl")
+        hints["timeframe"] = parsed.get("timeframe")
+    return hints
+
+async def cache_lookup(raw_text: str) -> Optional[dict]:
+    cache = get_cache()
+    return await cache.aget(raw_text, MODEL, SYSTEM_VERSION) if cache else None
+
+def cache_store(raw_text: str, parsed: dict):
+    cache = get_cache()
+    if cache:
+        cache.put(raw_text, MODEL, SYSTEM_VERSION, parsed)
+
+
+class OpenRouterClient:
+    """
+    Async OpenRouter client with one keep-alive connection pool per event loop.
+    `max_concurrency` caps in-flight requests so a burst of signals does not
+    open more sockets than the pool (or the free tier) can take.
+    """
+
+    def __init__(self, url: str = None, timeout: float = None,
+                 max_concurrency: int = None, pool_size: int = None):
+        self.url = url or OPENROUTER_URL
+        self.timeout = timeout if timeout is not None else LLM_TIMEOUT_SECS
+        self.max_concurrency = max_concurrency or LLM_MAX_CONCURRENCY
+        self.pool_size = pool_size or LLM_POOL_SIZE
+        self._session: Optional[aiohttp.ClientSession] = None
+        self._sem: Optional[asyncio.Semaphore] = None
+        self._loop = None
+
+    def _ensure_session(self) -> aiohttp.ClientSession:
+        # aiohttp sessions are bound to the loop that created them
+        loop = asyncio.get_running_loop()
+        if self._session is None or self._session.closed or self._loop is not loop:
+            connector = aiohttp.TCPConnector(limit=self.pool_size, keepalive_timeout=60)
+            self._session = aiohttp.ClientSession(
+                connector=connector,
+                timeout=aiohttp.ClientTimeout(total=self.timeout),
+            )
+            self._sem = asyncio.Semaphore(self.max_concurrency)
+            self._loop = loop
+        return self._session
+
+    async def close(self):
+        if self._session is not None and not self._session.closed:
+            await self._session.close()
+        self._session = None
+
+    async def complete(self, raw_text: str) -> dict:
+        """POST one normalization request and return the model's JSON object. Raises on any failure."""
+        session = self._ensure_session()
+        async with self._sem:
+            async with session.post(self.url, headers=_headers(), data=json.dumps(_payload(raw_text))) as resp:
+                resp.raise_for_status()
+                data = await resp.json(content_type=None)
         print("=== RAW RESPONSE ===")
         print(json.dumps(data, indent=2))
 
-         # response_format=json_object guarantees JSON in choices[0].message.content
+        # response_format=json_object guarantees JSON in choices[0].message.content
         content = (data.get("choices") or [{}])[0].get("message", {}).get("content", "")
-        parsed = json.loads(content)   # <-- direct load, no regex needed
-
-        # Post-fix: add missing fields
-        src = parsed.get("source") or {}
-        src.setdefault("platform", "telegram")
-        src.setdefault("group_id", str(group_id) if group_id else None)
-        src.setdefault("message_id", str(message_id) if message_id else None)
-        src.setdefault("received_ts", _now_iso())
-        parsed["source"] = src
-
-        parsed.setdefault("raw_text", raw_text)
-        parsed.setdefault(
-            "idempotency_key",
-            f"{group_id or 'na'}:{message_id or 'na'}:{abs(hash(raw_text))%10**8}",
-        )
-
-        if isinstance(parsed.get("symbol"), str):
-            sym = parsed["symbol"].lstrip("#").upper()
-            parsed["symbol"] = sym if sym else None
-
-        return parsed
-
-    except Exception as e:
-        print("[ERR] normalize_message failed:", e)
-        fallback["issues"].append(f"exception:{type(e).__name__}")
-        return fallback
+        return json.loads(content)   # <-- direct load, no regex needed
+
+    async def normalize(self, raw_text: str, group_id=None, message_id=None) -> dict:
+        fallback = _fallback(raw_text, group_id, message_id)
+        if not OR_TOKEN:
+            return fallback
+        cached = await cache_lookup(raw_text)
+        if cached is not None:
+            return _postfix(cached, raw_text, group_id, message_id)
+        try:
+            parsed = await self.complete(raw_text)
+            cache_store(raw_text, parsed)
+            return _postfix(parsed, raw_text, group_id, message_id)
+        except Exception as e:
+            print("[ERR] normalize_message failed:", e)
+            fallback["issues"].append(f"exception:{type(e).__name__}")
+            return fallback
+
+
+# Shared client for the agent's event loop (tele_agent)
+client = OpenRouterClient()
+
+async def anormalize_message(raw_text: str, group_id=None, message_id=None):
+    """
+    Async version of normalize_message. Safe to await from Telethon handlers:
+    requests share keep-alive connections and run concurrently up to LLM_MAX_CONCURRENCY.
+    """
+    return await client.normalize(raw_text, group_id=group_id, message_id=message_id)
+
+def normalize_message(raw_text: str, group_id=None, message_id=None):
+    """
+    Normalize a messy trade signal string into strict JSON via OpenRouter (gpt-oss-20b:free).
+    Falls back to a lightweight dict if no token is configured or on failure.
+    Blocking wrapper for scripts; do not call from inside a running event loop.
+    """
+    async def _run():
+        c = OpenRouterClient()
+        try:
+            return await c.normalize(raw_text, group_id=group_id, message_id=message_id)
+        finally:
+            await c.close()
+    return asyncio.run(_run())
 
 # if __name__ == "__main__":
 #     # Quick smoke test
@@ -0,0 +1,264 @@
+# lib/notify_sender.py
+# Concurrent, rate-limit-aware Bot API sender for follower fan-out.
+#
+# send_to_followers used to await two send_message calls per follower, route by route.
+# Now it only enqueues; NOTIFY_CONCURRENCY workers drain per-chat queues under
+#   - a global token bucket   (NOTIFY_GLOBAL_RATE msgs/s; Telegram allows ~30/s per bot)
+#   - a per-chat token bucket (NOTIFY_CHAT_RATE/s for private chats, NOTIFY_GROUP_RATE_PER_MIN
+#                              for groups/channels, i.e. negative chat ids)
+# Consecutive queued messages for the same chat are merged into one send (<= 4096 chars;
+# only the last part may carry an inline keyboard). A RetryAfter pauses that chat only:
+# its messages go back to the front of its queue and the worker moves on to other chats.
+# Network errors are retried (NOTIFY_MAX_RETRIES) except TimedOut: the request may have
+# reached Telegram, and a retry could deliver the card twice.
+#
+# Fan-out time per signal (first enqueue -> last message delivered or given up) is
+# reported as p50/p99.
+import os
+import time
+import asyncio
+from collections import deque
+from dataclasses import dataclass, asdict
+from typing import Any, Deque, Dict, List, Optional
+
+from telegram.error import BadRequest, NetworkError, RetryAfter, TimedOut
+
+# ---------- ENV ----------
+NOTIFY_CONCURRENCY = int(os.getenv("NOTIFY_CONCURRENCY", "16"))
+NOTIFY_GLOBAL_RATE = float(os.getenv("NOTIFY_GLOBAL_RATE", "30"))
+NOTIFY_CHAT_RATE = float(os.getenv("NOTIFY_CHAT_RATE", "1"))
+NOTIFY_GROUP_RATE_PER_MIN = float(os.getenv("NOTIFY_GROUP_RATE_PER_MIN", "20"))
+NOTIFY_CHAT_BURST = float(os.getenv("NOTIFY_CHAT_BURST", "3"))
+NOTIFY_MERGE = os.getenv("NOTIFY_MERGE", "1") not in ("0", "false", "no")
+NOTIFY_MAX_RETRIES = int(os.getenv("NOTIFY_MAX_RETRIES", "2"))   # network errors, per message
+
+MAX_TEXT = 4096
+
+
+class TokenBucket:
+    def __init__(self, rate: float, burst: float):
+        self.rate = rate
+        self.burst = max(1.0, burst)
+        self.tokens = self.burst
+        self.last = time.monotonic()
+
+    def _refill(self, now: float):
+        self.tokens = min(self.burst, self.tokens + (now - self.last) * self.rate)
+        self.last = now
+
+    def delay(self, now: float = None) -> float:
+        """Seconds until one token is available (0 = now)."""
+        now = time.monotonic() if now is None else now
+        self._refill(now)
+        return 0.0 if self.tokens >= 1 else (1 - self.tokens) / self.rate
+
+    def consume(self):
+        self.tokens -= 1
+
+    async def acquire(self):
+        while True:
+            d = self.delay()
+            if d <= 0:
+                self.consume()
+                return
+            await asyncio.sleep(d)
+
+
+class Fanout:
+    """One signal's messages; finished once closed and every message is settled."""
+
+    def __init__(self, sender: "NotifySender"):
+        self.sender = sender
+        self.started = time.monotonic()
+        self.pending = 0
+        self.closed = False
+        self.finished = False
+
+    def close(self):
+        self.closed = True
+        self.sender._maybe_finish(self)
+
+
+@dataclass
+class Outgoing:
+    chat_id: Any
+    text: str
+    reply_markup: Any = None
+    fanout: Optional[Fanout] = None
+    attempts: int = 0
+
+
+@dataclass
+class SenderStats:
+    enqueued: int = 0
+    api_calls: int = 0
+    delivered: int = 0
+    merged: int = 0          # messages folded into another send
+    retry_after: int = 0     # flood waits received (chat paused, not dropped)
+    retried: int = 0         # network errors retried
+    timed_out: int = 0       # not retried: may have been delivered already
+    failed: int = 0
+    signals: int = 0
+
+
+class _Chat:
+    __slots__ = ("queue", "bucket", "blocked_until", "active")
+
+    def __init__(self, bucket: TokenBucket):
+        self.queue: Deque[Outgoing] = deque()
+        self.bucket = bucket
+        self.blocked_until = 0.0
+        self.active = False      # queued in _ready, scheduled, or being sent
+
+
+def _percentiles(samples) -> dict:
+    if not samples:
+        return {"p50_ms": None, "p99_ms": None, "max_ms": None}
+    ordered = sorted(samples)
+    pick = lambda p: round(ordered[min(len(ordered) - 1, int(p * (len(ordered) - 1)))] * 1000, 1)
+    return {"p50_ms": pick(0.5), "p99_ms": pick(0.99), "max_ms": round(ordered[-1] * 1000, 1)}
+
+
+class NotifySender:
+    def __init__(self, bot, concurrency: int = None):
+        self.bot = bot
+        self.concurrency = concurrency or NOTIFY_CONCURRENCY
+        self.global_bucket = TokenBucket(NOTIFY_GLOBAL_RATE, NOTIFY_GLOBAL_RATE)
+        self._chats: Dict[str, _Chat] = {}
+        self._ready: Optional[asyncio.Queue] = None
+        self.tasks: List[asyncio.Task] = []
+        self.fanout_times: Deque[float] = deque(maxlen=1000)
+        self.stats = SenderStats()
+
+    # ---- producer side ----
+    def begin(self) -> Fanout:
+        return Fanout(self)
+
+    def send(self, chat_id, text: str, reply_markup=None, fanout: Fanout = None):
+        """Queue a message; returns immediately."""
+        key = str(chat_id)
+        chat = self._chats.get(key)
+        if chat is None:
+            group = key.startswith("-")
+            rate = NOTIFY_GROUP_RATE_PER_MIN / 60.0 if group else NOTIFY_CHAT_RATE
+            chat = self._chats[key] = _Chat(TokenBucket(rate, NOTIFY_CHAT_BURST))
+        chat.queue.append(Outgoing(chat_id, text, reply_markup, fanout))
+        if fanout is not None:
+            fanout.pending += 1
+        self.stats.enqueued += 1
+        if not chat.active:
+            chat.active = True
+            self._ready.put_nowait(key)
+
+    # ---- workers ----
+    def start(self):
+        if self._ready is None:
+            self._ready = asyncio.Queue()
+            self.tasks = [asyncio.create_task(self._worker()) for _ in range(max(1, self.concurrency))]
+        return self.tasks
+
+    def _take_batch(self, chat: _Chat) -> List[Outgoing]:
+        batch = [chat.queue.popleft()]
+        if not NOTIFY_MERGE or batch[0].reply_markup is not None:
+            return batch
+        size = len(batch[0].text)
+        while chat.queue:
+            nxt = chat.queue[0]
+            if size + 2 + len(nxt.text) > MAX_TEXT:
+                break
+            batch.append(chat.queue.popleft())
+            size += 2 + len(nxt.text)
+            if nxt.reply_markup is not None:
+                break   # keyboard goes on the last part only
+        return batch
+
+    def _settle(self, batch: List[Outgoing], ok: bool):
+        for m in batch:
+            if ok:
+                self.stats.delivered += 1
+            else:
+                self.stats.failed += 1
+            if m.fanout is not None:
+                m.fanout.pending -= 1
+                self._maybe_finish(m.fanout)
+
+    def _maybe_finish(self, f: Fanout):
+        if f.closed and f.pending <= 0 and not f.finished:
+            f.finished = True
+            self.stats.signals += 1
+            self.fanout_times.append(time.monotonic() - f.started)
+
+    def _requeue(self, chat: _Chat, batch: List[Outgoing]):
+        chat.queue.extendleft(reversed(batch))
+
+    async def _worker(self):
+        loop = asyncio.get_running_loop()
+        while True:
+            key = await self._ready.get()
+            chat = self._chats[key]
+            now = time.monotonic()
+            wait = max(chat.blocked_until - now, chat.bucket.delay(now))
+            if wait > 0:
+                # don't hold a worker on a slow chat; come back when it is allowed to send
+                loop.call_later(wait, self._ready.put_nowait, key)
+                continue
+            await self.global_bucket.acquire()
+            chat.bucket.consume()
+            batch = self._take_batch(chat)
+            try:
+                text = "\n\n".join(m.text for m in batch)
+                self.stats.api_calls += 1
+                await self.bot.send_message(chat_id=batch[0].chat_id, text=text, reply_markup=batch[-1].reply_markup)
+                self.stats.merged += len(batch) - 1
+                self._settle(batch, True)
+            except RetryAfter as e:
+                ra = e.retry_after
+                secs = ra.total_seconds() if hasattr(ra, "total_seconds") else float(ra)
+                self.stats.retry_after += 1
+                chat.blocked_until = time.monotonic() + secs
+                self._requeue(chat, batch)
+                print(f"[WARN] notify: flood wait {secs:.0f}s for chat={key}; other chats continue")
+            except BadRequest as e:
+                self._settle(batch, False)   # chat not found, text rejected, ...: retrying won't help
+                print(f"[ERROR] notify: send to chat={key} rejected:", repr(e))
+            except TimedOut as e:
+                # NetworkError subclass, but raised after the request went out: never resend
+                self.stats.timed_out += 1
+                self._settle(batch, False)
+                print(f"[WARN] notify: send to chat={key} timed out; not retrying (may be delivered):", repr(e))
+            except NetworkError as e:
+                retry, give_up = [], []
+                for m in batch:
+                    m.attempts += 1
+                    (retry if m.attempts <= NOTIFY_MAX_RETRIES else give_up).append(m)
+                self.stats.retried += len(retry)
+                self._settle(give_up, False)
+                self._requeue(chat, retry)
+                chat.blocked_until = time.monotonic() + 1.0
+                print(f"[WARN] notify: send to chat={key} failed ({e!r}); retrying {len(retry)}")
+            except Exception as e:
+                self._settle(batch, False)
+                print(f"[ERROR] notify: send to chat={key} failed:", repr(e))
+            finally:
+                if chat.queue:
+                    self._ready.put_nowait(key)
+                else:
+                    chat.active = False
+
+    async def drain(self, timeout: float = None):
+        """Wait until every queued message is settled (shutdown, benchmarks)."""
+        t0 = time.monotonic()
+        while any(c.active for c in self._chats.values()):
+            if timeout is not None and time.monotonic() - t0 > timeout:
+                return False
+            await asyncio.sleep(0.01)
+        return True
+
+    def snapshot(self) -> dict:
+        now = time.monotonic()
+        snap = asdict(self.stats)
+        snap["queued"] = sum(len(c.queue) for c in self._chats.values())
+        snap["chats"] = len(self._chats)
+        snap["chats_paused"] = sum(1 for c in self._chats.values() if c.blocked_until > now)
+        snap["fanout"] = _percentiles(self.fanout_times)
+        return snap
@@ -0,0 +1,227 @@
+# lib/parse_pool.py
+# Runs parse_trade_signal(_scored) in a process pool so tokenizing/matching a burst of
+# messages does not block the Telethon clients sharing the agent's event loop.
+#
+# Each worker builds the parser backend (spaCy nlp + Matcher, or the regex backend)
+# once in its initializer. PARSE_WORKERS=0 keeps the old inline behaviour (tests,
+# one-off scripts, tiny deployments).
+#
+# A broken pool (a worker died) is rebuilt once, by whichever task notices first and
+# only if the broken executor is still the current one, in a thread off the event
+# loop; the rebuild uses forkserver/spawn since by then the process has threads.
+#
+#   python lib/parse_pool.py bench bench/corpus.jsonl [--workers 4] [--n 2000]
+import os
+import sys
+import json
+import time
+import asyncio
+import multiprocessing as mp
+from concurrent.futures import ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+from dataclasses import dataclass, asdict
+from typing import Any, Dict, List, Optional, Tuple
+
+try:
+    from lib import parser
+except ImportError:  # running from lib/ (tele_agent.py)
+    import parser
+
+# ---------- ENV ----------
+PARSE_WORKERS = int(os.getenv("PARSE_WORKERS", "0"))  # 0 = parse inline on the event loop
+
+
+def _init_worker(backend: Optional[str]):
+    # pay for the spaCy import/Matcher build here, not on the first signal
+    parser.parse_trade_signal("warm up long entry 1 sl 1 tp 1", backend=backend)
+
+
+def _ping() -> int:
+    return os.getpid()
+
+
+def _timed(fn, *args) -> Tuple[Any, float]:
+    t0 = time.perf_counter()
+    result = fn(*args)
+    return result, time.perf_counter() - t0
+
+
+def _parse_scored(text: str, backend: Optional[str]):
+    return _timed(parser.parse_trade_signal_scored, text, None, backend)
+
+
+def _parse(text: str, hints: Optional[Dict[str, Any]], backend: Optional[str]):
+    return _timed(parser.parse_trade_signal, text, hints, backend)
+
+
+@dataclass
+class PoolStats:
+    submitted: int = 0
+    completed: int = 0
+    failed: int = 0
+    restarts: int = 0
+    busy_secs: float = 0.0   # time spent parsing inside workers
+    wait_secs: float = 0.0   # submit -> result, minus parse time (queueing + IPC)
+    max_inflight: int = 0
+
+
+class ParsePool:
+    def __init__(self, workers: int = None, backend: Optional[str] = None):
+        self.workers = PARSE_WORKERS if workers is None else workers
+        self.backend = backend
+        self.stats = PoolStats()
+        self.inflight = 0
+        self._executor: Optional[ProcessPoolExecutor] = None
+        self._rebuild: Optional[asyncio.Lock] = None
+        self._restart_method = next((m for m in ("forkserver", "spawn") if m in mp.get_all_start_methods()))
+        self._window_t0 = time.monotonic()
+        self._window_busy = 0.0
+
+    @property
+    def inline(self) -> bool:
+        return self.workers <= 0
+
+    def start(self):
+        """Create the pool and wait until every worker has warmed up its backend."""
+        if self.inline:
+            _init_worker(self.backend)
+            return
+        if self._executor is not None:
+            return
+        # fork keeps lib/ on sys.path and does not re-run tele_agent's module body;
+        # start() is called before the Telethon clients spin up any threads
+        methods = mp.get_all_start_methods()
+        self._executor = self._build("fork" if "fork" in methods else "spawn")
+
+    def _build(self, method: str) -> ProcessPoolExecutor:
+        """New executor with every worker warmed up (blocking)."""
+        t0 = time.perf_counter()
+        executor = ProcessPoolExecutor(max_workers=self.workers, mp_context=mp.get_context(method),
+                                       initializer=_init_worker, initargs=(self.backend,))
+        for f in [executor.submit(_ping) for _ in range(self.workers)]:
+            f.result()
+        print(f"[INFO] parse pool ready ({method}): {self.workers} worker(s) in {time.perf_counter() - t0:.2f}s")
+        return executor
+
+    async def _replace(self, broken: Optional[ProcessPoolExecutor], error: Exception = None) -> ProcessPoolExecutor:
+        """Rebuild the pool unless another task already replaced `broken`; never blocks the loop."""
+        if self._rebuild is None:
+            self._rebuild = asyncio.Lock()
+        async with self._rebuild:
+            if self._executor is not broken and self._executor is not None:
+                return self._executor   # someone else rebuilt it while we waited
+            if broken is not None:
+                print("[ERR] parse pool broken, restarting:", error)
+                self.stats.restarts += 1
+                # its futures already failed with BrokenProcessPool; nothing left to cancel
+                broken.shutdown(wait=False)
+            self._executor = None
+            self._executor = await asyncio.to_thread(self._build, self._restart_method)
+            return self._executor
+
+    def shutdown(self):
+        if self._executor is not None:
+            self._executor.shutdown(wait=False, cancel_futures=True)
+            self._executor = None
+
+    async def _run(self, fn, *args):
+        self.stats.submitted += 1
+        self.inflight += 1
+        self.stats.max_inflight = max(self.stats.max_inflight, self.inflight)
+        t0 = time.perf_counter()
+        try:
+            if self.inline:
+                result, busy = fn(*args)
+            else:
+                executor = self._executor or await self._replace(None)
+                loop = asyncio.get_running_loop()
+                try:
+                    result, busy = await loop.run_in_executor(executor, fn, *args)
+                except BrokenProcessPool as e:
+                    # a worker died (OOM, segfault in a C extension): rebuild once, retry there
+                    executor = await self._replace(executor, e)
+                    result, busy = await loop.run_in_executor(executor, fn, *args)
+        except Exception:
+            self.stats.failed += 1
+            raise
+        finally:
+            self.inflight -= 1
+        self.stats.completed += 1
+        self.stats.busy_secs += busy
+        self.stats.wait_secs += max(0.0, time.perf_counter() - t0 - busy)
+        self._window_busy += busy
+        return result
+
+    async def parse_scored(self, text: str) -> Tuple[Optional[dict], float, List[str]]:
+        return await self._run(_parse_scored, text, self.backend)
+
+    async def parse(self, text: str, hints: Optional[Dict[str, Any]] = None) -> Optional[dict]:
+        return await self._run(_parse, text, hints, self.backend)
+
+    def snapshot(self) -> dict:
+        """Cumulative counters plus utilization over the time since the previous snapshot."""
+        now = time.monotonic()
+        window = max(now - self._window_t0, 1e-9)
+        snap = asdict(self.stats)
+        done = self.stats.completed or 1
+        snap.update({
+            "workers": self.workers,
+            "inflight": self.inflight,
+            "queue_depth": max(0, self.inflight - max(self.workers, 1)),
+            "utilization": round(self._window_busy / (window * max(self.workers, 1)), 3),
+            "avg_parse_ms": round(self.stats.busy_secs / done * 1000, 3),
+            "avg_wait_ms": round(self.stats.wait_secs / done * 1000, 3),
+            "busy_secs": round(self.stats.busy_secs, 3),
+            "wait_secs": round(self.stats.wait_secs, 3),
+        })
+        self._window_t0, self._window_busy = now, 0.0
+        return snap
+
+
+async def _bench(path: str, workers: int, n: int):
+    """Parse n corpus messages concurrently while timing event-loop stalls."""
+    with open(path, encoding="utf-8") as f:
+        texts = [json.loads(l)["text"] for l in f if l.strip()]
+    texts = (texts * (n // len(texts) + 1))[:n]
+
+    pool = ParsePool(workers=workers)
+    pool.start()
+    pool.snapshot()
+
+    stalls = []
+    stop = asyncio.Event()
+
+    async def heartbeat():
+        # what a Telethon client would feel: how late does a 10ms timer fire?
+        while not stop.is_set():
+            t0 = time.perf_counter()
+            await asyncio.sleep(0.01)
+            stalls.append(time.perf_counter() - t0 - 0.01)
+
+    hb = asyncio.create_task(heartbeat())
+    t0 = time.perf_counter()
+    await asyncio.gather(*(pool.parse_scored(t) for t in texts))
+    elapsed = time.perf_counter() - t0
+    stop.set()
+    await hb
+    pool.shutdown()
+
+    stalls.sort()
+    print(json.dumps({
+        "workers": workers,
+        "messages": n,
+        "msgs_per_sec": int(n / elapsed),
+        "loop_stall_p50_ms": round(stalls[len(stalls) // 2] * 1000, 2) if stalls else None,
+        "loop_stall_max_ms": round(stalls[-1] * 1000, 2) if stalls else None,
+        "pool": pool.snapshot(),
+    }, indent=2))
+
+
+if __name__ == "__main__":
+    if len(sys.argv) > 2 and sys.argv[1] == "bench":
+        args = sys.argv[3:]
+        workers = int(args[args.index("--workers") + 1]) if "--workers" in args else (os.cpu_count() or 1)
+        n = int(args[args.index("--n") + 1]) if "--n" in args else 2000
+        asyncio.run(_bench(sys.argv[2], workers, n))
+    else:
+        print("Usage: python lib/parse_pool.py bench <corpus.jsonl> [--workers N] [--n 2000]")
@@ -1,28 +1,80 @@
+import os
 import re
 from typing import List, Optional, Tuple, Dict, Any
 from pydantic import BaseModel, field_validator
-import spacy
-from spacy.matcher import Matcher
 
-# Lightweight, rule-based spaCy (no external model required)
-nlp = spacy.blank("en")
-matcher = Matcher(nlp.vocab)
+try:
+    from lib.symbols import find_symbol
+except ImportError:  # running from lib/ (tele_agent.py)
+    from symbols import find_symbol
+
+# ---------- ENV ----------
+PARSER_BACKEND = os.getenv("PARSER_BACKEND", "spacy")  # spacy | regex (lib/parser_regex.py, no spaCy import)
 
 # Basic number token rule
 _NUM = {"TEXT": {"REGEX": r"^[0-9]+(?:[.,][0-9]+)?$"}}
 _DASH = {"TEXT": {"REGEX": r"[-–—]"}}
 
-# Side
-matcher.add("SIDE", [[{"LOWER": {"IN": ["long", "short", "buy", "sell"]}}]])
-# Entry range / single
-matcher.add("ENTRY_RANGE", [[{"LOWER": {"IN": ["entry", "entryzone", "entry_zone", "entry-area", "entryrange"]}},
-                              {"IS_PUNCT": True, "OP": "?"},
-                              _NUM, _DASH, _NUM]])
-matcher.add("ENTRY_SINGLE", [[{"LOWER": "entry"}, {"IS_PUNCT": True, "OP": "?"}, _NUM]])
-# Targets / Take / TP
-matcher.add("TARGET", [[{"LOWER": {"IN": ["target", "tp", "take"]}}, {"IS_DIGIT": True, "OP": "?"}, {"IS_PUNCT": True, "OP": "?"}, _NUM]])
-# Stop / SL
-matcher.add("STOP", [[{"LOWER": {"IN": ["stop", "sl", "stoploss", "stop-loss"]}}, {"IS_PUNCT": True, "OP": "?"}, _NUM]])
+# Match kinds (hot path compares ints, no vocab string lookups)
+SIDE, ENTRY_RANGE, ENTRY_SINGLE, TARGET, STOP = range(5)
+
+# Token patterns in spaCy Matcher syntax; every backend runs exactly these
+PATTERNS = [
+    # Side
+    (SIDE, "SIDE", [{"LOWER": {"IN": ["long", "short", "buy", "sell"]}}]),
+    # Entry range / single
+    (ENTRY_RANGE, "ENTRY_RANGE", [{"LOWER": {"IN": ["entry", "entryzone", "entry_zone", "entry-area", "entryrange"]}},
+                                  {"IS_PUNCT": True, "OP": "?"},
+                                  _NUM, _DASH, _NUM]),
+    (ENTRY_SINGLE, "ENTRY_SINGLE", [{"LOWER": "entry"}, {"IS_PUNCT": True, "OP": "?"}, _NUM]),
+    # Targets / Take / TP
+    (TARGET, "TARGET", [{"LOWER": {"IN": ["target", "tp", "take"]}}, {"IS_DIGIT": True, "OP": "?"}, {"IS_PUNCT": True, "OP": "?"}, _NUM]),
+    # Stop / SL
+    (STOP, "STOP", [{"LOWER": {"IN": ["stop", "sl", "stoploss", "stop-loss"]}}, {"IS_PUNCT": True, "OP": "?"}, _NUM]),
+]
+_NUM_RE = re.compile(r"^[0-9]+(?:[.,][0-9]+)?$")
+
+
+class SpacyBackend:
+    """Lightweight, rule-based spaCy (no external model required)."""
+    name = "spacy"
+
+    def __init__(self, patterns=PATTERNS):
+        import spacy
+        from spacy.matcher import Matcher
+        self.nlp = spacy.blank("en")
+        self.matcher = Matcher(self.nlp.vocab)
+        self._kinds = {}
+        for kind, name, steps in patterns:
+            self.matcher.add(name, [steps])
+            self._kinds[self.nlp.vocab.strings.add(name)] = kind
+
+    def scan(self, text: str) -> Tuple[List[str], List[Tuple[int, int, int]]]:
+        """Token texts plus (kind, start, end) matches in Matcher order."""
+        doc = self.nlp(text)
+        kinds = self._kinds
+        return [t.text for t in doc], [(kinds[mid], s, e) for mid, s, e in self.matcher(doc)]
+
+
+_backends: Dict[str, Any] = {}
+
+def get_backend(name: Optional[str] = None):
+    """Shared backend instance by name (defaults to PARSER_BACKEND); built on first use."""
+    name = (name or PARSER_BACKEND).lower()
+    backend = _backends.get(name)
+    if backend is None:
+        if name == "spacy":
+            backend = SpacyBackend()
+        elif name == "regex":
+            try:
+                from lib.parser_regex import RegexBackend
+            except ImportError:  # running from lib/ (tele_agent.py)
+                from parser_regex import RegexBackend
+            backend = RegexBackend(PATTERNS)
+        else:
+            raise ValueError(f"Unknown parser backend: {name!r} (expected spacy or regex)")
+        _backends[name] = backend
+    return backend
 
 class TradeSignal(BaseModel):
     symbol: str
@@ -42,16 +94,63 @@ class TradeSignal(BaseModel):
 def _f(x: str) -> float:
     return float(x.replace(",", "").strip())
 
-def parse_trade_signal(raw_text: str, hints: Optional[Dict[str, Any]] = None) -> Optional[Dict[str, Any]]:
+# Completeness scoring (tiered ingest: deterministic first, LLM only when needed)
+_FIELD_WEIGHTS = {"symbol": 0.25, "side": 0.25, "entry": 0.25, "sl": 0.15, "tp": 0.10}
+# Words the symbol regex can grab that are never instruments
+_NOT_SYMBOLS = {"LONG", "SHORT", "BUY", "SELL", "ENTRY", "TARGET", "TARGETS", "STOP", "LOSS",
+                "TAKE", "PROFIT", "ZONE", "SIGNAL", "LEVERAGE", "CROSS", "TERM", "MID"}
+
+def parse_trade_signal(raw_text: str, hints: Optional[Dict[str, Any]] = None,
+                       backend: Optional[str] = None) -> Optional[Dict[str, Any]]:
     """
     Final deterministic structuring. Accepts optional LLM hints:
       hints = {symbol, side, entry:[low,high?], targets:[], stop, timeframe}
     Returns dict compatible with your current DB usage:
       {"action": "buy|sell", "symbol": "WLDUSDT", "entry_min": 1.01, "entry_max": 1.04, "sl": 1.0, "tp": [..]}
+    backend picks the tokenizer/matcher ("spacy" | "regex"); default is PARSER_BACKEND.
+    """
+    return _build(_extract(raw_text, hints, backend))
+
+def parse_trade_signal_scored(raw_text: str, hints: Optional[Dict[str, Any]] = None,
+                              backend: Optional[str] = None) -> Tuple[Optional[Dict[str, Any]], float, List[str]]:
     """
+    parse_trade_signal plus a completeness score in [0, 1] and the list of missing
+    or ambiguous fields, e.g. (result, 0.75, ["sl", "ambiguous:side"]).
+    """
+    fields = _extract(raw_text, hints, backend)
+    result = _build(fields)
+
+    issues: List[str] = []
+    present = {
+        "symbol": bool(fields["symbol"]),
+        "side": bool(fields["side"]),
+        "entry": fields["entry"][0] is not None,
+        "sl": fields["stop"] is not None,
+        "tp": bool(fields["targets"]),
+    }
+    ambiguous = set()
+    if fields["symbol"] and fields["symbol"].upper() in _NOT_SYMBOLS:
+        ambiguous.add("symbol")
+    if len(fields["sides"]) > 1:
+        ambiguous.add("side")
+    if result is None and present["entry"]:
+        ambiguous.add("entry")  # extracted but failed the sanity checks
+
+    score = 0.0
+    for name, weight in _FIELD_WEIGHTS.items():
+        if not present[name]:
+            issues.append(name)
+        elif name in ambiguous:
+            issues.append(f"ambiguous:{name}")
+        else:
+            score += weight
+    return result, round(score, 4), issues
+
+def _extract(raw_text: str, hints: Optional[Dict[str, Any]] = None,
+             backend: Optional[str] = None) -> Dict[str, Any]:
     hints = hints or {}
     text_norm = raw_text.replace("–", "-").replace("—", "-")
-    doc = nlp(text_norm)
+    tokens, matches = get_backend(backend).scan(text_norm)
     upper = text_norm.upper()
 
     # Symbol heuristic (prefer hints)
@@ -59,32 +158,13 @@ def parse_trade_signal(raw_text: str, hints: Optional[Dict[str, Any]] = None) ->
 
     # Timeframe (prefer hints)
     timeframe = (hints.get("timeframe") or None)
-    # Side
-    side = hints.get("side") or _first_match(doc, "SIDE")
-    # Entry
+
     entry = hints.get("entry")
     entry_tuple: Tuple[Optional[float], Optional[float]] = (None, None)
-
-    matches = matcher(doc)
     targets: List[float] = list(hints.get("targets") or [])
     stop = hints.get("stop")
 
-    if not entry:
-        name = None
-        for mid, s, e in matches:
-            name = nlp.vocab.strings[mid]
-            span = doc[s:e]
-            if name == "ENTRY_RANGE" and entry_tuple == (None, None):
-                nums = [t.text for t in span if re.match(r"^[0-9]+(?:[.,][0-9]+)?$", t.text)]
-                if len(nums) >= 2:
-                    a, b = _f(nums[0]), _f(nums[1])
-                    entry_tuple = (min(a, b), max(a, b))
-            elif name == "ENTRY_SINGLE" and entry_tuple == (None, None):
-                nums = [t.text for t in span if re.match(r"^[0-9]+(?:[.,][0-9]+)?$", t.text)]
-                if nums:
-                    p = _f(nums[0])
-                    entry_tuple = (p, p)
-    else:
+    if entry:
         # Hints entry array → tuple
         if len(entry) == 1:
             entry_tuple = (float(entry[0]), float(entry[0]))
@@ -92,19 +172,53 @@ def parse_trade_signal(raw_text: str, hints: Optional[Dict[str, Any]] = None) ->
             a, b = float(entry[0]), float(entry[1])
             entry_tuple = (min(a, b), max(a, b))
 
-    # Targets/Stop from text if not in hints
-    if not targets:
-        for mid, s, e in matches:
-            if nlp.vocab.strings[mid] == "TARGET":
-                nums = [t.text for t in doc[s:e] if re.match(r"^[0-9]+(?:[.,][0-9]+)?$", t.text)]
+    # Single pass over the matches fills every field the hints did not provide.
+    # Order matters and mirrors the old per-field walks: first SIDE wins, first
+    # usable ENTRY_* wins, every TARGET appends, the last STOP wins.
+    need_entry, need_targets, need_stop = not entry, not targets, stop is None
+    first_side = None
+    sides = set()
+    for kind, s, e in matches:
+        if kind == SIDE:
+            word = tokens[s]
+            if first_side is None:
+                first_side = word
+            sides.add(_SIDE_NORM.get(word.lower()))
+        elif kind == TARGET:
+            if need_targets:
+                nums = _span_nums(tokens, s, e)
                 if nums:
                     targets.append(_f(nums[-1]))
-    if stop is None:
-        for mid, s, e in matches:
-            if nlp.vocab.strings[mid] == "STOP":
-                nums = [t.text for t in doc[s:e] if re.match(r"^[0-9]+(?:[.,][0-9]+)?$", t.text)]
+        elif kind == STOP:
+            if need_stop:
+                nums = _span_nums(tokens, s, e)
                 if nums:
                     stop = _f(nums[-1])
+        elif need_entry and entry_tuple[0] is None:
+            if kind == ENTRY_RANGE:
+                nums = _span_nums(tokens, s, e)
+                if len(nums) >= 2:
+                    a, b = _f(nums[0]), _f(nums[1])
+                    entry_tuple = (min(a, b), max(a, b))
+            elif kind == ENTRY_SINGLE:
+                nums = _span_nums(tokens, s, e)
+                if nums:
+                    p = _f(nums[0])
+                    entry_tuple = (p, p)
+
+    side = hints.get("side") or first_side
+
+    return {"symbol": symbol, "side": side, "entry": entry_tuple, "targets": targets,
+            "stop": stop, "timeframe": timeframe, "sides": sides}
+
+def _span_nums(tokens: List[str], start: int, end: int) -> List[str]:
+    return [t for t in tokens[start:end] if _NUM_RE.match(t)]
+
+_SIDE_NORM = {"long": "LONG", "buy": "LONG", "short": "SHORT", "sell": "SHORT"}
+
+def _build(fields: Dict[str, Any]) -> Optional[Dict[str, Any]]:
+    symbol, side, entry_tuple = fields["symbol"], fields["side"], fields["entry"]
+    stop, targets, timeframe = fields["stop"], fields["targets"], fields["timeframe"]
 
     # Validation (required)
     if not (symbol and side and entry_tuple[0] is not None):
@@ -125,15 +239,14 @@ def parse_trade_signal(raw_text: str, hints: Optional[Dict[str, Any]] = None) ->
     }
 
 def _extract_symbol(upper_text: str) -> Optional[str]:
+    # Broker catalog first (aliases like GOLD, suffixes like EURUSD.m, <BASE>/USDT pairs),
+    # then the old "first uppercase run" guess for instruments it does not know
+    symbol = find_symbol(upper_text)
+    if symbol:
+        return symbol
     m = re.search(r"#?([A-Z]{3,12}(?:USDT|USD|JPY|BTC|ETH)?)", upper_text)
     return m.group(1).upper() if m else None
 
-def _first_match(doc, name: str) -> Optional[str]:
-    for mid, s, e in matcher(doc):
-        if nlp.vocab.strings[mid] == name:
-            return doc[s:e].text
-    return None
-
 
 # Old Parsing Tech
 # def parse_trade_signal(raw_text: str) -> dict:
@@ -0,0 +1,320 @@
+# lib/parser_regex.py
+# spaCy-free backend for parse_trade_signal: a pure-Python port of the spaCy
+# tokenizer algorithm (whitespace split -> prefix/suffix stripping with special
+# cases -> infix split -> special-case retokenization) driven by the English rules
+# exported to data/tokenizer_en.json, plus a small token-pattern state machine that
+# runs the same Matcher patterns as the spaCy backend.
+#
+# The rules file is generated from spaCy once (only this command needs spaCy):
+#   python lib/parser_regex.py export-rules
+import os
+import re
+import sys
+import json
+import unicodedata
+from typing import Any, Dict, List, Sequence, Tuple
+
+RULES_PATH = os.getenv("TOKENIZER_RULES", os.path.join(os.path.dirname(os.path.abspath(__file__)),
+                                                        "data", "tokenizer_en.json"))
+_CACHE_SIZE = 10000  # same bound as spaCy's per-chunk cache
+_RUNS = re.compile(r"\s+|\S+")  # \s is str.isspace() for str patterns
+
+
+def _is_punct(text: str) -> bool:
+    for ch in text:
+        if not unicodedata.category(ch).startswith("P"):
+            return False
+    return True
+
+
+class Tokenizer:
+    """Token texts identical to spacy.blank("en").tokenizer for the same rules."""
+
+    def __init__(self, rules_path: str = None):
+        with open(rules_path or RULES_PATH, encoding="utf-8") as f:
+            rules = json.load(f)
+        self._prefix = re.compile(rules["prefix"]).search
+        self._suffix = re.compile(rules["suffix"]).search
+        self._infix = re.compile(rules["infix"]).finditer
+        self._url = re.compile(rules["url"]).match
+        self.specials: Dict[str, List[str]] = rules["specials"]
+        self._cache: Dict[str, List[str]] = {}
+
+        # Specials that contain affixes/spaces are also applied after tokenization by
+        # matching their affix-tokenized form (spaCy's _special_matcher)
+        self._phrases: Dict[Tuple[str, ...], None] = {}
+        self._phrase_firsts = set()
+        self._phrase_max = 0
+        for orth in self.specials:
+            if self._find_prefix(orth) or self._find_suffix(orth) or \
+                    any(True for _ in self._infix(orth)) or " " in orth:
+                toks = tuple(t for t, _ in self._tokenize_affixes(orth, False))
+                if toks:
+                    self._phrases[toks] = None
+                    self._phrase_firsts.add(toks[0])
+                    self._phrase_max = max(self._phrase_max, len(toks))
+
+    def _find_prefix(self, s: str) -> int:
+        m = self._prefix(s)
+        return m.end() - m.start() if m else 0
+
+    def _find_suffix(self, s: str) -> int:
+        m = self._suffix(s)
+        return m.end() - m.start() if m else 0
+
+    def __call__(self, text: str) -> List[str]:
+        toks = self._tokenize_affixes(text, True)
+        if self._phrases:
+            toks = self._apply_special_cases(toks)
+        return [t for t, _ in toks]
+
+    def _tokenize_affixes(self, text: str, with_specials: bool) -> List[list]:
+        out: List[list] = []  # [text, followed_by_space]
+        if not text:
+            return out
+        # spaCy splits on isspace() transitions; a single ' ' after a token becomes its
+        # trailing-space flag, any other whitespace run is a token of its own
+        for m in _RUNS.finditer(text):
+            run = m.group()
+            if not run[0].isspace():
+                self._chunk(run, out, with_specials)
+                continue
+            if run[0] == " " and m.start() > 0:
+                out[-1][1] = True
+                run = run[1:]
+            if run:
+                self._chunk(run, out, with_specials)
+        return out
+
+    def _specials_or_cache(self, span: str, out: List[list], with_specials: bool) -> bool:
+        if with_specials:
+            special = self.specials.get(span)
+            if special is not None:
+                out.extend([t, False] for t in special)
+                return True
+        cached = self._cache.get(span)
+        if cached is not None:
+            out.extend([t, False] for t in cached)
+            return True
+        return False
+
+    def _chunk(self, span: str, out: List[list], with_specials: bool):
+        if self._specials_or_cache(span, out, with_specials):
+            return
+        n = len(out)
+        prefixes, suffixes = [], []
+        core = self._split_affixes(span, prefixes, suffixes, with_specials)
+        out.extend([p, False] for p in prefixes)
+        if core and not self._specials_or_cache(core, out, with_specials):
+            if self._url(core):
+                out.append([core, False])
+            else:
+                self._split_infixes(core, out)
+        out.extend([s, False] for s in reversed(suffixes))
+        # spaCy does not cache chunks that hit a special case because those tokens carry
+        # extra attributes; we only keep token texts, so every chunk can be cached
+        if with_specials and len(self._cache) < _CACHE_SIZE:
+            self._cache[span] = [t for t, _ in out[n:]]
+
+    def _split_affixes(self, s: str, prefixes: list, suffixes: list, with_specials: bool) -> str:
+        specials = self.specials if with_specials else {}
+        last_size = 0
+        while s and len(s) != last_size:
+            if s in specials:
+                break
+            last_size = len(s)
+            pre_len = self._find_prefix(s)
+            if pre_len:
+                prefix, minus_pre = s[:pre_len], s[pre_len:]
+                if minus_pre and minus_pre in specials:
+                    prefixes.append(prefix)
+                    s = minus_pre
+                    break
+            suf_len = self._find_suffix(s[pre_len:])
+            if suf_len:
+                suffix, minus_suf = s[-suf_len:], s[:-suf_len]
+                if minus_suf and minus_suf in specials:
+                    suffixes.append(suffix)
+                    s = minus_suf
+                    break
+            if pre_len and suf_len and pre_len + suf_len <= len(s):
+                prefixes.append(prefix)
+                suffixes.append(suffix)
+                s = s[pre_len:-suf_len]
+            elif pre_len:
+                prefixes.append(prefix)
+                s = minus_pre
+            elif suf_len:
+                suffixes.append(suffix)
+                s = minus_suf
+        return s
+
+    def _split_infixes(self, s: str, out: List[list]):
+        start = 0
+        for m in self._infix(s):
+            a, b = m.start(), m.end()
+            if a == 0:
+                continue
+            if a != start:
+                out.append([s[start:a], False])
+            if a != b:
+                out.append([s[a:b], False])
+            start = b
+        if start < len(s):
+            out.append([s[start:], False])
+
+    def _apply_special_cases(self, toks: List[list]) -> List[list]:
+        texts = [t for t, _ in toks]
+        found = []
+        for i, t in enumerate(texts):
+            if t not in self._phrase_firsts:
+                continue
+            for n in range(1, min(self._phrase_max, len(texts) - i) + 1):
+                if tuple(texts[i:i + n]) in self._phrases:
+                    found.append((i, i + n))
+        if not found:
+            return toks
+
+        # longest first, then leftmost; drop spans overlapping an accepted one
+        found.sort(key=lambda se: (se[1] - se[0], -se[0]))
+        seen, keep = set(), []
+        for s, e in reversed(found):
+            if s not in seen and e - 1 not in seen:
+                keep.append((s, e))
+            seen.update(range(s, e))
+        keep.sort()
+
+        out, i, k = [], 0, 0
+        while i < len(toks):
+            if k < len(keep) and keep[k][0] == i:
+                s, e = keep[k]
+                k += 1
+                span_text = "".join(t + (" " if sp else "") for t, sp in toks[s:e - 1]) + toks[e - 1][0]
+                special = self.specials.get(span_text)
+                if special is None:
+                    out.extend(toks[s:e])
+                else:
+                    out.extend([t, False] for t in special)
+                    out[-1][1] = toks[e - 1][1]
+                i = e
+            else:
+                out.append(toks[i])
+                i += 1
+        return out
+
+
+class _Step:
+    """One token slot of a Matcher pattern (the subset of keys parser.py uses)."""
+
+    def __init__(self, spec: Dict[str, Any]):
+        self.optional = spec.get("OP") == "?"
+        # words this slot accepts when it is a plain required LOWER test (lets the
+        # matcher start patterns from a dict lookup instead of trying every token)
+        self.words = None
+        if not self.optional and set(spec) == {"LOWER"}:
+            val = spec["LOWER"]
+            self.words = frozenset(val["IN"]) if isinstance(val, dict) else frozenset([val])
+        tests = []
+        for key, val in spec.items():
+            if key == "OP":
+                continue
+            if key == "LOWER":
+                if isinstance(val, dict):
+                    allowed = frozenset(val["IN"])
+                    tests.append(lambda t, a=allowed: t.lower() in a)
+                else:
+                    tests.append(lambda t, v=val: t.lower() == v)
+            elif key == "TEXT":
+                rx = re.compile(val["REGEX"])
+                tests.append(lambda t, r=rx: r.search(t) is not None)
+            elif key == "IS_PUNCT":
+                tests.append(lambda t, v=bool(val): _is_punct(t) == v)
+            elif key == "IS_DIGIT":
+                tests.append(lambda t, v=bool(val): t.isdigit() == v)
+            else:
+                raise ValueError(f"Unsupported pattern key for regex backend: {key}")
+        self.tests = tests
+
+    def __call__(self, tok: str) -> bool:
+        for test in self.tests:
+            if not test(tok):
+                return False
+        return True
+
+
+class PatternMatcher:
+    """All (kind, start, end) matches of token patterns, ordered like spaCy's Matcher."""
+
+    def __init__(self, patterns: Sequence[Tuple[int, str, List[Dict[str, Any]]]]):
+        self.patterns = [(kind, [_Step(s) for s in steps]) for kind, _name, steps in patterns]
+        self._by_first: Dict[str, List[int]] = {}
+        self._anywhere: List[int] = []
+        for order, (_kind, steps) in enumerate(self.patterns):
+            if steps[0].words is None:
+                self._anywhere.append(order)
+            else:
+                for w in steps[0].words:
+                    self._by_first.setdefault(w, []).append(order)
+
+    def __call__(self, tokens: Sequence[str]) -> List[Tuple[int, int, int]]:
+        n = len(tokens)
+        found = set()
+        for i, tok in enumerate(tokens):
+            for order in self._by_first.get(tok.lower(), ()):
+                kind, steps = self.patterns[order]
+                for end in self._ends(steps, 1, tokens, i + 1, n):
+                    found.add((end, order, i, kind))
+            for order in self._anywhere:
+                kind, steps = self.patterns[order]
+                for end in self._ends(steps, 0, tokens, i, n):
+                    found.add((end, order, i, kind))
+        # spaCy reports matches as they complete: by end token, then pattern order
+        return [(kind, start, end) for end, _, start, kind in sorted(found)]
+
+    def _ends(self, steps, si: int, tokens, ti: int, n: int):
+        if si == len(steps):
+            yield ti
+            return
+        step = steps[si]
+        if ti < n and step(tokens[ti]):
+            yield from self._ends(steps, si + 1, tokens, ti + 1, n)
+        if step.optional:
+            yield from self._ends(steps, si + 1, tokens, ti, n)
+
+
+class RegexBackend:
+    name = "regex"
+
+    def __init__(self, patterns: Sequence[Tuple[int, str, List[Dict[str, Any]]]], rules_path: str = None):
+        self.tokenizer = Tokenizer(rules_path)
+        self.matcher = PatternMatcher(patterns)
+
+    def scan(self, text: str) -> Tuple[List[str], List[Tuple[int, int, int]]]:
+        tokens = self.tokenizer(text)
+        return tokens, self.matcher(tokens)
+
+
+def export_rules(path: str = None):
+    """Dump spacy.blank("en") tokenizer rules to the JSON file the regex backend loads."""
+    import spacy
+    tok = spacy.blank("en").tokenizer
+    rules = {
+        "spacy_version": spacy.__version__,
+        "prefix": tok.prefix_search.__self__.pattern,
+        "suffix": tok.suffix_search.__self__.pattern,
+        "infix": tok.infix_finditer.__self__.pattern,
+        "url": tok.url_match.__self__.pattern,
+        "specials": {orth: [t[65] for t in toks] for orth, toks in tok.rules.items()},  # 65 == ORTH
+    }
+    path = path or RULES_PATH
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    with open(path, "w", encoding="utf-8") as f:
+        json.dump(rules, f, ensure_ascii=False, separators=(",", ":"))
+    print(f"Wrote {path} ({len(rules['specials'])} special cases, spaCy {spacy.__version__})")
+
+
+if __name__ == "__main__":
+    if len(sys.argv) > 1 and sys.argv[1] == "export-rules":
+        export_rules(sys.argv[2] if len(sys.argv) > 2 else None)
+    else:
+        print("Usage: python lib/parser_regex.py export-rules [path]")
@@ -0,0 +1,178 @@
+# lib/prefilter.py
+# Cheap "is this even a signal?" check that runs before the group_sources lookup,
+# the LLM and spaCy. One compiled multi-keyword scanner counts side words and
+# entry/TP/SL markers, plus how dense the numbers are; chatter, PnL posts and
+# promos fail it in microseconds.
+#
+#   python lib/prefilter.py eval bench/corpus.jsonl      # precision/recall + msgs/sec
+import os
+import re
+import sys
+import json
+import time
+from dataclasses import dataclass, asdict, replace
+from typing import Dict, Optional
+
+# ---------- ENV ----------
+PREFILTER_ENABLED = os.getenv("PREFILTER", "1") not in ("0", "false", "no")
+PREFILTER_OVERRIDES = os.getenv("PREFILTER_OVERRIDES", "")  # JSON file: {"<chat_id>": {"min_markers": 1, ...}}
+
+# One pass over the text; the named group that matched tells us the category
+_SCAN = re.compile(
+    r"(?P<side>\b(?:long|short|buy|sell)\b)"
+    r"|(?P<entry>\b(?:entry|entries|enter|entry[\s_-]?zone|limit|now)\b|@)"
+    r"|(?P<tp>\b(?:tp\d*|targets?|take[\s-]?profit)\b)"
+    r"|(?P<sl>\b(?:sl|stop|stop[\s-]?loss|stoploss|invalidation)\b)"
+    r"|(?P<num>(?<![\w.])\d+(?:[.,]\d+)?(?![\w]))",
+    re.IGNORECASE,
+)
+_CATEGORIES = ("side", "entry", "tp", "sl")
+_WORD = re.compile(r"\S+")
+
+
+@dataclass
+class PrefilterConfig:
+    enabled: bool = True
+    min_markers: int = 2          # distinct categories among side/entry/tp/sl ("BUY X 2350 SL 2340" has no TP)
+    min_numbers: int = 2          # price-like numbers
+    min_numeric_density: float = 0.08  # numbers / whitespace tokens
+    require_side: bool = False    # some channels never say long/short
+
+
+@dataclass
+class PrefilterStats:
+    checked: int = 0
+    passed: int = 0
+    dropped: int = 0
+
+
+def features(text: str) -> Dict[str, float]:
+    found = set()
+    numbers = 0
+    for m in _SCAN.finditer(text):
+        kind = m.lastgroup
+        if kind == "num":
+            numbers += 1
+        else:
+            found.add(kind)
+    words = len(_WORD.findall(text)) or 1
+    return {
+        "markers": len(found),
+        "side": "side" in found,
+        "numbers": numbers,
+        "density": numbers / words,
+    }
+
+
+def looks_like_signal(text: str, cfg: PrefilterConfig) -> bool:
+    if not cfg.enabled:
+        return True
+    f = features(text)
+    if f["numbers"] < cfg.min_numbers or f["markers"] < cfg.min_markers:
+        return False
+    if cfg.require_side and not f["side"]:
+        return False
+    return f["density"] >= cfg.min_numeric_density
+
+
+class Prefilter:
+    def __init__(self, default: PrefilterConfig = None, overrides: Dict[str, dict] = None):
+        self.default = default or PrefilterConfig(enabled=PREFILTER_ENABLED)
+        self.overrides: Dict[str, PrefilterConfig] = {}
+        for key, patch in (overrides or {}).items():
+            self.overrides[str(key)] = replace(self.default, **patch)
+        self.stats = PrefilterStats()
+
+    @classmethod
+    def from_env(cls) -> "Prefilter":
+        overrides = {}
+        if PREFILTER_OVERRIDES:
+            try:
+                with open(PREFILTER_OVERRIDES) as f:
+                    overrides = json.load(f)
+            except Exception as e:
+                print(f"[WARN] Could not load PREFILTER_OVERRIDES={PREFILTER_OVERRIDES}:", e)
+        return cls(overrides=overrides)
+
+    def config_for(self, chat_id=None) -> PrefilterConfig:
+        if chat_id is not None:
+            return self.overrides.get(str(chat_id), self.default)
+        return self.default
+
+    def check(self, text: str, chat_id=None) -> bool:
+        """True if the message may be a signal and should continue down the pipeline."""
+        ok = looks_like_signal(text, self.config_for(chat_id))
+        self.stats.checked += 1
+        if ok:
+            self.stats.passed += 1
+        else:
+            self.stats.dropped += 1
+        return ok
+
+    def snapshot(self) -> dict:
+        return asdict(self.stats)
+
+
+def evaluate(path: str, cfg: PrefilterConfig = None, min_secs: float = 1.0) -> dict:
+    """Run the filter over a JSONL corpus of {"text": ..., "is_signal": bool} rows."""
+    cfg = cfg or PrefilterConfig()
+    rows = []
+    with open(path, encoding="utf-8") as f:
+        for line in f:
+            if line.strip():
+                rows.append(json.loads(line))
+
+    tp = fp = fn = tn = 0
+    misses = []
+    for r in rows:
+        pred = looks_like_signal(r["text"], cfg)
+        if pred and r["is_signal"]:
+            tp += 1
+        elif pred:
+            fp += 1
+        elif r["is_signal"]:
+            fn += 1
+            misses.append(r["text"][:80])
+        else:
+            tn += 1
+
+    texts = [r["text"] for r in rows]
+    n = 0
+    t0 = time.perf_counter()
+    while time.perf_counter() - t0 < min_secs:
+        for t in texts:
+            looks_like_signal(t, cfg)
+        n += len(texts)
+    elapsed = time.perf_counter() - t0
+
+    return {
+        "messages": len(rows),
+        "precision": round(tp / (tp + fp), 4) if tp + fp else None,
+        "recall": round(tp / (tp + fn), 4) if tp + fn else None,
+        "dropped_noise": round(tn / (tn + fp), 4) if tn + fp else None,
+        "confusion": {"tp": tp, "fp": fp, "fn": fn, "tn": tn},
+        "msgs_per_sec": int(n / elapsed),
+        "us_per_msg": round(elapsed / n * 1e6, 2),
+        "missed_signals": misses,
+        "config": asdict(cfg),
+    }
+
+
+def main():
+    if len(sys.argv) < 3 or sys.argv[1] != "eval":
+        print("Usage: python lib/prefilter.py eval <corpus.jsonl> [--min-markers N] [--min-numbers N] "
+              "[--min-density X] [--require-side]")
+        sys.exit(0)
+    args = sys.argv[3:]
+    cfg = PrefilterConfig()
+    for flag, field, cast in (("--min-markers", "min_markers", int),
+                              ("--min-numbers", "min_numbers", int),
+                              ("--min-density", "min_numeric_density", float)):
+        if flag in args:
+            setattr(cfg, field, cast(args[args.index(flag) + 1]))
+    cfg.require_side = "--require-side" in args
+    print(json.dumps(evaluate(sys.argv[2], cfg), indent=2, ensure_ascii=False))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,126 @@
+# lib/route_cache.py
+# In-process TTL cache for the two lookups every allowed message used to pay for:
+#   (owner_user_id, chat_id) -> group_sources row   (None cached too: "no source")
+#   source_id                -> active copy_routes rows
+# Entries expire after ROUTE_CACHE_TTL_SECS, so a subscribe/unsubscribe made through the
+# bot (main.toggle_source, another process) reaches the agent within that bound; the
+# invalidate_* hooks drop entries immediately when a change notification arrives.
+import os
+import time
+from dataclasses import dataclass, asdict
+from typing import Any, Callable, Dict, Hashable, List, Optional, Tuple
+
+# ---------- ENV ----------
+ROUTE_CACHE_TTL_SECS = float(os.getenv("ROUTE_CACHE_TTL_SECS", "30"))
+ROUTE_CACHE_MAX = int(os.getenv("ROUTE_CACHE_MAX", "10000"))
+
+
+@dataclass
+class TTLStats:
+    hits: int = 0
+    misses: int = 0
+    expired: int = 0
+    invalidated: int = 0
+    load_errors: int = 0
+    stale_loads: int = 0     # loads overlapped by an invalidate(): returned, not cached
+
+
+class TTLCache:
+    def __init__(self, ttl_secs: float, max_entries: int = None):
+        self.ttl_secs = ttl_secs
+        self.max_entries = max_entries or ROUTE_CACHE_MAX
+        self._data: Dict[Hashable, Tuple[float, Any]] = {}
+        self._generation = 0     # bumped by invalidate(); a load may only store under its own
+        self.stats = TTLStats()
+
+    def __len__(self) -> int:
+        return len(self._data)
+
+    def get_or_load(self, key: Hashable, load: Callable[[], Any]) -> Any:
+        now = time.monotonic()
+        hit = self._data.get(key)
+        if hit is not None:
+            if now - hit[0] < self.ttl_secs:
+                self.stats.hits += 1
+                return hit[1]
+            self.stats.expired += 1
+        self.stats.misses += 1
+        generation = self._generation
+        try:
+            value = load()
+        except Exception:
+            self.stats.load_errors += 1
+            raise
+        if generation != self._generation:
+            # invalidated while loading (loads run in worker threads): the value may predate
+            # the change, so caching it would hide the change for a whole TTL
+            self.stats.stale_loads += 1
+            return value
+        if len(self._data) >= self.max_entries:
+            # dict keeps insertion order: drop the oldest tenth in one go
+            for k in list(self._data)[: max(1, self.max_entries // 10)]:
+                self._data.pop(k, None)   # loads run in worker threads: may already be gone
+        self._data[key] = (now, value)
+        return value
+
+    def invalidate(self, match: Callable[[Hashable], bool] = None) -> int:
+        """Drop every entry (match=None) or the ones whose key satisfies match."""
+        self._generation += 1
+        if match is None:
+            n = len(self._data)
+            self._data.clear()
+        else:
+            keys = [k for k in list(self._data) if match(k)]
+            for k in keys:
+                self._data.pop(k, None)
+            n = len(keys)
+        self.stats.invalidated += n
+        return n
+
+    def snapshot(self) -> dict:
+        snap = asdict(self.stats)
+        lookups = self.stats.hits + self.stats.misses
+        snap["size"] = len(self._data)
+        snap["hit_rate"] = round(self.stats.hits / lookups, 4) if lookups else None
+        return snap
+
+
+class RouteCache:
+    def __init__(self, ttl_secs: float = None):
+        ttl = ROUTE_CACHE_TTL_SECS if ttl_secs is None else ttl_secs
+        self.sources = TTLCache(ttl)   # (owner_user_id, chat_id) -> row | None
+        self.routes = TTLCache(ttl)    # source_id -> [route rows]
+
+    @property
+    def ttl_secs(self) -> float:
+        return self.sources.ttl_secs
+
+    def source(self, owner_user_id: str, chat_id, load: Callable[[], Optional[dict]]) -> Optional[dict]:
+        return self.sources.get_or_load((str(owner_user_id), str(chat_id)), load)
+
+    def active_routes(self, source_id, load: Callable[[], List[dict]]) -> List[dict]:
+        return self.routes.get_or_load(str(source_id), load)
+
+    # ---- invalidation hooks ----
+    def invalidate_source(self, owner_user_id: str = None, chat_id=None, source_id=None):
+        """Drop cached group_sources rows for an owner/chat (or a source id); no args = all."""
+        if owner_user_id is None and chat_id is None and source_id is None:
+            self.sources.invalidate()
+            return
+
+        def match(key):
+            cached = self.sources._data.get(key, (0, None))[1]
+            return ((owner_user_id is None or key[0] == str(owner_user_id))
+                    and (chat_id is None or key[1] == str(chat_id))
+                    and (source_id is None or (cached is not None and str(cached.get("id")) == str(source_id))))
+        self.sources.invalidate(match)
+
+    def invalidate_routes(self, source_id=None):
+        """Drop cached routes of one source (e.g. after a subscribe/unsubscribe); no args = all."""
+        if source_id is None:
+            self.routes.invalidate()
+        else:
+            self.routes.invalidate(lambda k: k == str(source_id))
+
+    def snapshot(self) -> dict:
+        return {"ttl_secs": self.ttl_secs, "sources": self.sources.snapshot(), "routes": self.routes.snapshot()}
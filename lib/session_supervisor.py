@@ -0,0 +1,280 @@
+# lib/session_supervisor.py
+# Keeps the running Telethon clients in line with user_sessions (is_active = true).
+#
+# run_all_sessions used to read user_sessions once, start every client and gather
+# run_until_disconnected: a new login needed an agent restart, a deactivated session
+# kept running and one crashed client took the gather (and every other session) down.
+#
+# Now each session row gets its own task that opens the client, runs it until it
+# disconnects and, if it fails, reopens it after a jittered exponential backoff
+# (SESSION_BACKOFF_BASE * 2^n, capped at SESSION_BACKOFF_MAX, times 0.5-1.0). The
+# failure count resets once a client has stayed up SESSION_STABLE_SECS. Errors listed
+# as fatal (revoked/unregistered auth keys) park the session until its row changes.
+#
+# Every SESSION_RECONCILE_SECS (or right away on poke(), e.g. from the change feed)
+# the active rows are diffed with the running set by row id: new rows are started,
+# rows gone or deactivated are stopped, rows whose session string changed are
+# restarted. Other sessions are never touched.
+#
+# Clients connect concurrently, at most SESSION_START_CONCURRENCY at a time; each
+# session starts watching as soon as its own client is up. A FloodWait while opening
+# only reschedules that session (after the wait Telegram asked for, not counted as a
+# failure) and frees its start slot for the others. Time from the first reconcile to
+# the first and to the last initial session being up is logged and in snapshot().
+import os
+import time
+import random
+import asyncio
+import hashlib
+from dataclasses import dataclass, asdict
+from typing import Any, Awaitable, Callable, Dict, Iterable, List, Optional, Tuple, Type
+
+# ---------- ENV ----------
+SESSION_RECONCILE_SECS = float(os.getenv("SESSION_RECONCILE_SECS", "30"))
+SESSION_BACKOFF_BASE = float(os.getenv("SESSION_BACKOFF_BASE", "2"))
+SESSION_BACKOFF_MAX = float(os.getenv("SESSION_BACKOFF_MAX", "300"))
+SESSION_STABLE_SECS = float(os.getenv("SESSION_STABLE_SECS", "120"))
+SESSION_START_CONCURRENCY = int(os.getenv("SESSION_START_CONCURRENCY", "8"))
+
+# states
+STARTING, RUNNING, BACKOFF, FLOOD_WAIT, PARKED, STOPPED = \
+    "starting", "running", "backoff", "flood_wait", "parked", "stopped"
+
+
+def backoff_delay(failures: int, base: float = None, cap: float = None) -> float:
+    """Seconds before attempt number failures+1; exponential, capped, with 50% jitter."""
+    base = SESSION_BACKOFF_BASE if base is None else base
+    cap = SESSION_BACKOFF_MAX if cap is None else cap
+    return min(cap, base * (2 ** max(0, failures - 1))) * random.uniform(0.5, 1.0)
+
+
+def _version(row: dict) -> str:
+    # what requires a reconnect when it changes; never keep/log the session string itself
+    raw = f"{row.get('telegram_user_id')}:{row.get('session_string')}"
+    return hashlib.blake2b(raw.encode(), digest_size=8).hexdigest()
+
+
+@dataclass
+class SessionHealth:
+    row_id: str
+    owner_user_id: str
+    telegram_user_id: Optional[int]
+    state: str = STARTING
+    starts: int = 0
+    restarts: int = 0
+    failures: int = 0              # consecutive; drives the backoff
+    last_error: Optional[str] = None
+    up_since: Optional[float] = None
+    retry_at: Optional[float] = None
+
+
+@dataclass
+class SupervisorStats:
+    reconciles: int = 0
+    reconcile_errors: int = 0
+    started: int = 0
+    stopped: int = 0
+    restarted: int = 0             # after a failure or disconnect
+    flood_waits: int = 0           # opens rescheduled by a FloodWait
+    replaced: int = 0              # row changed (new session string)
+    last_reconcile_ms: float = 0.0
+    first_ready_secs: Optional[float] = None   # first reconcile -> first session up
+    all_ready_secs: Optional[float] = None     # first reconcile -> every initial session up (or parked)
+
+
+class _Managed:
+    __slots__ = ("row", "version", "health", "task", "handle")
+
+    def __init__(self, row: dict):
+        self.row = row
+        self.version = _version(row)
+        self.health = SessionHealth(str(row["id"]), row.get("owner_user_id"), row.get("telegram_user_id"))
+        self.task: Optional[asyncio.Task] = None
+        self.handle: Any = None
+
+
+class SessionSupervisor:
+    """
+    fetch_rows(): blocking, returns the active user_sessions rows (run in a thread).
+    open(row) -> handle: connect + authorize the client and register its handlers.
+    run(handle): returns/raises when the client disconnects.
+    close(handle): disconnect and unregister (must not raise for a half-open handle).
+    flood_wait(exc) -> seconds Telegram asked us to wait, or None for other errors.
+    """
+
+    def __init__(self, fetch_rows: Callable[[], Iterable[dict]],
+                 open: Callable[[dict], Awaitable[Any]],
+                 run: Callable[[Any], Awaitable[Any]],
+                 close: Callable[[Any], Awaitable[Any]],
+                 fatal: Tuple[Type[BaseException], ...] = (),
+                 flood_wait: Callable[[BaseException], Optional[float]] = None,
+                 reconcile_secs: float = None, start_concurrency: int = None):
+        self.fetch_rows = fetch_rows
+        self.open, self.run_client, self.close = open, run, close
+        self.fatal = fatal
+        self.flood_wait = flood_wait or (lambda e: None)
+        self.reconcile_secs = reconcile_secs or SESSION_RECONCILE_SECS
+        self._start_slots = asyncio.Semaphore(max(1, start_concurrency or SESSION_START_CONCURRENCY))
+        self._t0: Optional[float] = None
+        self._initial: Optional[set] = None   # row ids of the first reconcile not up yet
+        self._managed: Dict[str, _Managed] = {}
+        self._poke = asyncio.Event()
+        self._lock = asyncio.Lock()   # one reconcile at a time
+        self.stats = SupervisorStats()
+
+    # ---- per session ----
+    async def _supervise(self, m: _Managed):
+        h = m.health
+        while True:
+            h.state = STARTING
+            h.starts += 1
+            try:
+                async with self._start_slots:
+                    m.handle = await self.open(m.row)
+                h.state, h.up_since, h.retry_at = RUNNING, time.monotonic(), None
+                print(f"[INFO] session {h.row_id} up (owner={h.owner_user_id} tg_user={h.telegram_user_id})")
+                self._ready(h.row_id)
+                await self.run_client(m.handle)
+                h.last_error = "disconnected"
+            except asyncio.CancelledError:
+                raise
+            except self.fatal as e:
+                h.last_error = repr(e)
+                h.state, h.up_since = PARKED, None
+                print(f"[ERR] session {h.row_id} parked until its row changes:", h.last_error)
+                await self._close(m)
+                self._ready(h.row_id)
+                return
+            except Exception as e:
+                h.last_error = repr(e)
+                wait = self.flood_wait(e) if m.handle is None else None
+                if wait is not None:
+                    # Telegram told us when to come back: not a failure, no backoff growth
+                    wait = float(wait) * random.uniform(1.0, 1.1)
+                    h.state, h.retry_at = FLOOD_WAIT, time.monotonic() + wait
+                    self.stats.flood_waits += 1
+                    print(f"[WARN] session {h.row_id} flood wait while starting; retry in {wait:.1f}s")
+                    await asyncio.sleep(wait)
+                    continue
+            await self._close(m)
+
+            up = time.monotonic() - h.up_since if h.up_since else 0.0
+            h.failures = 1 if up >= SESSION_STABLE_SECS else h.failures + 1
+            delay = backoff_delay(h.failures)
+            h.state, h.up_since, h.retry_at = BACKOFF, None, time.monotonic() + delay
+            h.restarts += 1
+            self.stats.restarted += 1
+            print(f"[WARN] session {h.row_id} down ({h.last_error}); retry {h.failures} in {delay:.1f}s")
+            await asyncio.sleep(delay)
+
+    async def _close(self, m: _Managed):
+        if m.handle is None:
+            return
+        handle, m.handle = m.handle, None
+        try:
+            await self.close(handle)
+        except Exception as e:
+            print(f"[WARN] session {m.health.row_id} close failed:", repr(e))
+
+    def _ready(self, row_id: str):
+        """row_id is up (or parked/stopped): update time-to-first/all-ready."""
+        if self._t0 is None:
+            return
+        elapsed = round(time.monotonic() - self._t0, 2)
+        m = self._managed.get(row_id)
+        if self.stats.first_ready_secs is None and m is not None and m.health.state == RUNNING:
+            self.stats.first_ready_secs = elapsed
+            print(f"[INFO] first session ready after {elapsed}s")
+        if self._initial:
+            self._initial.discard(row_id)
+            if not self._initial:
+                self.stats.all_ready_secs = elapsed
+                print(f"[INFO] all initial sessions ready after {elapsed}s")
+
+    def _start(self, row: dict):
+        m = _Managed(row)
+        self._managed[m.health.row_id] = m
+        m.task = asyncio.create_task(self._supervise(m))
+        self.stats.started += 1
+
+    async def _stop(self, row_id: str):
+        m = self._managed.pop(row_id, None)
+        if m is None:
+            return
+        m.task.cancel()
+        try:
+            await m.task
+        except (asyncio.CancelledError, Exception):
+            pass
+        await self._close(m)
+        m.health.state = STOPPED
+        self.stats.stopped += 1
+        self._ready(row_id)   # a removed row no longer holds up all_ready
+        print(f"[INFO] session {row_id} stopped")
+
+    # ---- reconcile ----
+    async def reconcile(self):
+        async with self._lock:
+            t0 = time.perf_counter()
+            if self._t0 is None:
+                self._t0 = time.monotonic()
+            try:
+                rows = await asyncio.to_thread(lambda: list(self.fetch_rows() or []))
+            except Exception as e:
+                self.stats.reconcile_errors += 1
+                print("[ERR] session reconcile failed; keeping the running set:", repr(e))
+                return
+            want = {str(r["id"]): r for r in rows}
+            if self._initial is None:
+                self._initial = set(want)
+            for row_id in [i for i in self._managed if i not in want]:
+                await self._stop(row_id)
+            for row_id, row in want.items():
+                m = self._managed.get(row_id)
+                if m is None:
+                    self._start(row)
+                elif m.version != _version(row):
+                    await self._stop(row_id)
+                    self._start(row)
+                    self.stats.replaced += 1
+            self.stats.reconciles += 1
+            self.stats.last_reconcile_ms = round((time.perf_counter() - t0) * 1000, 2)
+            if not want:
+                print("[INFO] no active user sessions. Run `python tele_agent.py login --owner <uuid>`.")
+
+    def poke(self):
+        """Reconcile now (user_sessions changed)."""
+        self._poke.set()
+
+    async def run(self):
+        while True:
+            await self.reconcile()
+            try:
+                await asyncio.wait_for(self._poke.wait(), self.reconcile_secs)
+            except asyncio.TimeoutError:
+                pass
+            self._poke.clear()
+
+    async def stop_all(self):
+        for row_id in list(self._managed):
+            await self._stop(row_id)
+
+    # ---- health ----
+    def health(self) -> List[SessionHealth]:
+        return [m.health for m in self._managed.values()]
+
+    def snapshot(self) -> dict:
+        now = time.monotonic()
+        snap = asdict(self.stats)
+        per = {}
+        for h in self.health():
+            d = asdict(h)
+            d["uptime_secs"] = round(now - h.up_since, 1) if h.up_since else None
+            d["retry_in_secs"] = round(max(0.0, h.retry_at - now), 1) if h.retry_at else None
+            del d["up_since"], d["retry_at"], d["row_id"]
+            per[h.row_id] = d
+        snap["states"] = {s: sum(1 for h in self.health() if h.state == s)
+                          for s in (STARTING, RUNNING, BACKOFF, FLOOD_WAIT, PARKED)}
+        snap["initial_pending"] = len(self._initial or ())
+        snap["sessions"] = per
+        return snap
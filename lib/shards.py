@@ -0,0 +1,206 @@
+# lib/shards.py
+# Splits tele_agent's sessions across processes so ingest can use more than one core.
+#
+#   python tele_agent.py run --shards 4     parent + 4 shard processes on this box
+#   python tele_agent.py run --shard 1/4    just shard 1 of 4 (one replica per box)
+#
+# A session belongs to shard shard_of(owner_user_id, N): a stable blake2b hash, so an
+# owner's sessions always land in the same shard, on every box and across restarts.
+# Each shard is a complete agent (own clients, parse pool, queues, caches, change
+# feed) that only starts the user_sessions rows of its shard.
+#
+# The parent only supervises: a shard that exits is restarted after a jittered
+# backoff (same policy as the session supervisor), and each shard sends a compact
+# report every METRICS_SECS over a queue, printed per shard plus totals.
+#
+# No shard may outlive the parent (a second agent started meanwhile would log in with
+# the same auth keys -> AuthKeyDuplicatedError): SIGTERM/SIGHUP to the parent stop every
+# shard like Ctrl-C does, and a shard whose parent is gone (SIGKILL, OOM) exits by itself
+# within SHARD_PARENT_CHECK_SECS. Shards can't be daemonic: they start parse pools.
+#
+# In-process state is per shard: duplicate collapsing (lib/signal_index.py) and
+# in-flight extraction sharing (lib/inflight.py) only see the owners of their shard.
+import os
+import time
+import json
+import queue
+import signal
+import threading
+import hashlib
+import multiprocessing as mp
+from dataclasses import dataclass, asdict
+from typing import Callable, Dict, List, Optional, Tuple
+
+try:
+    from lib.session_supervisor import backoff_delay, SESSION_STABLE_SECS
+except ImportError:  # running from lib/ (tele_agent.py)
+    from session_supervisor import backoff_delay, SESSION_STABLE_SECS
+
+# ---------- ENV ----------
+SHARD_METRICS_SECS = float(os.getenv("SHARD_METRICS_SECS", os.getenv("METRICS_SECS", "60")))
+SHARD_STOP_TIMEOUT = float(os.getenv("SHARD_STOP_TIMEOUT", "10"))   # SIGTERM -> SIGKILL
+SHARD_PARENT_CHECK_SECS = float(os.getenv("SHARD_PARENT_CHECK_SECS", "2"))
+
+
+def shard_of(owner_user_id, count: int) -> int:
+    if count <= 1:
+        return 0
+    digest = hashlib.blake2b(str(owner_user_id).encode(), digest_size=8).digest()
+    return int.from_bytes(digest, "big") % count
+
+
+def parse_shard_args(argv: List[str]) -> Tuple[Optional[int], int]:
+    """(index, count) from --shard i/N; (None, N) from --shards N; (None, 1) if neither."""
+    if "--shard" in argv:
+        i, _, n = argv[argv.index("--shard") + 1].partition("/")
+        index, count = int(i), int(n)
+        if not 0 <= index < count:
+            raise ValueError(f"--shard {index}/{count}: index must be in [0, {count})")
+        return index, count
+    if "--shards" in argv:
+        count = int(argv[argv.index("--shards") + 1])
+        if count < 1:
+            raise ValueError("--shards must be >= 1")
+        return None, count
+    return None, 1
+
+
+def _exit_with_parent(parent_pid: int):
+    while os.getppid() == parent_pid:
+        time.sleep(SHARD_PARENT_CHECK_SECS)
+    print(f"[WARN] shard pid={os.getpid()}: parent {parent_pid} is gone; exiting")
+    os.kill(os.getpid(), signal.SIGTERM)
+
+
+def _shard_main(target: Callable, parent_pid: int, index: int, count: int, reports):
+    threading.Thread(target=_exit_with_parent, args=(parent_pid,), daemon=True,
+                     name="shard-parent-watch").start()
+    target(index, count, reports)
+
+
+@dataclass
+class ShardState:
+    index: int
+    pid: Optional[int] = None
+    starts: int = 0
+    restarts: int = 0
+    failures: int = 0          # consecutive exits; drives the backoff
+    last_exit: Optional[int] = None
+    started_at: Optional[float] = None
+    retry_at: Optional[float] = None
+    reported_at: Optional[float] = None
+    report: Optional[dict] = None
+
+
+class ShardParent:
+    """
+    target(index, count, reports) runs one shard; it should put (index, dict) on
+    reports every so often and only return on failure.
+    """
+
+    def __init__(self, target: Callable, count: int, metrics_secs: float = None):
+        self.target = target
+        self.count = count
+        self.metrics_secs = metrics_secs or SHARD_METRICS_SECS
+        # spawn: each shard builds its own clients/threads instead of inheriting the parent's
+        self._ctx = mp.get_context("spawn")
+        self.reports = self._ctx.Queue()
+        self.shards = [ShardState(i) for i in range(count)]
+        self._procs: Dict[int, mp.Process] = {}
+
+    def _spawn(self, s: ShardState):
+        p = self._ctx.Process(target=_shard_main,
+                              args=(self.target, os.getpid(), s.index, self.count, self.reports),
+                              name=f"tele_agent-shard-{s.index}")
+        p.start()
+        self._procs[s.index] = p
+        s.pid, s.started_at, s.retry_at = p.pid, time.monotonic(), None
+        s.starts += 1
+        print(f"[INFO] shard {s.index}/{self.count} started pid={p.pid}")
+
+    def _check(self, s: ShardState, now: float):
+        p = self._procs.get(s.index)
+        if p is not None and p.is_alive():
+            return
+        if p is not None:
+            # just exited: schedule the restart
+            self._procs.pop(s.index)
+            p.join(0)
+            up = now - s.started_at if s.started_at else 0.0
+            s.failures = 1 if up >= SESSION_STABLE_SECS else s.failures + 1
+            s.last_exit, s.pid, s.started_at = p.exitcode, None, None
+            delay = backoff_delay(s.failures)
+            s.retry_at = now + delay
+            s.restarts += 1
+            print(f"[WARN] shard {s.index}/{self.count} exited (code={p.exitcode}); restart in {delay:.1f}s")
+        elif s.retry_at is not None and now >= s.retry_at:
+            self._spawn(s)
+
+    def _drain_reports(self, timeout: float):
+        try:
+            index, report = self.reports.get(timeout=timeout)
+        except queue.Empty:
+            return
+        while True:
+            s = self.shards[index]
+            s.report, s.reported_at = report, time.monotonic()
+            try:
+                index, report = self.reports.get_nowait()
+            except queue.Empty:
+                return
+
+    def snapshot(self) -> dict:
+        now = time.monotonic()
+        totals: Dict[str, Dict[str, float]] = {}
+        per = {}
+        for s in self.shards:
+            d = asdict(s)
+            d["uptime_secs"] = round(now - s.started_at, 1) if s.started_at else None
+            d["report_age_secs"] = round(now - s.reported_at, 1) if s.reported_at else None
+            for k in ("started_at", "retry_at", "reported_at"):
+                del d[k]
+            per[s.index] = d
+            for group, values in (s.report or {}).get("totals", {}).items():
+                bucket = totals.setdefault(group, {})
+                for k, v in values.items():
+                    bucket[k] = bucket.get(k, 0) + v
+        return {"count": self.count, "alive": sum(1 for p in self._procs.values() if p.is_alive()),
+                "totals": totals, "shards": per}
+
+    def _terminate(self, signum, frame):
+        raise SystemExit(128 + signum)   # unwinds run() into stop()
+
+    def run(self):
+        previous = {sig: signal.signal(sig, self._terminate) for sig in (signal.SIGTERM, signal.SIGHUP)}
+        next_report = time.monotonic() + self.metrics_secs
+        try:
+            for s in self.shards:
+                self._spawn(s)
+            while True:
+                self._drain_reports(timeout=1.0)
+                now = time.monotonic()
+                for s in self.shards:
+                    self._check(s, now)
+                if now >= next_report:
+                    next_report = now + self.metrics_secs
+                    print("[METRICS] shards:", json.dumps(self.snapshot()))
+        except KeyboardInterrupt:
+            pass
+        finally:
+            for sig in previous:
+                signal.signal(sig, signal.SIG_IGN)   # a second SIGTERM must not cut stop() short
+            try:
+                self.stop()
+            finally:
+                for sig, handler in previous.items():
+                    signal.signal(sig, handler)
+
+    def stop(self):
+        for p in self._procs.values():
+            p.terminate()
+        deadline = time.monotonic() + SHARD_STOP_TIMEOUT
+        for p in self._procs.values():
+            p.join(max(0.0, deadline - time.monotonic()))
+            if p.is_alive():
+                p.kill()
+        self._procs.clear()
@@ -0,0 +1,197 @@
+# lib/signal_index.py
+# Collapse the same trade arriving from several sources into one follower card.
+#
+# Channels copy each other's calls within seconds, so a follower routed to several of
+# them used to get one user_inbound_messages row and one bot card per copy. Fan-out now
+# asks the index first: a signal with the same symbol and side whose entry midpoint
+# (and SL, when both have one) lies within the follower's relative tolerance, seen
+# from a *different* source inside the follower's window, is a duplicate. Duplicates
+# are attached to the first row's extra_sources (sql/001_signal_collapse.sql) instead.
+#
+# Prices are bucketed on a log scale (bucket width == tolerance) and lookups check the
+# neighbouring buckets, so a match costs O(entries in three buckets), not O(window).
+import os
+import math
+import time
+import asyncio
+from collections import deque
+from dataclasses import dataclass, asdict
+from typing import Any, Callable, Deque, Dict, Iterable, List, Optional, Tuple
+
+# ---------- ENV ----------
+COLLAPSE_DEFAULT = os.getenv("COLLAPSE_DUPLICATES", "1") not in ("0", "false", "no")
+COLLAPSE_WINDOW_SECS = float(os.getenv("COLLAPSE_WINDOW_SECS", "120"))
+COLLAPSE_TOLERANCE = float(os.getenv("COLLAPSE_TOLERANCE", "0.001"))        # relative, 0.001 = 0.1%
+SIGNAL_INDEX_MAX_WINDOW_SECS = float(os.getenv("SIGNAL_INDEX_MAX_WINDOW_SECS", "900"))  # hard cap per entry
+COLLAPSE_SETTINGS_TTL_SECS = float(os.getenv("COLLAPSE_SETTINGS_TTL_SECS", "60"))
+
+
+@dataclass
+class CollapseConfig:
+    enabled: bool = COLLAPSE_DEFAULT
+    window_secs: float = COLLAPSE_WINDOW_SECS
+    tolerance: float = COLLAPSE_TOLERANCE
+
+    @classmethod
+    def from_row(cls, row: Optional[dict]) -> "CollapseConfig":
+        """From a user_settings row; missing/NULL columns fall back to the env defaults."""
+        row = row or {}
+        cfg = cls()
+        if row.get("collapse_duplicates") is not None:
+            cfg.enabled = bool(row["collapse_duplicates"])
+        if row.get("collapse_window_secs") is not None:
+            cfg.window_secs = min(float(row["collapse_window_secs"]), SIGNAL_INDEX_MAX_WINDOW_SECS)
+        if row.get("collapse_tolerance") is not None:
+            cfg.tolerance = max(0.0, float(row["collapse_tolerance"]))
+        return cfg
+
+
+@dataclass
+class IndexStats:
+    checked: int = 0
+    indexed: int = 0
+    collapsed: int = 0       # rows/cards not created
+    disabled: int = 0        # follower opted out
+    expired: int = 0
+
+
+class IndexEntry:
+    """A follower's first card for a trade; duplicates wait on uim_id while it is created."""
+
+    def __init__(self, key: Tuple, entry: float, sl: Optional[float], source_id, created_at: float):
+        self.key = key
+        self.entry = entry
+        self.sl = sl
+        self.source_id = source_id
+        self.created_at = created_at
+        self.uim_id: asyncio.Future = asyncio.get_running_loop().create_future()
+        self.dead = False
+
+    def resolve(self, uim_id: Optional[int]):
+        if not self.uim_id.done():
+            self.uim_id.set_result(uim_id)
+        if uim_id is None:
+            self.dead = True
+
+    async def wait(self) -> Optional[int]:
+        return await asyncio.shield(self.uim_id)
+
+
+def _mid(parsed: dict) -> Optional[float]:
+    lo, hi = parsed.get("entry_min"), parsed.get("entry_max")
+    if lo is None:
+        return None
+    return (float(lo) + float(hi if hi is not None else lo)) / 2.0
+
+
+def _bucket(price: float, tolerance: float) -> int:
+    if tolerance <= 0 or price <= 0:
+        return hash(round(price, 10))
+    return math.floor(math.log(price) / math.log1p(tolerance))
+
+
+def _close(a: Optional[float], b: Optional[float], tolerance: float) -> bool:
+    if a is None or b is None:
+        return a is None and b is None
+    return abs(a - b) <= tolerance * max(abs(a), abs(b))
+
+
+class SignalIndex:
+    def __init__(self):
+        self._buckets: Dict[Tuple, List[IndexEntry]] = {}
+        self._order: Deque[IndexEntry] = deque()   # insertion (== time) order for expiry
+        self.stats = IndexStats()
+
+    def __len__(self) -> int:
+        return len(self._order)
+
+    def _expire(self, now: float):
+        while self._order and now - self._order[0].created_at >= SIGNAL_INDEX_MAX_WINDOW_SECS:
+            e = self._order.popleft()
+            bucket = self._buckets.get(e.key)
+            if bucket is not None:
+                try:
+                    bucket.remove(e)
+                except ValueError:
+                    pass
+                if not bucket:
+                    del self._buckets[e.key]
+            self.stats.expired += 1
+
+    def match_or_reserve(self, follower_id, parsed: dict, source_id,
+                         cfg: CollapseConfig) -> Tuple[bool, Optional[IndexEntry]]:
+        """
+        (True, entry)  -> duplicate of entry (await entry.wait() for its uim id)
+        (False, entry) -> first sighting; create the row, then entry.resolve(uim_id)
+        (False, None)  -> collapsing disabled or signal not indexable
+        Synchronous on purpose: no other worker can interleave between lookup and insert.
+        """
+        self.stats.checked += 1
+        if not cfg.enabled:
+            self.stats.disabled += 1
+            return False, None
+        mid = _mid(parsed)
+        symbol, action = (parsed.get("symbol") or "").upper(), parsed.get("action")
+        if mid is None or not symbol or not action:
+            return False, None
+
+        now = time.monotonic()
+        self._expire(now)
+        sl = float(parsed["sl"]) if parsed.get("sl") is not None else None
+        b = _bucket(mid, cfg.tolerance)
+        for nb in (b, b - 1, b + 1):
+            for e in self._buckets.get((follower_id, symbol, action, nb), ()):
+                if e.dead or now - e.created_at > cfg.window_secs or e.source_id == source_id:
+                    continue
+                if _close(e.entry, mid, cfg.tolerance) and _close(e.sl, sl, cfg.tolerance):
+                    self.stats.collapsed += 1
+                    return True, e
+
+        key = (follower_id, symbol, action, b)
+        entry = IndexEntry(key, mid, sl, source_id, now)
+        self._buckets.setdefault(key, []).append(entry)
+        self._order.append(entry)
+        self.stats.indexed += 1
+        return False, entry
+
+    def snapshot(self) -> dict:
+        snap = asdict(self.stats)
+        snap["size"] = len(self._order)
+        snap["collapse_rate"] = round(self.stats.collapsed / self.stats.checked, 4) if self.stats.checked else 0.0
+        return snap
+
+
+class CollapseSettings:
+    """Per-follower CollapseConfig, loaded in one query per batch and cached for a TTL."""
+
+    def __init__(self, fetch: Callable[[List[str]], Iterable[dict]], ttl_secs: float = None):
+        self.fetch = fetch  # user_ids -> user_settings rows (user_id + collapse_* columns)
+        self.ttl_secs = COLLAPSE_SETTINGS_TTL_SECS if ttl_secs is None else ttl_secs
+        self._cache: Dict[str, Tuple[float, CollapseConfig]] = {}
+
+    def get_many(self, user_ids: Iterable[str]) -> Dict[str, CollapseConfig]:
+        now = time.monotonic()
+        out, missing = {}, []
+        for uid in set(user_ids):
+            hit = self._cache.get(uid)
+            if hit and now - hit[0] < self.ttl_secs:
+                out[uid] = hit[1]
+            else:
+                missing.append(uid)
+        if missing:
+            rows = {}
+            try:
+                rows = {r["user_id"]: r for r in (self.fetch(missing) or [])}
+            except Exception as e:
+                print("[WARN] collapse settings load failed; using defaults:", repr(e))
+            for uid in missing:
+                cfg = CollapseConfig.from_row(rows.get(uid))
+                self._cache[uid] = (now, cfg)
+                out[uid] = cfg
+        return out
+
+    def invalidate(self, user_id: Optional[str] = None):
+        if user_id is None:
+            self._cache.clear()
+        else:
+            self._cache.pop(user_id, None)
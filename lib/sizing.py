@@ -0,0 +1,156 @@
+# lib/sizing.py
+# Per-follower lot sizes for one signal, computed for every routed follower in a single
+# NumPy pass.
+#
+# Follower parameters (sql/006_position_sizing.sql):
+#   user_settings.sizing_mode      "fixed" (default) or "risk"
+#   user_settings.fixed_lots       lots per trade in fixed mode (SIZING_DEFAULT_LOTS if NULL)
+#   user_settings.risk_pct         % of balance lost if the SL is hit, risk mode
+#   user_settings.max_symbol_lots  cap per symbol per signal
+#   accounts.balance               in SIZING_ACCOUNT_CCY
+# Broker constraints (contract_size, min_lot, lot_step, max_lot) come from the symbol
+# catalog of the account's broker (lib/symbols.py "contracts").
+#
+# risk lots = balance * risk_pct / 100 / (|entry - sl| * contract_size * quote->account rate)
+# Lots are capped by max_symbol_lots and max_lot, then floored to lot_step. Risk-sized
+# lots below min_lot become 0 (skip: trading min_lot would exceed the follower's risk);
+# fixed lots are raised to min_lot. Risk mode without a usable SL, balance or quote
+# conversion falls back to the fixed size.
+import os
+from dataclasses import dataclass, asdict
+from typing import Dict, Iterable, List, Optional
+
+import numpy as np
+
+try:
+    from lib.symbols import get_catalog
+except ImportError:  # running from lib/ (tele_agent.py)
+    from symbols import get_catalog
+
+# ---------- ENV ----------
+SIZING_DEFAULT_LOTS = float(os.getenv("SIZING_DEFAULT_LOTS", "0.01"))
+SIZING_ACCOUNT_CCY = os.getenv("SIZING_ACCOUNT_CCY", "USD").upper()
+
+# status per follower
+OK, CAPPED, BELOW_MIN, FALLBACK_FIXED = range(4)
+STATUS_NAMES = ("ok", "capped", "below_min", "fallback_fixed")
+
+_USD_LIKE = {"USD", "USDT", "USDC", "FDUSD", "BUSD"}
+_SETTING_COLS = "sizing_mode,fixed_lots,risk_pct,max_symbol_lots"
+
+
+@dataclass
+class SizingStats:
+    signals: int = 0
+    followers: int = 0
+    capped: int = 0
+    below_min: int = 0
+    fallback_fixed: int = 0
+
+
+def quote_rate(symbol: str, price: float, quote: Optional[str] = None) -> Optional[float]:
+    """Account-currency value of 1 unit of the symbol's quote currency; None if unknown."""
+    symbol = symbol.upper()
+    account = SIZING_ACCOUNT_CCY
+    if quote is None:
+        quote = next((q for q in sorted(_USD_LIKE, key=len, reverse=True) if symbol.endswith(q)), symbol[-3:])
+    quote = quote.upper()
+    if quote == account or (quote in _USD_LIKE and account == "USD"):
+        return 1.0
+    if symbol.startswith(account) and price > 0:   # USDJPY: 1 JPY = 1 / price USD
+        return 1.0 / price
+    return None
+
+
+def compute_lots(entry: float, sl: Optional[float], rate: Optional[float],
+                 risk_mode, fixed_lots, risk_pct, balance, max_symbol_lots,
+                 contract_size, min_lot, lot_step, max_lot):
+    """
+    Vectorized core. Scalars describe the signal, arrays (or broadcastable scalars) the
+    followers; NaN means "not set". Returns (lots, status) arrays.
+    """
+    risk_mode = np.asarray(risk_mode, dtype=bool)
+    fixed_lots = np.where(np.isnan(fixed_lots), SIZING_DEFAULT_LOTS, fixed_lots)
+    dist = abs(entry - sl) if sl is not None else 0.0
+    per_lot_loss = dist * np.asarray(contract_size, dtype=float) * (rate or 0.0)
+
+    with np.errstate(divide="ignore", invalid="ignore"):
+        risk_lots = np.asarray(balance) * np.asarray(risk_pct) / 100.0 / per_lot_loss
+    usable = risk_mode & np.isfinite(risk_lots) & (risk_lots >= 0)
+    lots = np.where(usable, risk_lots, fixed_lots)
+    status = np.where(risk_mode & ~usable, FALLBACK_FIXED, OK)
+
+    cap = np.fmin(np.where(np.isnan(max_symbol_lots), np.inf, max_symbol_lots), max_lot)
+    capped = lots > cap
+    lots = np.minimum(lots, cap)
+    status = np.where(capped & (status == OK), CAPPED, status)
+
+    lots = np.round(np.floor(lots / lot_step + 1e-9) * lot_step, 8)
+    below = lots < np.asarray(min_lot) - 1e-12
+    skip = below & (usable | (cap < np.asarray(min_lot) - 1e-12))   # min_lot would break risk or cap
+    lots = np.where(skip, 0.0, np.where(below, min_lot, lots))
+    status = np.where(skip, BELOW_MIN, status)
+    return lots, status
+
+
+def _f(v) -> float:
+    try:
+        return float(v) if v is not None else np.nan
+    except (TypeError, ValueError):
+        return np.nan
+
+
+class SizingEngine:
+    def __init__(self):
+        self.stats = SizingStats()
+
+    def size(self, parsed: dict, followers: List[dict]) -> Dict[str, float]:
+        """
+        followers: one dict per follower with user_id, broker and the sizing columns of
+        user_settings/accounts (missing keys = not set). Returns user_id -> lots
+        (0 = too small for the broker at the follower's risk: don't trade).
+        """
+        if not followers:
+            return {}
+        lots, status = self.size_arrays(parsed, followers)
+        self.stats.signals += 1
+        self.stats.followers += len(followers)
+        counts = np.bincount(status, minlength=len(STATUS_NAMES))
+        self.stats.capped += int(counts[CAPPED])
+        self.stats.below_min += int(counts[BELOW_MIN])
+        self.stats.fallback_fixed += int(counts[FALLBACK_FIXED])
+        return {f["user_id"]: float(x) for f, x in zip(followers, lots)}
+
+    def size_arrays(self, parsed: dict, followers: List[dict]):
+        symbol = (parsed.get("symbol") or "").upper()
+        lo, hi = parsed.get("entry_min"), parsed.get("entry_max")
+        entry = (float(lo) + float(hi if hi is not None else lo)) / 2.0 if lo is not None else 0.0
+        sl = float(parsed["sl"]) if parsed.get("sl") is not None else None
+
+        # broker constraints: one catalog lookup per distinct broker, then gathered
+        brokers = [str(f.get("broker") or "default").lower() for f in followers]
+        specs = {b: get_catalog(b).contract(symbol) for b in set(brokers)}
+        idx = {b: i for i, b in enumerate(specs)}
+        table = np.array([[specs[b].get("contract_size", 1), specs[b].get("min_lot", 0.01),
+                           specs[b].get("lot_step", 0.01), specs[b].get("max_lot", np.inf)] for b in specs],
+                         dtype=float)
+        rows = table[np.fromiter((idx[b] for b in brokers), dtype=np.intp, count=len(brokers))]
+        quote = next(iter(specs.values())).get("quote")
+        rate = quote_rate(symbol, entry, quote)
+
+        n = len(followers)
+        col = lambda k: np.fromiter((_f(f.get(k)) for f in followers), dtype=float, count=n)
+        risk_mode = np.fromiter((f.get("sizing_mode") == "risk" for f in followers), dtype=bool, count=n)
+        return compute_lots(entry, sl, rate, risk_mode, col("fixed_lots"), col("risk_pct"), col("balance"),
+                            col("max_symbol_lots"), rows[:, 0], rows[:, 1], rows[:, 2], rows[:, 3])
+
+    def snapshot(self) -> dict:
+        return asdict(self.stats)
+
+
+def size_one(parsed: dict, settings: dict, account: dict) -> float:
+    """Single follower (manual review flow); same rules as the batch path."""
+    row = {**{k: settings.get(k) for k in _SETTING_COLS.split(",")},
+           "user_id": settings.get("user_id"), "balance": account.get("balance"), "broker": account.get("broker")}
+    lots, _ = SizingEngine().size_arrays(parsed, [row])
+    return float(lots[0])
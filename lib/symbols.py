@@ -0,0 +1,194 @@
+# lib/symbols.py
+# Broker symbol catalog and symbol resolution for parse_trade_signal and the review flow.
+#
+# A catalog is data/symbols/<broker>.json:
+#     {"extends": "default",              # optional, merge on top of another catalog
+#      "symbols": ["XAUUSD", ...],        # canonical names
+#      "aliases": {"GOLD": "XAUUSD"},     # extra spellings -> canonical
+#      "suffixes": [".m", ".pro", "m"],   # broker decorations accepted after a symbol in text
+#      "quotes": ["USDT"],                # crypto quotes: any <BASE>[/]<QUOTE> is a pair
+#      "broker_suffix": ".m",             # what this broker appends when placing orders
+#      "contracts": {"default": {...},    # lot sizing (lib/sizing.py): contract_size, min_lot,
+#                    "XAUUSD": {...}}}    #   lot_step, max_lot, quote; per symbol over "default"
+# Symbols and aliases are compiled into a character trie; find() walks it from every
+# word start, so one message costs O(len(text) * longest key), i.e. linear in practice.
+#
+#   python lib/symbols.py resolve "Gold buy now 2350 sl 2340" [--broker default]
+import os
+import re
+import sys
+import json
+from functools import lru_cache
+from typing import Dict, Iterable, List, Optional, Tuple
+
+# ---------- ENV ----------
+SYMBOL_BROKER = os.getenv("SYMBOL_BROKER", "default")
+SYMBOL_CATALOG_DIR = os.getenv("SYMBOL_CATALOG_DIR", os.path.join(os.path.dirname(os.path.abspath(__file__)),
+                                                                  "data", "symbols"))
+
+_END = ""          # trie key holding the canonical symbol of a complete entry
+_SEPARATORS = "/_-"  # "EUR/USD", "BTC_USDT", "XAU-USD"
+
+
+class SymbolCatalog:
+    def __init__(self, broker: str, symbols: Iterable[str], aliases: Dict[str, str] = None,
+                 suffixes: Iterable[str] = (), quotes: Iterable[str] = (), broker_suffix: str = "",
+                 contracts: Dict[str, dict] = None):
+        self.broker = broker
+        self.contracts = {k if k in ("default", "crypto_quote") else k.upper(): v for k, v in (contracts or {}).items()}
+        self.broker_suffix = broker_suffix or ""
+        self.symbols = {s.upper() for s in symbols}
+        self.aliases = {a.upper(): s.upper() for a, s in (aliases or {}).items()}
+        self._root: dict = {}
+        for s in self.symbols:
+            self._add(s, s)
+        for a, s in self.aliases.items():
+            self._add(a, s)
+        # longest first so ".pro" wins over a bare "."-less variant
+        self.suffixes = sorted({x.upper() for x in suffixes}, key=len, reverse=True)
+        quotes = sorted({q.upper() for q in quotes}, key=len, reverse=True)
+        self.quotes = quotes
+        self._pair = re.compile(r"(?<![A-Z0-9])([A-Z][A-Z0-9]{1,11})[/_-]?(" + "|".join(map(re.escape, quotes))
+                                + r")(?![A-Z0-9])") if quotes else None
+
+    def __len__(self) -> int:
+        return len(self.symbols) + len(self.aliases)
+
+    def _add(self, key: str, canonical: str):
+        node = self._root
+        for ch in key:
+            node = node.setdefault(ch, {})
+        node[_END] = canonical
+
+    def _suffix_end(self, text: str, j: int) -> int:
+        """End of the word starting at j if it is empty or a broker suffix, else -1."""
+        # suffixes first: most start with punctuation (".m", "-ecn", "+"), i.e. at a boundary
+        for suf in self.suffixes:
+            k = j + len(suf)
+            if text.startswith(suf, j) and (k == len(text) or not text[k].isalnum()):
+                return k
+        if j == len(text) or not text[j].isalnum():
+            return j
+        return -1
+
+    def _walk(self, text: str, i: int) -> Optional[Tuple[str, int]]:
+        """Longest catalog entry starting at i that ends on a word boundary: (canonical, end)."""
+        node, j, n = self._root, i, len(text)
+        best = None
+        while j < n:
+            nxt = node.get(text[j])
+            if nxt is None and text[j] in _SEPARATORS and node is not self._root and j + 1 < n:
+                nxt = node.get(text[j + 1])
+                j += 1
+            if nxt is None:
+                break
+            node = nxt
+            j += 1
+            if _END in node:
+                end = self._suffix_end(text, j)
+                if end >= 0:
+                    best = (node[_END], end)
+        return best
+
+    def find(self, text: str) -> Optional[Tuple[int, str]]:
+        """First symbol mentioned in text as (position, canonical); text is matched upper-cased."""
+        upper = text.upper()
+        root = self._root
+        hit = None
+        prev_alnum = False
+        for i, ch in enumerate(upper):
+            if not prev_alnum and ch in root:
+                m = self._walk(upper, i)
+                if m:
+                    hit = (i, m[0])
+                    break
+            prev_alnum = ch.isalnum()
+        if self._pair:
+            m = self._pair.search(upper, 0, hit[0] if hit else len(upper))
+            if m:
+                return m.start(), m.group(1) + m.group(2)
+        return hit
+
+    def resolve(self, text: str) -> Optional[str]:
+        hit = self.find(text)
+        return hit[1] if hit else None
+
+    def resolve_exact(self, raw: str) -> Optional[str]:
+        """Canonical symbol when the whole input names one ("gold", "#eurusd.m", "pepe/usdt")."""
+        upper = raw.strip().lstrip("#").upper()
+        if not upper:
+            return None
+        m = self._walk(upper, 0)
+        if m and m[1] == len(upper):
+            return m[0]
+        if self._pair:
+            m = self._pair.fullmatch(upper)
+            if m:
+                return m.group(1) + m.group(2)
+        return None
+
+    def contract(self, symbol: str) -> dict:
+        """Contract spec for a canonical symbol: its entry over "default" (crypto pairs: "crypto_quote")."""
+        symbol = symbol.upper()
+        spec = dict(self.contracts.get("default", {}))
+        if symbol not in self.contracts and any(symbol.endswith(q) for q in self.quotes):
+            spec.update(self.contracts.get("crypto_quote", {}))
+        spec.update(self.contracts.get(symbol, {}))
+        return spec
+
+    def to_broker(self, symbol: str) -> str:
+        """Broker-side name for a canonical symbol (adds broker_suffix)."""
+        return symbol + self.broker_suffix if symbol.upper() in self.symbols else symbol
+
+
+def _read_spec(broker: str, seen: List[str]) -> dict:
+    path = os.path.join(SYMBOL_CATALOG_DIR, f"{broker}.json")
+    with open(path, encoding="utf-8") as f:
+        spec = json.load(f)
+    parent = spec.get("extends", None if broker == "default" else "default")
+    if parent and parent not in seen:
+        base = _read_spec(parent, seen + [broker])
+        spec = {
+            "symbols": list(base.get("symbols", [])) + list(spec.get("symbols", [])),
+            "aliases": {**base.get("aliases", {}), **spec.get("aliases", {})},
+            "suffixes": list(base.get("suffixes", [])) + list(spec.get("suffixes", [])),
+            "quotes": list(base.get("quotes", [])) + list(spec.get("quotes", [])),
+            "broker_suffix": spec.get("broker_suffix", base.get("broker_suffix", "")),
+            "contracts": {k: {**base.get("contracts", {}).get(k, {}), **v}
+                          for k, v in {**base.get("contracts", {}), **spec.get("contracts", {})}.items()},
+        }
+    return spec
+
+
+@lru_cache(maxsize=32)
+def get_catalog(broker: Optional[str] = None) -> SymbolCatalog:
+    """Compiled catalog per broker; unknown brokers get the default catalog."""
+    broker = (broker or SYMBOL_BROKER).lower()
+    try:
+        spec = _read_spec(broker, [])
+    except FileNotFoundError:
+        if broker == "default":
+            print(f"[WARN] No symbol catalog in {SYMBOL_CATALOG_DIR}; symbol resolution disabled")
+            return SymbolCatalog(broker, [])
+        return get_catalog("default")
+    return SymbolCatalog(broker, spec.get("symbols", []), spec.get("aliases"), spec.get("suffixes", []),
+                         spec.get("quotes", []), spec.get("broker_suffix", ""), spec.get("contracts"))
+
+
+def find_symbol(text: str, broker: Optional[str] = None) -> Optional[str]:
+    return get_catalog(broker).resolve(text)
+
+
+def resolve_symbol(raw: str, broker: Optional[str] = None) -> Optional[str]:
+    return get_catalog(broker).resolve_exact(raw)
+
+
+if __name__ == "__main__":
+    if len(sys.argv) > 2 and sys.argv[1] == "resolve":
+        args = sys.argv[3:]
+        broker = args[args.index("--broker") + 1] if "--broker" in args else None
+        cat = get_catalog(broker)
+        print(json.dumps({"broker": cat.broker, "entries": len(cat), "find": cat.find(sys.argv[2]),
+                          "exact": cat.resolve_exact(sys.argv[2])}))
+    else:
+        print('Usage: python lib/symbols.py resolve "<text>" [--broker <name>]')
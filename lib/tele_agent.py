@@ -4,10 +4,28 @@ import os
 import sys
 import json
 import time
-from dataclasses import dataclass
-from typing import Dict, List, Optional, Set, Tuple
-from parser import parse_trade_signal
-from llm_normalize import normalize_message
+from collections import Counter
+from dataclasses import dataclass, asdict
+from datetime import datetime, timezone
+from typing import Dict, FrozenSet, List, Optional, Set, Tuple
+from llm_normalize import hints_from_parsed, fingerprint
+from llm_guard import guarded_normalize, guard as llm_guard
+from llm_cache import get_cache as get_llm_cache
+from prefilter import Prefilter
+from templates import TemplateStore
+from parse_pool import ParsePool
+from ingest_queue import IngestQueue, MessageRecord
+from inflight import InflightMap
+from signal_index import SignalIndex, CollapseSettings
+from route_cache import RouteCache
+from whitelist import WhitelistIndex
+from invalidation import get_bus, Change
+from ingest_db import IngestDB
+from notify_sender import NotifySender, Fanout, NOTIFY_CONCURRENCY
+from auto_copy import AutoCopy, AutoOrder, FollowerProfiles, AUTO_COPY_ENABLED, SETTINGS_COLS, ACCOUNT_COLS
+from session_supervisor import SessionSupervisor
+from shards import ShardParent, parse_shard_args, shard_of
+from entity_cache import CachedStringSession, StartupTimes, get_store as get_entity_store
 
 from dotenv import load_dotenv
 load_dotenv()
@@ -18,9 +36,11 @@ from supabase import create_client, Client
 # --- Telegram: Telethon (user) + Bot API (send approval, forward, etc.)
 from telethon import TelegramClient, events
 from telethon.sessions import StringSession
-from telethon.errors import SessionPasswordNeededError
+from telethon.errors import (SessionPasswordNeededError, AuthKeyUnregisteredError, AuthKeyDuplicatedError,
+                             SessionRevokedError, UserDeactivatedError, UserDeactivatedBanError, FloodWaitError)
 
 from telegram import Bot, InlineKeyboardMarkup, InlineKeyboardButton
+from telegram.request import HTTPXRequest
 
 # ---------- ENV ----------
 SUPABASE_URL = os.getenv("SUPABASE_URL")
@@ -34,7 +54,7 @@ if not (SUPABASE_URL and SUPABASE_KEY and BOT_TOKEN and API_ID and API_HASH):
     sys.exit(1)
 
 sb: Client = create_client(SUPABASE_URL, SUPABASE_KEY)
-bot = Bot(token=BOT_TOKEN)
+bot = Bot(token=BOT_TOKEN, request=HTTPXRequest(connection_pool_size=NOTIFY_CONCURRENCY))
 
 
 
@@ -43,35 +63,135 @@ class SessionCtx:
     owner_user_id: str
     telegram_user_id: int
     client: TelegramClient
-    # simple cache of allowed chats (group_sources) for this owner
-    allowed_chat_ids: Set[int]
-    last_refresh: float = 0.0
-
-
-_refresh_secs = 15.0  # refresh whitelist every 60s
-
-
-async def refresh_allowed_chats(ctx: SessionCtx):
-    now = time.time()
-   
-
-    if now - ctx.last_refresh < _refresh_secs:
-        return
-    res = sb.table("group_sources") \
-        .select("chat_id") \
-        .eq("platform", "telegram") \
-        .eq("owner_user_id", ctx.owner_user_id) \
-        .execute()
-    allowed = set()
-    for row in res.data or []:
-        try:
-            allowed.add(int(row["chat_id"]))
-        except Exception:
-            pass
-    ctx.allowed_chat_ids = allowed
-    ctx.last_refresh = now
-      # NEW: log after refresh so it's the latest list
-    print(f"[{ctx.telegram_user_id}] allowed_chat_ids (refreshed) -> {sorted(ctx.allowed_chat_ids)}")
+    events_processed: int = 0   # passed the chat filter and reached the handler
+    events_dropped: int = 0     # filtered out inside Telethon's dispatch loop
+    resolve_task: Optional[asyncio.Task] = None   # resolve_whitelisted_chats, kept referenced
+
+    @property
+    def allowed_chat_ids(self) -> FrozenSet[int]:
+        # owner's group_sources chats from the shared index (empty = allow all)
+        return whitelist.allowed(self.owner_user_id)
+
+
+_metrics_secs = float(os.getenv("METRICS_SECS", "60"))  # periodic stats line
+sessions: List[SessionCtx] = []  # running watchers (for per-session metrics)
+SHARD: Tuple[int, int] = (0, 1)  # (index, count): this process runs the owners with shard_of(owner) == index
+shard_reports = None             # queue to the shard parent (run --shards N)
+
+# "tiered": deterministic parse first, LLM only when required fields are missing/ambiguous
+# "llm":    always normalize with the LLM, then parse with its hints (previous behaviour)
+INGEST_MODE = os.getenv("INGEST_MODE", "tiered").lower()
+TIERED_REQUIRED = {f.strip() for f in os.getenv("TIERED_REQUIRED_FIELDS", "symbol,side,entry,sl,tp").split(",") if f.strip()}
+tier_counts: Counter = Counter()  # messages resolved per tier
+prefilter = Prefilter.from_env()  # drops chatter/promos before any DB/LLM/spaCy work
+templates = TemplateStore()       # per-source learned extractors (python lib/templates.py build)
+parse_pool = ParsePool()          # PARSE_WORKERS processes (0 = inline) for parse_trade_signal
+ingest_queue = IngestQueue()      # handlers enqueue, INGEST_WORKERS run process_message
+inflight = InflightMap()          # one extract_signal per post even when several sessions see it
+signal_index = SignalIndex()      # recent per-follower signals for cross-source duplicate collapsing
+route_cache = RouteCache()        # group_sources row per (owner, chat) and active routes per source
+whitelist = WhitelistIndex(sb)    # owner -> allowed chat ids for every session, one delta query per interval
+notify = NotifySender(bot)        # rate-limited, per-chat queued Bot API sends for fan-out
+ingest_db = IngestDB(sb)          # inbound + follower rows in one RPC (INGEST_DB_MODE=rpc) or the legacy calls
+collapse_settings = CollapseSettings(
+    lambda ids: sb.table("user_settings")
+                  .select("user_id,collapse_duplicates,collapse_window_secs,collapse_tolerance")
+                  .in_("user_id", ids)
+                  .execute().data
+)
+follower_profiles = FollowerProfiles(  # copy_mode + account per follower for the auto copy path
+    lambda ids: sb.table("user_settings").select(SETTINGS_COLS).in_("user_id", ids).execute().data,
+    lambda ids: sb.table("accounts").select(ACCOUNT_COLS).in_("user_id", ids).eq("status", "active").execute().data,
+)
+auto_copy = AutoCopy(sb)
+bus = get_bus()                   # row-change notifications (DATABASE_URL) -> targeted cache invalidation
+whitelist.live = lambda: bus.live
+
+
+def _on_group_sources_change(ch: Change):
+    whitelist.apply_change(ch.op, ch.row, ch.old)
+    for r in (ch.old, ch.row):
+        if r.get("owner_user_id") is not None:
+            route_cache.invalidate_source(r["owner_user_id"], r.get("chat_id"))
+    if ch.op == "DELETE":
+        route_cache.invalidate_routes(ch.get("id"))
+
+
+def _on_copy_routes_change(ch: Change):
+    for source_id in {ch.row.get("source_id"), ch.old.get("source_id")} - {None}:
+        route_cache.invalidate_routes(source_id)
+
+
+def _on_invalidation_resync():
+    # notifications may have been lost while the listener was down
+    route_cache.invalidate_source()
+    route_cache.invalidate_routes()
+    collapse_settings.invalidate()
+    follower_profiles.invalidate()
+    supervisor.poke()
+    asyncio.get_running_loop().create_task(_full_whitelist_sync())
+
+
+async def _full_whitelist_sync():
+    try:
+        await asyncio.to_thread(whitelist.sync, True)
+    except Exception as e:
+        print("[ERR] whitelist resync failed:", repr(e))
+
+
+bus.subscribe("group_sources", _on_group_sources_change)
+bus.subscribe("copy_routes", _on_copy_routes_change)
+bus.subscribe("user_settings", lambda ch: collapse_settings.invalidate(ch.get("user_id")))
+bus.subscribe("user_settings", lambda ch: follower_profiles.invalidate(ch.get("user_id")))
+bus.subscribe("accounts", lambda ch: follower_profiles.invalidate(ch.get("user_id")))
+bus.on_resync(_on_invalidation_resync)
+
+
+async def extract_signal(text: str, chat_id, message_id, source_id=None) -> Tuple[Optional[dict], Optional[dict]]:
+    """
+    Returns (normalized_json, parsed). normalized_json["tier"] records which stage
+    produced the result: "template" (source's learned layout), "deterministic"
+    (spaCy matcher only) or "llm".
+    """
+    if INGEST_MODE == "tiered":
+        parsed = templates.extract(source_id, text)
+        if parsed:
+            hints = hints_from_parsed(parsed, text, group_id=chat_id, message_id=message_id, confidence=1.0)
+            hints["tier"] = "template"
+            tier_counts["template"] += 1
+            return hints, parsed
+
+        parsed, score, issues = await parse_pool.parse_scored(text)
+        blocking = [i for i in issues if i.split(":")[-1] in TIERED_REQUIRED]
+        if parsed and not blocking:
+            hints = hints_from_parsed(parsed, text, group_id=chat_id, message_id=message_id,
+                                      confidence=score, issues=issues)
+            hints["tier"] = "deterministic"
+            tier_counts["deterministic"] += 1
+            return hints, parsed
+
+    # --- Normalize with LLM ---
+    # Bounded by LLM_BUDGET_SECS; while the circuit is open this returns the
+    # no-hints fallback and parse_trade_signal works from the raw text alone
+    hints = await guarded_normalize(text, group_id=chat_id, message_id=message_id)
+    if not hints or not isinstance(hints, dict):
+        return None, None
+    hints["tier"] = "llm"
+    tier_counts["llm"] += 1
+    return hints, await parse_pool.parse(text, hints)
+
+
+def _order_summary(parsed: dict) -> str:
+    entry_text = (
+        f"{parsed['entry_min']}-{parsed['entry_max']}"
+        if parsed.get('entry_max') and parsed['entry_max'] != parsed['entry_min']
+        else f"{parsed['entry_min']}"
+    )
+    sl_text = parsed.get('sl') if parsed.get('sl') is not None else "—"
+    tp_text = ", ".join(str(x) for x in (parsed.get('tp') or [])) or "—"
+    return (f"Symbol: {parsed['symbol']} | Side: {parsed['action'].upper()}\n"
+            f"Entry: {entry_text} | Stop: {sl_text}\n"
+            f"Targets: {tp_text}")
 
 
 async def send_to_followers(
@@ -81,216 +201,438 @@ async def send_to_followers(
     follower_user_id: str,
     target_chat: str,
     message_id: str,
-    uim_id: int
+    uim_id: int,
+    fanout: Fanout = None,
 ):
+    """Queue the follower's messages on the notify sender; delivery happens in its workers."""
     # (A) Forward original for transparency via Bot
     title = source_row.get("title") or "Signal"
-    await bot.send_message(
-        chat_id=target_chat,
-        text=f"📨 [{title}] (original)\n{text}"
+    notify.send(
+        target_chat,
+        f"📨 [{title}] (original)\n{text}",
+        fanout=fanout,
     )
     # (B) Summary card before approvals
-    entry_text = (
-        f"{parsed['entry_min']}-{parsed['entry_max']}"
-        if parsed.get('entry_max') and parsed['entry_max'] != parsed['entry_min']
-        else f"{parsed['entry_min']}"
-    )
-    sl_text = parsed.get('sl') if parsed.get('sl') is not None else "—"
-    tp_text = ", ".join(str(x) for x in (parsed.get('tp') or [])) or "—"
     kb = InlineKeyboardMarkup([[
         InlineKeyboardButton("✏️ Review/Adjust Order", callback_data=f"review:{uim_id}"),
         InlineKeyboardButton("🚫 Ignore",  callback_data=f"exec:no:{uim_id}")    ]])
 
-    await bot.send_message(
-        chat_id=target_chat,
-        text=(f"Proposed Order\n"
-            f"Symbol: {parsed['symbol']} | Side: {parsed['action'].upper()}\n"
-            f"Entry: {entry_text} | Stop: {sl_text}\n"
-            f"Targets: {tp_text}\n"
+    notify.send(
+        target_chat,
+        (f"Proposed Order\n"
+            f"{_order_summary(parsed)}\n"
             f"Source msg: {message_id}\n"
             f"Choose: Review/Adjust or Ignore"),
-    reply_markup=kb
+        reply_markup=kb,
+        fanout=fanout,
     )
   
 
 
 
+def send_auto_confirmation(source_row: dict, text: str, parsed: dict, target_chat: str,
+                           message_id: str, order: AutoOrder, fanout: Fanout = None):
+    """Auto copy-mode: the order already exists, tell the follower instead of asking."""
+    title = source_row.get("title") or "Signal"
+    notify.send(target_chat, f"📨 [{title}] (original)\n{text}", fanout=fanout)
+    notify.send(
+        target_chat,
+        (f"✅ Auto-copied order\n"
+         f"{_order_summary(parsed)}\n"
+         f"Source msg: {message_id}\n"
+         f"Order: {order.order_id} ({order.latency_ms} ms after the signal)"),
+        fanout=fanout,
+    )
+
+
+async def attach_extra_source(uim_id: int, extra_source: dict, inbound_id: int):
+    """Record a duplicate copy of a trade on the follower's existing card instead of a new one."""
+    try:
+        await asyncio.to_thread(lambda: sb.rpc("rpc_uim_add_extra_source", {
+            "p_uim_id": uim_id,
+            "p_source": dict(extra_source, inbound_message_id=inbound_id),
+        }).execute())
+        print(f"[INFO] Collapsed duplicate from source={extra_source['source_id']} into uim={uim_id}")
+    except Exception as e:
+        print(f"[ERROR] attach extra source to uim={uim_id} failed:", repr(e))
+
+
+class WhitelistedNewMessage(events.NewMessage):
+    """
+    NewMessage whose filter() checks the owner's whitelist. Telethon calls filter()
+    synchronously in _dispatch_update before awaiting the callback, so DMs and
+    non-whitelisted groups/channels never start a handler coroutine. It reads the shared
+    index on every event, so the filter follows each whitelist sync without re-registering.
+    """
+
+    def __init__(self, ctx: SessionCtx, **kwargs):
+        super().__init__(**kwargs)
+        self.ctx = ctx
+
+    def filter(self, event):
+        allowed = self.ctx.allowed_chat_ids
+        if event.chat_id is None or (allowed and event.chat_id not in allowed) or not event.message.message:
+            self.ctx.events_dropped += 1
+            return None
+        event = super().filter(event)
+        if event:
+            self.ctx.events_processed += 1
+        return event
+
+
 def make_handler(ctx: SessionCtx):
-    @events.register(events.NewMessage(incoming=True, outgoing=True))
+    @events.register(WhitelistedNewMessage(ctx, incoming=True, outgoing=True))
     async def on_new_message(event):
-        # at the top of on_new_message
+        # Only capture a compact record here; the pipeline workers do the rest so a
+        # slow message never holds up Telethon's update processing
         print(f"[{ctx.telegram_user_id}] got msg chat_id={event.chat_id}")
-        try:
-            # Basic guards
-            if not event.message or not event.message.message:
-                return
+        rec = MessageRecord(
+            ctx=ctx,
+            chat_id=event.chat_id,
+            message_id=event.message.id,
+            text=event.message.message,
+            message_ts=event.message.date.isoformat(),
+            sent_at=event.message.date.timestamp(),
+        )
+        await ingest_queue.put(rec)
 
-            await refresh_allowed_chats(ctx)
-
-            chat_id = event.chat_id  # int
-            if chat_id is None:
-                return
-            if ctx.allowed_chat_ids and chat_id not in ctx.allowed_chat_ids:
-                # Not whitelisted for this owner
-                return
+    # IMPORTANT: return the handler from make_handler (NOT inside on_new_message)
+    return on_new_message
 
-            text = event.message.message
-            message_id = event.message.id
-            message_ts = event.message.date.isoformat()
-
-            # Find source row
-            src = (sb.table("group_sources")
-                     .select("*")
-                     .eq("platform", "telegram")
-                     .eq("chat_id", str(chat_id))
-                     .eq("owner_user_id", ctx.owner_user_id)
-                     .limit(1)
-                     .execute().data)
-            if not src:
-                return
-            source = src[0]
 
-            # --- 1. Normalize with LLM ---
-            # BUGFIX: use the same message_id object you already extracted
-            hints = normalize_message(text, group_id=chat_id, message_id=message_id)
-            if not hints or not isinstance(hints, dict):
-                print("[WARN] Normalizer failed, skipping.\nRaw text:", text[:200])
-                return
+async def process_message(rec: MessageRecord):
+    """One queued message through whitelist, parse/LLM, persistence and fan-out."""
+    ctx = rec.ctx
+    try:
+        chat_id = rec.chat_id  # int
+        allowed = ctx.allowed_chat_ids
+        if allowed and chat_id not in allowed:
+            # Not whitelisted for this owner
+            return
 
-            print("Raw normalized payload:", hints)
+        text = rec.text
+        if not prefilter.check(text, chat_id):
+            return
+        message_id = rec.message_id
+        message_ts = rec.message_ts
+
+        # Find source row (cached for ROUTE_CACHE_TTL_SECS, including "no source").
+        # supabase-py is blocking: every lookup below runs in a thread, never on the loop
+        source = await asyncio.to_thread(route_cache.source, ctx.owner_user_id, chat_id, lambda: next(iter(
+            sb.table("group_sources")
+              .select("*")
+              .eq("platform", "telegram")
+              .eq("chat_id", str(chat_id))
+              .eq("owner_user_id", ctx.owner_user_id)
+              .limit(1)
+              .execute().data or []), None))
+        if not source:
+            return
 
-            # --- 2. Parse trade signal ---
-            parsed = parse_trade_signal(text, hints)
-            if not parsed:
-                print("[WARN] Parser failed, skipping.\nRaw text:", text[:200])
-                return
+        # --- 1+2. Normalize (deterministic first / LLM on demand) and parse ---
+        # BUGFIX: use the same message_id object you already extracted
+        # Sessions sharing a channel all receive this post; the first one extracts,
+        # the rest await/reuse its result
+        hints, parsed = await inflight.run(
+            (fingerprint(text), chat_id, message_id),
+            lambda: extract_signal(text, chat_id, message_id, source_id=source["id"]),
+        )
+        if not hints:
+            print("[WARN] Normalizer failed, skipping.\nRaw text:", text[:200])
+            return
 
-            print("✅ Parsed payload:", parsed)
+        print("Raw normalized payload:", hints)
 
-            # 3) Persist inbound message (idempotent on source_id,message_id)
-            source_id = source["id"]  # from group_sources
-            inbound_payload = {
-                "source_id": source_id,
-                "message_id": str(message_id),
-                "message_ts": message_ts,
-                "raw_text": text,
-                "normalized_json": hints,
-                "parsed_json": parsed,
-            }
+        if not parsed:
+            print("[WARN] Parser failed, skipping.\nRaw text:", text[:200])
+            return
 
+        print("✅ Parsed payload:", parsed)
+
+        # 3) Subscribers (routes); subscribe/unsubscribe shows up within the cache TTL
+        source_id = source["id"]  # from group_sources
+        routes = await asyncio.to_thread(route_cache.active_routes, source_id,
+                                         lambda: ingest_db.active_routes(source_id))
+
+        # Same trade already carded for a follower from another source? Duplicates of a
+        # finished card attach to it inside the ingest call; duplicates of a card still
+        # being created are deferred until our own rows exist (waiting first could deadlock
+        # two sources' messages on each other's reservations)
+        collapse = await asyncio.to_thread(collapse_settings.get_many, [r["follower_user_id"] for r in routes])
+        reserved: Dict[str, object] = {}
+        dup_of: Dict[str, Optional[int]] = {}
+        pending_dups = {}
+        for r in routes:
+            follower_id = r["follower_user_id"]
+            is_dup, entry = signal_index.match_or_reserve(follower_id, parsed, source_id, collapse[follower_id])
+            if is_dup:
+                first = entry.uim_id
+                if not first.done():
+                    dup_of[follower_id] = None
+                    pending_dups[follower_id] = (r, entry)
+                elif first.result() is not None:
+                    dup_of[follower_id] = first.result()
+                # else: the first copy failed to fan out; card this one normally
+            elif entry:
+                reserved[follower_id] = entry
+
+        # 4) Persist inbound message + follower rows (idempotent on source_id,message_id)
+        inbound_payload = {
+            "source_id": source_id,
+            "message_id": str(message_id),
+            "message_ts": message_ts,
+            "raw_text": text,
+            "normalized_json": hints,
+            "parsed_json": parsed,
+        }
+        extra_source = {
+            "source_id": source_id,
+            "title": source.get("title"),
+            "message_id": str(message_id),
+            "at": datetime.now(timezone.utc).isoformat(),
+        }
+        try:
             try:
-                sb.table("inbound_messages").upsert(
-                    inbound_payload,
-                    on_conflict="source_id,message_id"
-                ).execute()
-
-                inbound = (sb.table("inbound_messages")
-                             .select("id")
-                             .eq("source_id", source_id)
-                             .eq("message_id", str(message_id))
-                             .maybe_single()
-                             .execute()
-                             .data)
-                if not inbound or "id" not in inbound:
-                    print("[ERROR] inbound_messages row not found after upsert")
-                    return
-                inbound_id = inbound["id"]
+                result = await asyncio.to_thread(ingest_db.ingest, inbound_payload, dup_of, extra_source,
+                                                 routes=lambda: routes)
             except Exception as e:
-                print("[ERROR] Upsert inbound_messages failed:", repr(e))
+                print("[ERROR] Ingest of inbound message failed:", repr(e))
                 return
-
-            # 4) Find subscribers (routes)
-            routes = (sb.table("copy_routes")
-                        .select("*")
-                        .eq("source_id", source_id)
-                        .eq("active", True)
-                        .execute().data) or []
-            if not routes:
+            if not result.routes:
                 print("[INFO] No active routes for this source; nothing to fan out.")
                 return
 
-            # 5) Fan out PER ROUTE
-            for r in routes:
-                follower_id = r["follower_user_id"]
-                target_chat = r["target_chat_id"]
-
-                try:
-                    # 1) upsert and ask PostgREST to return the row
-                    res = (sb.table("user_inbound_messages")
-                            .upsert(
-                                {
-                                    "user_id": follower_id,
-                                    "inbound_message_id": inbound_id,
-                                    "status": "pending",
-                                },
-                                on_conflict="user_id,inbound_message_id",
-                                returning="representation",   # <-- key fix
+            # Auto copy-mode followers: sized in one pass, signal + order for all of them
+            # in one call, a confirmation instead of the review card
+            placed = {}
+            if AUTO_COPY_ENABLED:
+                fresh = [row for row in result.routes if not row.collapsed and row.uim_id is not None]
+                profiles = await asyncio.to_thread(follower_profiles.get_many,
+                                                   [row.follower_user_id for row in fresh])
+                auto_rows = [(row.follower_user_id, row.uim_id, profiles[row.follower_user_id])
+                             for row in fresh if profiles[row.follower_user_id].auto]
+                if auto_rows:
+                    try:
+                        placed = await asyncio.to_thread(auto_copy.place, source_id, parsed, auto_rows, rec.sent_at)
+                    except Exception as e:
+                        print("[ERROR] auto copy batch failed; sending review cards:", repr(e))
+
+            # 5) Fan out PER ROUTE (queued; the notify sender delivers concurrently)
+            fanout = notify.begin()
+            try:
+                for row in result.routes:
+                    follower_id = row.follower_user_id
+                    if row.collapsed:
+                        if row.uim_id is not None:
+                            print(f"[INFO] Collapsed duplicate from source={source_id} into uim={row.uim_id}")
+                        continue
+                    entry = reserved.pop(follower_id, None)
+                    if entry:
+                        entry.resolve(row.uim_id)  # release waiting duplicates before the bot sends
+                    if row.uim_id is None:
+                        continue
+                    order = placed.get(follower_id)
+                    if order is not None and order.ok:
+                        print(f"[INFO] Auto-copied for user={follower_id}: order={order.order_id} "
+                              f"signal->order {order.latency_ms} ms")
+                        send_auto_confirmation(source, text, parsed, row.target_chat_id, str(message_id), order, fanout)
+                        continue
+                    try:
+                        await send_to_followers(
+                            source, text, parsed, follower_id, row.target_chat_id, str(message_id), row.uim_id, fanout
+                        )
+                    except Exception as e:
+                        print(f"[ERROR] Route fanout failed for user={follower_id}:", repr(e))
+
+                # 6) Deferred duplicates: attach once the first card exists, else card normally
+                for follower_id, (r, entry) in pending_dups.items():
+                    first_uim_id = await entry.wait()
+                    if first_uim_id is not None:
+                        await attach_extra_source(first_uim_id, extra_source, result.inbound_id)
+                        continue
+                    try:
+                        uim_id = await asyncio.to_thread(ingest_db.upsert_uim, follower_id, result.inbound_id)
+                        if uim_id is not None:
+                            await send_to_followers(
+                                source, text, parsed, follower_id, r["target_chat_id"], str(message_id), uim_id, fanout
                             )
-                            .execute())
-
-                    # 2) extract id (fallback to a select if representation wasn’t returned)
-                    if res.data and len(res.data) > 0 and "id" in res.data[0]:
-                        uim_id = res.data[0]["id"]
-                    else:
-                        uim_row = (sb.table("user_inbound_messages")
-                                    .select("id")
-                                    .eq("user_id", follower_id)
-                                    .eq("inbound_message_id", inbound_id)
-                                    .maybe_single()
-                                    .execute()
-                                    .data)
-                        if not uim_row or "id" not in uim_row:
-                            print(f"[ERROR] No uim row for user={follower_id}")
-                            continue
-                        uim_id = uim_row["id"]
-
-                    await send_to_followers(
-                        source, text, parsed, follower_id, target_chat, str(message_id), uim_id
-                    )
-
-                except Exception as e:
-                    print(f"[ERROR] Route fanout failed for user={follower_id}:", repr(e))
-                    continue
-
-
-        except Exception as e:
-            # Top-level safety net for the handler
-            print(f"[{ctx.telegram_user_id}] Handler error:", e)
-
-    # IMPORTANT: return the handler from make_handler (NOT inside on_new_message)
-    return on_new_message
-
-
-
-async def run_all_sessions():
-    # Load all active sessions
-    rows = sb.table("user_sessions").select("*").eq("is_active", True).execute().data or []
-    if not rows:
-        print("No active user sessions. Run `python tele_agent.py login --owner <uuid>` first.")
+                    except Exception as e:
+                        print(f"[ERROR] Route fanout failed for user={follower_id}:", repr(e))
+            finally:
+                fanout.close()   # counts as finished even if a send above raised
+        finally:
+            for entry in reserved.values():
+                entry.resolve(None)  # no row created; release waiting duplicates
+
+    except Exception as e:
+        # Top-level safety net for the pipeline
+        print(f"[{ctx.telegram_user_id}] Handler error:", e)
+
+
+
+async def report_metrics():
+    while True:
+        await asyncio.sleep(_metrics_secs)
+        print("[METRICS] prefilter:", json.dumps(prefilter.snapshot()))
+        print("[METRICS] tiers:", json.dumps(dict(tier_counts)))
+        print("[METRICS] templates:", json.dumps(templates.snapshot()))
+        print("[METRICS] ingest_queue:", json.dumps(ingest_queue.snapshot()))
+        print("[METRICS] inflight:", json.dumps(inflight.snapshot()))
+        print("[METRICS] collapse:", json.dumps(signal_index.snapshot()))
+        print("[METRICS] route_cache:", json.dumps(route_cache.snapshot()))
+        print("[METRICS] ingest_db:", json.dumps(ingest_db.snapshot()))
+        print("[METRICS] notify:", json.dumps(notify.snapshot()))
+        print("[METRICS] auto_copy:", json.dumps(auto_copy.snapshot()))
+        print("[METRICS] whitelist:", json.dumps(whitelist.snapshot()))
+        print("[METRICS] invalidation:", json.dumps(bus.snapshot()))
+        print("[METRICS] sessions:", json.dumps(supervisor.snapshot()))
+        entity_store = get_entity_store()
+        print("[METRICS] entity_cache:", json.dumps({
+            "store": entity_store.snapshot() if entity_store else None,
+            "startup": startup_times.snapshot(),
+        }))
+        print("[METRICS] session_events:", json.dumps({
+            str(c.telegram_user_id): {"processed": c.events_processed, "dropped": c.events_dropped}
+            for c in sessions
+        }))
+        print("[METRICS] parse_pool:", json.dumps(parse_pool.snapshot()))
+        print("[METRICS] llm:", json.dumps(llm_guard.snapshot()))
+        llm_cache = get_llm_cache()
+        if llm_cache:
+            print("[METRICS] llm_cache:", json.dumps(llm_cache.snapshot()))
+        if shard_reports is not None:
+            shard_reports.put((SHARD[0], shard_report()))
+
+
+def shard_report() -> dict:
+    """Compact per-shard metrics for the shard parent; "totals" are summed across shards."""
+    q = ingest_queue.snapshot()
+    n = notify.snapshot()
+    return {
+        "totals": {
+            "sessions": supervisor.snapshot()["states"],
+            "ingest": {k: q[k] for k in ("enqueued", "processed", "failed", "dropped_oldest", "depth")},
+            "notify": {k: n[k] for k in ("delivered", "failed", "queued")},
+            "auto_copy": asdict(auto_copy.stats),
+        },
+        "queue_wait": q["queue_wait"],
+        "receive_lag": q["receive_lag"],
+        "startup": {"first_ready_secs": supervisor.stats.first_ready_secs,
+                    "all_ready_secs": supervisor.stats.all_ready_secs},
+    }
+
+
+class SessionUnauthorized(Exception):
+    """Stored session string is no longer logged in; needs a new `login`."""
+
+
+# the session itself is dead: retrying won't help until its user_sessions row changes
+SESSION_FATAL = (SessionUnauthorized, AuthKeyUnregisteredError, AuthKeyDuplicatedError,
+                 SessionRevokedError, UserDeactivatedError, UserDeactivatedBanError)
+
+
+startup_times = StartupTimes()
+
+
+async def open_session(row: dict) -> SessionCtx:
+    t0 = time.perf_counter()
+    tg_uid = int(row["telegram_user_id"])
+    # entities saved by earlier runs of this session: no re-resolving after a restart
+    # (opening the store and reading its rows is SQLite I/O: off the event loop)
+    session = await asyncio.to_thread(
+        lambda: CachedStringSession(row["session_string"], tg_uid, get_entity_store()))
+    client = TelegramClient(session, API_ID, API_HASH)
+    ctx = SessionCtx(owner_user_id=row["owner_user_id"], telegram_user_id=tg_uid, client=client)
+    # while starting, FloodWaits are raised (the supervisor reschedules just this
+    # session) instead of slept through while holding a start slot
+    flood_threshold, client.flood_sleep_threshold = client.flood_sleep_threshold, 0
+    try:
+        # not client.start(): that prompts for a phone number on a revoked session.
+        # not is_user_authorized(): it reports a FloodWait as "logged out".
+        await client.connect()
+        if await client.get_me() is None:
+            raise SessionUnauthorized(f"tg_user={ctx.telegram_user_id}")
+    except BaseException:
+        await client.disconnect()
+        raise
+    client.flood_sleep_threshold = flood_threshold
+    client.add_event_handler(make_handler(ctx))
+    sessions.append(ctx)
+    print(f"Started watcher for owner={ctx.owner_user_id} tg_user={ctx.telegram_user_id}"
+          f" ({'warm' if session.warm else 'cold'} entity cache, {session.preloaded} entities)")
+    ctx.resolve_task = asyncio.create_task(resolve_whitelisted_chats(ctx, t0))
+    return ctx
+
+
+async def resolve_whitelisted_chats(ctx: SessionCtx, t0: float):
+    """
+    Make sure the session knows the access hash of every whitelisted chat (needed to
+    recover channel update gaps, fetch chats, reply). Cold sessions learn them with one
+    get_dialogs(); warm ones already have them from the entity cache.
+    """
+    session = ctx.client.session
+    missing = [c for c in ctx.allowed_chat_ids if session.get_entity_rows_by_id(c) is None]
+    try:
+        if missing:
+            await ctx.client.get_dialogs()
+        session.flush()
+    except Exception as e:
+        print(f"[WARN] [{ctx.telegram_user_id}] resolving {len(missing)} whitelisted chats failed:", repr(e))
         return
+    startup_times.record(session.warm, (time.perf_counter() - t0) * 1000, bool(missing))
 
-    clients: List[TelegramClient] = []
-    tasks = []
 
-    for row in rows:
-        session_str = row["session_string"]
-        owner_id = row["owner_user_id"]
-        tg_uid = int(row["telegram_user_id"])
+async def close_session(ctx: SessionCtx):
+    if ctx in sessions:
+        sessions.remove(ctx)
+    if ctx.resolve_task is not None:
+        ctx.resolve_task.cancel()
+    await ctx.client.disconnect()
 
-        client = TelegramClient(StringSession(session_str), API_ID, API_HASH)
-        await client.start()
-        ctx = SessionCtx(owner_user_id=owner_id, telegram_user_id=tg_uid, client=client, allowed_chat_ids=set())
-        handler = make_handler(ctx)
-        client.add_event_handler(handler)
 
-        clients.append(client)
-        tasks.append(client.run_until_disconnected())
+def _active_session_rows() -> List[dict]:
+    rows = (sb.table("user_sessions").select("id,owner_user_id,telegram_user_id,session_string")
+              .eq("is_active", True).execute().data or [])
+    return [r for r in rows if shard_of(r["owner_user_id"], SHARD[1]) == SHARD[0]]
 
-        print(f"Started watcher for owner={owner_id} tg_user={tg_uid}")
 
+supervisor = SessionSupervisor(
+    _active_session_rows,
+    open=open_session,
+    run=lambda ctx: ctx.client.run_until_disconnected(),
+    close=close_session,
+    fatal=SESSION_FATAL,
+    flood_wait=lambda e: e.seconds if isinstance(e, FloodWaitError) else None,
+)
+bus.subscribe("user_sessions", lambda ch: supervisor.poke())
 
-    # Run all clients concurrently
-    await asyncio.gather(*tasks)
+
+async def run_all_sessions():
+    # fork + warm the parser workers before any client connects
+    parse_pool.start()
+    # listen before the first sync so no change falls between the two
+    await bus.start()
+    # whitelist for every owner before the first update arrives
+    try:
+        await asyncio.to_thread(whitelist.sync, True)
+    except Exception as e:
+        print("[ERR] initial whitelist sync failed; retrying in the background:", repr(e))
+
+    # pipeline first: each watcher feeds it as soon as its own client is up, while
+    # the other sessions are still connecting (SESSION_START_CONCURRENCY at a time)
+    notify.start()
+    ingest_queue.start_workers(process_message)
+    # each session runs (and restarts) in its own supervised task; a new login or a
+    # deactivated row is picked up without restarting the agent
+    await asyncio.gather(supervisor.run(), whitelist.run(), report_metrics())
+
+
+def run_shard(index: int, count: int, reports=None):
+    """One shard: the owners with shard_of(owner_user_id, count) == index."""
+    global SHARD, shard_reports
+    SHARD, shard_reports = (index, count), reports
+    print(f"[INFO] shard {index}/{count} pid={os.getpid()}")
+    asyncio.run(run_all_sessions())
 
 
 async def login_flow(owner_user_id: str):
@@ -334,7 +676,7 @@ def main():
     if len(sys.argv) < 2:
         print("Usage:")
         print("  python tele_agent.py login --owner <owner_user_id>")
-        print("  python tele_agent.py run")
+        print("  python tele_agent.py run [--shards N | --shard i/N]")
         sys.exit(0)
 
     cmd = sys.argv[1]
@@ -347,7 +689,15 @@ def main():
             sys.exit(1)
         asyncio.run(login_flow(owner_id))
     elif cmd == "run":
-        asyncio.run(run_all_sessions())
+        try:
+            index, count = parse_shard_args(sys.argv[2:])
+        except (ValueError, IndexError) as e:
+            print("Bad shard argument:", e)
+            sys.exit(1)
+        if index is not None or count == 1:
+            run_shard(index or 0, count)
+        else:
+            ShardParent(run_shard, count).run()
     else:
         print("Unknown command:", cmd)
         sys.exit(1)
@@ -0,0 +1,381 @@
+# lib/templates.py
+# Per-source learned templates.
+#
+# Most group_sources post every signal in the same layout, e.g.
+#     📩 #WLDUSDT 30m | Mid-Term
+#     📉 Long Entry Zone: 1.1045-1.0413
+#     Target 1: 1.1343
+#     ❌Stop-Loss: 1.0132
+# From a source's past (inbound_messages.raw_text, parsed_json) pairs we learn one line
+# pattern per field-bearing line ("📉 {SIDE} Entry Zone: {entry}-{entry2}", "Target {NUM}: {tp}", ...),
+# keep the layout most samples agree on, verify it reproduces parsed_json, and compile it
+# to regexes. At ingest the source's extractor is tried before spaCy/LLM; any mismatch
+# falls back to the generic path.
+#
+#   python lib/templates.py build [--source <source_id>] [--limit 500] [--min-support 3]
+#   python lib/templates.py show <source_id>
+import os
+import re
+import sys
+import json
+import time
+from collections import defaultdict
+from dataclasses import dataclass, asdict
+from datetime import datetime, timezone
+from typing import Any, Dict, List, Optional, Tuple
+
+# ---------- ENV ----------
+TEMPLATE_DIR = os.getenv("TEMPLATE_DIR", ".cache/templates")
+TEMPLATE_MIN_SUPPORT = int(os.getenv("TEMPLATE_MIN_SUPPORT", "3"))      # samples sharing one layout
+TEMPLATE_MIN_ACCURACY = float(os.getenv("TEMPLATE_MIN_ACCURACY", "0.95"))
+TEMPLATE_RELOAD_SECS = float(os.getenv("TEMPLATE_RELOAD_SECS", "60"))   # re-check files for rebuilds
+
+_NUM = r"[0-9]+(?:[.,][0-9]+)?"
+_TOKEN = re.compile(
+    r"(?P<num>(?<![\w.])" + _NUM + r"(?![\w]))"
+    r"|(?P<tf>(?<![\w.])[0-9]{1,3}[mhdwMHDW](?![\w]))"      # 30m / 4h / 1D vary per message
+    r"|(?P<side>\b(?:long|short|buy|sell)\b)",
+    re.I,
+)
+_SLOT_RE = {  # slot -> (capture group name, pattern)
+    "SIDE": ("side", r"long|short|buy|sell"),
+    "SYMBOL": ("symbol", r"[A-Za-z0-9]{2,20}"),
+    "NUM": (None, _NUM),
+    "TF": (None, r"[0-9]{1,3}[mhdwMHDW]"),
+}
+_FIELD_SLOTS = {"entry", "entry2", "sl", "tp"}
+
+
+def _f(x: str) -> float:
+    return float(x.replace(",", "").strip())
+
+
+def _norm(text: str) -> str:
+    return text.replace("–", "-").replace("—", "-")
+
+
+def _same(a, b) -> bool:
+    return a is not None and b is not None and abs(float(a) - float(b)) <= 1e-9 * max(1.0, abs(float(b)))
+
+
+def _literal(s: str) -> str:
+    return r"[ \t]+".join(re.escape(w) for w in re.split(r"[ \t]+", s))
+
+
+def _line_skeleton(line: str, parsed: dict) -> Tuple[str, List[str], str]:
+    """
+    Replace symbol/side/prices in one line with slots.
+    Returns (skeleton for display/grouping, slots, regex source).
+    """
+    line = line.strip()
+    symbol = (parsed.get("symbol") or "").upper()
+    scan = _TOKEN
+    if symbol:
+        scan = re.compile(_TOKEN.pattern + r"|(?P<sym>(?<![A-Za-z0-9])" + re.escape(symbol) + r"(?![A-Za-z0-9]))", re.I)
+
+    entries = [parsed.get("entry_min"), parsed.get("entry_max")]
+    tps = list(parsed.get("tp") or [])
+    skel, rx, slots, pos = [], [], [], 0
+    for m in scan.finditer(line):
+        lit = line[pos:m.start()]
+        skel.append(lit)
+        rx.append(_literal(lit))
+        pos = m.end()
+        if m.lastgroup == "sym":
+            slot = "SYMBOL"
+        elif m.lastgroup == "side":
+            slot = "SIDE"
+        elif m.lastgroup == "tf":
+            slot = "TF"
+        else:
+            v = _f(m.group())
+            n_entry = slots.count("entry") + slots.count("entry2")
+            if n_entry < 2 and any(_same(v, e) for e in entries):
+                slot = "entry" if n_entry == 0 else "entry2"
+            elif _same(v, parsed.get("sl")):
+                slot = "sl"
+            elif any(_same(v, t) for t in tps):
+                slot = "tp"
+            else:
+                slot = "NUM"
+        skel.append("{" + slot + "}")
+        group, pattern = _SLOT_RE.get(slot, (slot, _NUM))
+        k = slots.count(slot)
+        if group is None or (k and slot in _SLOT_RE):
+            rx.append(f"(?:{pattern})")
+        else:
+            # a repeated field on one line (e.g. "TP 3400, 3350, 3300") gets numbered groups
+            rx.append(f"(?P<{group if k == 0 else f'{group}_{k}'}>{pattern})")
+        slots.append(slot)
+    skel.append(line[pos:])
+    rx.append(_literal(line[pos:]))
+    return "".join(skel), slots, r"^[ \t]*" + "".join(rx) + r"[ \t]*$"
+
+
+def sample_layout(raw_text: str, parsed: dict) -> Dict[str, Tuple[List[str], str]]:
+    """Field-bearing line skeletons of one message: {skeleton: (slots, regex)}."""
+    layout = {}
+    for line in _norm(raw_text).splitlines():
+        if not line.strip():
+            continue
+        skeleton, slots, rx = _line_skeleton(line, parsed)
+        if any(s in _FIELD_SLOTS or s in ("SIDE", "SYMBOL") for s in slots):
+            layout[skeleton] = (slots, rx)
+    return layout
+
+
+class Template:
+    def __init__(self, spec: dict):
+        self.spec = spec
+        self.source_id = spec.get("source_id")
+        self.lines = [(re.compile(l["regex"], re.I | re.M), l["slots"]) for l in spec["lines"]]
+        self.symbol_const = spec.get("symbol_const")
+
+    def extract(self, raw_text: str) -> Optional[Dict[str, Any]]:
+        """parse_trade_signal-shaped dict, or None if the message does not fit the layout."""
+        text = _norm(raw_text)
+        fields: Dict[str, str] = {}
+        tps: List[float] = []
+        for rx, slots in self.lines:
+            hit = False
+            for m in rx.finditer(text):
+                hit = True
+                for k, v in m.groupdict().items():
+                    if v is None:
+                        continue
+                    if k == "tp" or k.startswith("tp_"):
+                        tps.append(_f(v))
+                    else:
+                        fields.setdefault(k, v)
+            if not hit and "tp" not in slots:
+                return None
+
+        symbol = (fields.get("symbol") or self.symbol_const or "").lstrip("#").upper()
+        side = (fields.get("side") or "").upper()
+        if not (symbol and side and "entry" in fields):
+            return None
+        a = _f(fields["entry"])
+        b = _f(fields["entry2"]) if "entry2" in fields else a
+        sl = _f(fields["sl"]) if "sl" in fields else None
+        if min(a, b) <= 0 or (sl is not None and sl <= 0):
+            return None
+        return {
+            "action": "buy" if side in ("LONG", "BUY") else "sell",
+            "symbol": symbol,
+            "entry_min": min(a, b),
+            "entry_max": max(a, b),
+            "sl": sl,
+            "tp": tps,
+            "timeframe": None,
+        }
+
+
+def _agrees(got: Optional[dict], want: dict) -> bool:
+    if not got:
+        return False
+    for k in ("action", "symbol", "entry_min", "entry_max", "sl"):
+        w, g = want.get(k), got.get(k)
+        if isinstance(w, (int, float)) or isinstance(g, (int, float)):
+            if not (w is None and g is None) and not _same(g, w):
+                return False
+        elif (w or None) != (g or None):
+            return False
+    want_tp = [float(x) for x in (want.get("tp") or [])]
+    return len(want_tp) == len(got["tp"]) and all(_same(g, w) for g, w in zip(got["tp"], want_tp))
+
+
+def learn_template(pairs: List[Tuple[str, dict]], source_id: str = None,
+                   min_support: int = None, min_accuracy: float = None) -> Optional[dict]:
+    """
+    pairs: [(raw_text, parsed_json), ...] for one source. Returns a JSON-able template
+    spec, or None if no layout has enough support or it fails verification.
+    """
+    min_support = min_support or TEMPLATE_MIN_SUPPORT
+    min_accuracy = min_accuracy if min_accuracy is not None else TEMPLATE_MIN_ACCURACY
+
+    groups: Dict[tuple, list] = defaultdict(list)
+    for raw, parsed in pairs:
+        if not raw or not parsed or not parsed.get("symbol") or parsed.get("entry_min") is None:
+            continue
+        layout = sample_layout(raw, parsed)
+        if layout:
+            groups[tuple(sorted(layout))].append((raw, parsed, layout))
+    if not groups:
+        return None
+
+    signature, members = max(groups.items(), key=lambda kv: len(kv[1]))
+    if len(members) < min_support:
+        return None
+
+    layout = members[0][2]
+    slots_all = {s for sk in signature for s in layout[sk][0]}
+    if "entry" not in slots_all:
+        return None
+    symbol_const = None
+    if "SYMBOL" not in slots_all:
+        symbols = {p["symbol"].upper() for _, p, _ in members}
+        if len(symbols) != 1:
+            return None
+        symbol_const = symbols.pop()
+
+    spec = {
+        "source_id": source_id,
+        "lines": [{"skeleton": sk, "regex": layout[sk][1], "slots": layout[sk][0]} for sk in signature],
+        "symbol_const": symbol_const,
+        "support": len(members),
+        "samples": len(pairs),
+        "built_at": datetime.now(timezone.utc).isoformat(),
+    }
+
+    # Verify against every sample it claims to match (not only the supporting ones)
+    tpl = Template(spec)
+    attempted = correct = 0
+    for raw, parsed in pairs:
+        if not parsed:
+            continue
+        got = tpl.extract(raw)
+        if got is None:
+            continue
+        attempted += 1
+        correct += _agrees(got, parsed)
+    spec["coverage"] = round(attempted / max(1, len(pairs)), 4)
+    spec["accuracy"] = round(correct / attempted, 4) if attempted else 0.0
+    if spec["accuracy"] < min_accuracy:
+        return None
+    return spec
+
+
+@dataclass
+class TemplateStats:
+    attempts: int = 0
+    hits: int = 0
+    mismatches: int = 0
+    no_template: int = 0
+
+
+class TemplateStore:
+    """Compiled extractors keyed by source_id, loaded from TEMPLATE_DIR/<source_id>.json."""
+
+    def __init__(self, directory: str = None):
+        self.directory = directory or TEMPLATE_DIR
+        self._cache: Dict[str, Tuple[float, float, Optional[Template]]] = {}  # id -> (checked_at, mtime, tpl)
+        self.stats = TemplateStats()
+        self.per_source: Dict[str, TemplateStats] = defaultdict(TemplateStats)
+
+    def path(self, source_id) -> str:
+        return os.path.join(self.directory, f"{source_id}.json")
+
+    def get(self, source_id) -> Optional[Template]:
+        key = str(source_id)
+        now = time.monotonic()
+        cached = self._cache.get(key)
+        if cached and now - cached[0] < TEMPLATE_RELOAD_SECS:
+            return cached[2]
+        p = self.path(key)
+        try:
+            mtime = os.path.getmtime(p)
+        except OSError:
+            self._cache[key] = (now, 0.0, None)
+            return None
+        if cached and cached[1] == mtime:
+            self._cache[key] = (now, mtime, cached[2])
+            return cached[2]
+        try:
+            with open(p, encoding="utf-8") as f:
+                tpl = Template(json.load(f))
+        except Exception as e:
+            print(f"[WARN] Bad template for source {key}:", e)
+            tpl = None
+        self._cache[key] = (now, mtime, tpl)
+        return tpl
+
+    def save(self, source_id, spec: dict):
+        os.makedirs(self.directory, exist_ok=True)
+        tmp = self.path(source_id) + ".tmp"
+        with open(tmp, "w", encoding="utf-8") as f:
+            json.dump(spec, f, ensure_ascii=False, indent=2)
+        os.replace(tmp, self.path(source_id))
+        self._cache.pop(str(source_id), None)
+
+    def extract(self, source_id, raw_text: str) -> Optional[Dict[str, Any]]:
+        if source_id is None:
+            return None
+        tpl = self.get(source_id)
+        per = self.per_source[str(source_id)]
+        if tpl is None:
+            self.stats.no_template += 1
+            return None
+        self.stats.attempts += 1
+        per.attempts += 1
+        res = tpl.extract(raw_text)
+        if res is None:
+            self.stats.mismatches += 1
+            per.mismatches += 1
+        else:
+            self.stats.hits += 1
+            per.hits += 1
+        return res
+
+    def snapshot(self) -> dict:
+        snap = asdict(self.stats)
+        snap["hit_rate"] = round(self.stats.hits / self.stats.attempts, 3) if self.stats.attempts else 0.0
+        snap["per_source"] = {
+            sid: round(s.hits / s.attempts, 3) for sid, s in self.per_source.items() if s.attempts
+        }
+        return snap
+
+
+# ---------- CLI ----------
+def _sb():
+    try:
+        from lib.supa import service_client
+    except ImportError:
+        from supa import service_client
+    return service_client()
+
+
+def build(source_ids: List[str] = None, limit: int = 500, min_support: int = None):
+    sb = _sb()
+    store = TemplateStore()
+    if not source_ids:
+        source_ids = [r["id"] for r in (sb.table("group_sources").select("id").execute().data or [])]
+    for sid in source_ids:
+        rows = (sb.table("inbound_messages")
+                  .select("raw_text,parsed_json")
+                  .eq("source_id", sid)
+                  .order("id", desc=True)
+                  .limit(limit)
+                  .execute().data) or []
+        pairs = [(r.get("raw_text") or "", r.get("parsed_json")) for r in rows]
+        spec = learn_template(pairs, source_id=str(sid), min_support=min_support)
+        if spec is None:
+            print(f"[{sid}] no template ({len(pairs)} samples)")
+            if os.path.exists(store.path(sid)):
+                os.remove(store.path(sid))
+            continue
+        store.save(sid, spec)
+        print(f"[{sid}] template saved: support={spec['support']}/{spec['samples']} "
+              f"coverage={spec['coverage']} accuracy={spec['accuracy']}")
+        for line in spec["lines"]:
+            print("    ", line["skeleton"])
+
+
+def main():
+    args = sys.argv[1:]
+    if not args or args[0] not in ("build", "show"):
+        print("Usage:")
+        print("  python lib/templates.py build [--source <source_id>] [--limit 500] [--min-support 3]")
+        print("  python lib/templates.py show <source_id>")
+        sys.exit(0)
+    if args[0] == "show":
+        tpl = TemplateStore().get(args[1]) if len(args) > 1 else None
+        print(json.dumps(tpl.spec, indent=2, ensure_ascii=False) if tpl else "No template.")
+        return
+    sources = [args[i + 1] for i, a in enumerate(args) if a == "--source"]
+    limit = int(args[args.index("--limit") + 1]) if "--limit" in args else 500
+    support = int(args[args.index("--min-support") + 1]) if "--min-support" in args else None
+    build(sources or None, limit=limit, min_support=support)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,210 @@
+# lib/whitelist.py
+# One chat whitelist (owner_user_id -> chat_ids) shared by every session in the agent.
+#
+# Each SessionCtx used to query group_sources for its own owner every 15s. Now a single
+# background task syncs the whole table: a delta query on updated_at (watermark minus a
+# small overlap, so rows committed late by long transactions are not skipped) every
+# WHITELIST_REFRESH_SECS, plus a full resync every WHITELIST_FULL_SYNC_SECS to pick up
+# deleted rows. Requires sql/002_group_sources_updated_at.sql; without the column it
+# falls back to full syncs.
+#
+# Readers never wait: allowed() reads an immutable mapping that each sync replaces in a
+# single assignment, while the blocking PostgREST calls run in a worker thread.
+#
+# With a live change feed (lib/invalidation.py) apply_change() patches the index as
+# rows change and the delta polling stops; only the periodic full resync remains.
+import os
+import time
+import asyncio
+import threading
+from dataclasses import dataclass, asdict
+from datetime import datetime, timedelta, timezone
+from typing import Callable, Dict, FrozenSet, Optional, Tuple
+
+# ---------- ENV ----------
+WHITELIST_REFRESH_SECS = float(os.getenv("WHITELIST_REFRESH_SECS", "15"))
+WHITELIST_FULL_SYNC_SECS = float(os.getenv("WHITELIST_FULL_SYNC_SECS", "600"))
+WHITELIST_OVERLAP_SECS = float(os.getenv("WHITELIST_OVERLAP_SECS", "5"))
+WHITELIST_PAGE = int(os.getenv("WHITELIST_PAGE", "1000"))  # PostgREST max-rows
+
+_COLS = "id,owner_user_id,chat_id,platform,updated_at"
+_EMPTY: FrozenSet[int] = frozenset()
+
+
+@dataclass
+class WhitelistStats:
+    refreshes: int = 0
+    full_syncs: int = 0
+    queries: int = 0
+    rows_fetched: int = 0
+    changes: int = 0
+    pushed: int = 0          # changes applied from the change feed
+    errors: int = 0
+    last_refresh_ms: float = 0.0
+    total_refresh_ms: float = 0.0
+
+
+def _parse_ts(value: str) -> datetime:
+    return datetime.fromisoformat(value.replace("Z", "+00:00"))
+
+
+class WhitelistIndex:
+    def __init__(self, sb, refresh_secs: float = None, full_sync_secs: float = None, platform: str = "telegram"):
+        self.sb = sb
+        self.refresh_secs = refresh_secs or WHITELIST_REFRESH_SECS
+        self.full_sync_secs = full_sync_secs or WHITELIST_FULL_SYNC_SECS
+        self.platform = platform
+        self._by_owner: Dict[str, FrozenSet[int]] = {}
+        self._rows: Dict[str, Tuple[str, int]] = {}     # group_sources.id -> (owner, chat_id)
+        self._watermark: Optional[datetime] = None
+        self._last_full = 0.0
+        self._synced_at = 0.0                          # monotonic time of last successful sync
+        self._delta_supported = True
+        self._lock = threading.Lock()                  # writers only (sync thread vs apply_change)
+        self._syncing = False
+        self._replay = []                              # changes pushed while a sync was fetching
+        self.live: Optional[Callable[[], bool]] = None  # True while a change feed keeps us current
+        self.stats = WhitelistStats()
+
+    # ---- readers (any session, no locking) ----
+    def allowed(self, owner_user_id: str) -> FrozenSet[int]:
+        return self._by_owner.get(str(owner_user_id), _EMPTY)
+
+    @property
+    def ready(self) -> bool:
+        return self._synced_at > 0
+
+    # ---- sync ----
+    def _fetch(self, since: Optional[datetime]) -> list:
+        rows, offset = [], 0
+        while True:
+            q = self.sb.table("group_sources").select(_COLS)
+            if since is not None:
+                q = q.gte("updated_at", since.isoformat()).order("updated_at").order("id")
+            else:
+                q = q.order("id")
+            page = q.range(offset, offset + WHITELIST_PAGE - 1).execute().data or []
+            self.stats.queries += 1
+            rows.extend(page)
+            if len(page) < WHITELIST_PAGE:
+                return rows
+            offset += WHITELIST_PAGE
+
+    def _row_entry(self, row: dict) -> Optional[Tuple[str, int]]:
+        if row.get("platform") != self.platform:
+            return None
+        try:
+            return str(row["owner_user_id"]), int(row["chat_id"])
+        except Exception:
+            return None
+
+    def _merge(self, rows: Dict[str, Tuple[str, int]], row: dict, op: str = "UPDATE", old: dict = None):
+        if op == "DELETE":
+            rows.pop(str((old or row)["id"]), None)
+            return
+        entry = self._row_entry(row)
+        if entry is None:
+            rows.pop(str(row["id"]), None)   # moved off this platform
+        else:
+            rows[str(row["id"])] = entry
+
+    def _swap(self, new_rows: Dict[str, Tuple[str, int]], force: bool = False) -> int:
+        changed = len(set(new_rows.values()) ^ set(self._rows.values()))
+        if changed or force:
+            by_owner: Dict[str, set] = {}
+            for owner, chat_id in new_rows.values():
+                by_owner.setdefault(owner, set()).add(chat_id)
+            self._by_owner = {o: frozenset(c) for o, c in by_owner.items()}  # one swap, readers see old or new
+        self._rows = new_rows
+        return changed
+
+    def apply_change(self, op: str, row: dict, old: dict = None) -> int:
+        """Patch the index from a group_sources change notification (INSERT/UPDATE/DELETE)."""
+        with self._lock:
+            if self._syncing:
+                self._replay.append((op, row, old))
+            new_rows = dict(self._rows)
+            self._merge(new_rows, row, op, old)
+            changed = self._swap(new_rows)
+        self.stats.pushed += 1
+        self.stats.changes += changed
+        return changed
+
+    def sync(self, full: bool = False) -> int:
+        """Blocking; returns the number of (owner, chat) entries that changed."""
+        t0 = time.perf_counter()
+        full = full or not self._delta_supported or self._watermark is None \
+            or time.monotonic() - self._last_full >= self.full_sync_secs
+        since = None if full else self._watermark - timedelta(seconds=WHITELIST_OVERLAP_SECS)
+        with self._lock:
+            self._syncing, self._replay = True, []
+        try:
+            rows = self._fetch(since)
+        except Exception as e:
+            with self._lock:
+                self._syncing = False
+            if since is not None and "updated_at" in str(e):
+                print("[WARN] group_sources.updated_at missing (apply sql/002_group_sources_updated_at.sql); "
+                      "whitelist falls back to full syncs")
+                self._delta_supported = False
+                return self.sync(full=True)
+            self.stats.errors += 1
+            raise
+
+        with self._lock:
+            new_rows = {} if full else dict(self._rows)
+            for row in rows:
+                self._merge(new_rows, row)
+                ts = row.get("updated_at")
+                if ts:
+                    ts = _parse_ts(ts)
+                    if self._watermark is None or ts > self._watermark:
+                        self._watermark = ts
+            if full and self._watermark is None:
+                self._watermark = datetime.now(timezone.utc)
+            # pushed changes that raced this fetch are newer than what it returned
+            for op, row, old in self._replay:
+                self._merge(new_rows, row, op, old)
+            self._syncing, self._replay = False, []
+            changed = self._swap(new_rows, force=full)
+
+        elapsed_ms = (time.perf_counter() - t0) * 1000
+        self.stats.refreshes += 1
+        self.stats.full_syncs += int(full)
+        self.stats.rows_fetched += len(rows)
+        self.stats.changes += changed
+        self.stats.last_refresh_ms = round(elapsed_ms, 2)
+        self.stats.total_refresh_ms += elapsed_ms
+        if full:
+            self._last_full = time.monotonic()
+        self._synced_at = time.monotonic()
+        if changed:
+            print(f"[INFO] whitelist {'full' if full else 'delta'} sync: {changed} change(s), "
+                  f"{len(self._rows)} chats across {len(self._by_owner)} owners")
+        return changed
+
+    async def run(self):
+        """Background loop: one shared sync per interval for every session."""
+        while True:
+            if self.ready:
+                await asyncio.sleep(self.refresh_secs)
+                if self.live and self.live() and time.monotonic() - self._last_full < self.full_sync_secs:
+                    continue   # change feed is current; only the periodic full resync polls
+            try:
+                await asyncio.to_thread(self.sync)
+            except Exception as e:
+                print("[ERR] whitelist sync failed:", repr(e))
+                await asyncio.sleep(self.refresh_secs)
+
+    def snapshot(self) -> dict:
+        snap = asdict(self.stats)
+        snap["avg_refresh_ms"] = round(self.stats.total_refresh_ms / self.stats.refreshes, 2) \
+            if self.stats.refreshes else None
+        snap["total_refresh_ms"] = round(self.stats.total_refresh_ms, 1)
+        snap["staleness_secs"] = round(time.monotonic() - self._synced_at, 1) if self._synced_at else None
+        snap["owners"] = len(self._by_owner)
+        snap["chats"] = len(self._rows)
+        snap["delta"] = self._delta_supported
+        snap["push"] = bool(self.live and self.live())
+        snap["watermark"] = self._watermark.isoformat() if self._watermark else None
+        return snap
@@ -8,6 +8,10 @@ from uuid import UUID
 from dotenv import load_dotenv
 from lib.supa import service_client
 from lib.parser import parse_trade_signal
+from lib.symbols import resolve_symbol
+from lib.sizing import size_one
+from lib.route_cache import ROUTE_CACHE_TTL_SECS, TTLCache
+from lib.invalidation import get_bus
 from lib.llm_normalize import normalize_message
 from datetime import datetime, timezone
 # ========== State Constants ==========
@@ -99,6 +103,46 @@ async def set_copy_mode(update: Update, context: ContextTypes.DEFAULT_TYPE):
     sb.table("user_settings").upsert({"user_id": user_id, "copy_mode": mode}).execute()
     await update.message.reply_text(f"✅ Copy mode set to *{mode}*.", parse_mode="Markdown")
 
+async def set_collapse(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    """/collapse on|off [window_secs] [tolerance] - merge the same trade from several sources into one card."""
+    user_id = _link_user(update.effective_user)
+    args = [a.lower() for a in (context.args or [])]
+    if not args or args[0] not in ("on", "off"):
+        await update.message.reply_text("Usage: /collapse on|off [window_secs] [tolerance, e.g. 0.001 = 0.1%]")
+        return
+    row = {"user_id": user_id, "collapse_duplicates": args[0] == "on"}
+    try:
+        if len(args) > 1:
+            row["collapse_window_secs"] = int(args[1])
+        if len(args) > 2:
+            row["collapse_tolerance"] = float(args[2])
+    except ValueError:
+        await update.message.reply_text("window_secs must be an integer and tolerance a number.")
+        return
+    sb.table("user_settings").upsert(row).execute()
+    await update.message.reply_text(f"✅ Duplicate collapsing *{args[0]}*.", parse_mode="Markdown")
+
+async def set_sizing(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    """/sizing fixed <lots> | risk <pct> [max_lots] - lot size for copied signals."""
+    user_id = _link_user(update.effective_user)
+    args = [a.lower() for a in (context.args or [])]
+    if len(args) < 2 or args[0] not in ("fixed", "risk"):
+        await update.message.reply_text("Usage: /sizing fixed <lots> [max_lots] | /sizing risk <% of balance> [max_lots]")
+        return
+    try:
+        value = float(args[1])
+        cap = float(args[2]) if len(args) > 2 else None
+    except ValueError:
+        await update.message.reply_text("lots, % and max_lots must be numbers.")
+        return
+    if value <= 0 or (args[0] == "risk" and value > 100) or (cap is not None and cap <= 0):
+        await update.message.reply_text("Values must be positive (risk at most 100%).")
+        return
+    row = {"user_id": user_id, "sizing_mode": args[0], "max_symbol_lots": cap}
+    row["fixed_lots" if args[0] == "fixed" else "risk_pct"] = value
+    sb.table("user_settings").upsert(row).execute()
+    await update.message.reply_text(f"✅ Sizing set to *{args[0]} {value:g}*.", parse_mode="Markdown")
+
 def _load_user_settings(user_id: str):
     q = sb.table("user_settings").select("*").eq("user_id", user_id).limit(1).execute()
     return (q.data or [{}])[0]
@@ -253,19 +297,28 @@ async def alert(update: Update, context: ContextTypes.DEFAULT_TYPE):
 
 # ===== Subscriptions UX (inline buttons) =====
 
+# Cached only while the change feed is live (DATABASE_URL); otherwise every render queries
+bus = get_bus()
+_sources_cache = TTLCache(float(os.getenv("SOURCES_CACHE_TTL_SECS", "600")))
+bus.subscribe("group_sources", lambda ch: _sources_cache.invalidate(lambda k: k == "all"))
+bus.subscribe("copy_routes", lambda ch: _sources_cache.invalidate(lambda k: k == ("subs", ch.get("follower_user_id"))))
+bus.on_resync(lambda: _sources_cache.invalidate())
+
 def _fetch_sources():
-    res = sb.table("group_sources").select("id,title,chat_id").execute()
-    return res.data or []
+    load = lambda: sb.table("group_sources").select("id,title,chat_id").execute().data or []
+    return _sources_cache.get_or_load("all", load) if bus.live else load()
 
 def _subscribed_source_ids(user_id: str):
-    q = (
-        sb.table("copy_routes")
-          .select("source_id")
-          .eq("follower_user_id", user_id)
-          .eq("active", True)
-          .execute()
-    )
-    return {row["source_id"] for row in (q.data or [])}
+    def load():
+        q = (
+            sb.table("copy_routes")
+              .select("source_id")
+              .eq("follower_user_id", user_id)
+              .eq("active", True)
+              .execute()
+        )
+        return {row["source_id"] for row in (q.data or [])}
+    return _sources_cache.get_or_load(("subs", user_id), load) if bus.live else load()
 
 def _render_sources_markup(user_id: str):
     """Return (text, InlineKeyboardMarkup) showing all sources with per-row Subscribe/Unsubscribe buttons."""
@@ -345,8 +398,12 @@ async def toggle_source(update: Update, ctx: ContextTypes.DEFAULT_TYPE):
         await q.edit_message_text(f"❌ Error: {e}")
         return
 
-    # Re-render updated list
+    # Re-render updated list; the agent gets the change notification right away, or
+    # picks it up within its route cache TTL when no change feed is configured
+    _sources_cache.invalidate(lambda k: k == ("subs", user_id))
     text, markup = _render_sources_markup(user_id)
+    if not bus.live:
+        text += f"\n\n_Applies to new signals within ~{int(ROUTE_CACHE_TTL_SECS)}s._"
     await q.edit_message_text(text, reply_markup=markup, parse_mode="Markdown")
 # ========== Help Command Function ==========
 async def help_cmd(update: Update, context: ContextTypes.DEFAULT_TYPE):
@@ -507,7 +564,8 @@ async def handle_edit_value(update, ctx):
             side = "buy" if side in ("buy", "long") else "sell"
             _patch_edited_json(uim_id, {"action": side})
         elif field == "symbol":
-            _patch_edited_json(uim_id, {"symbol": raw.upper()})
+            # "gold" -> XAUUSD, "#eurusd.m" -> EURUSD; unknown instruments are kept as typed
+            _patch_edited_json(uim_id, {"symbol": resolve_symbol(raw) or raw.upper()})
         else:
             return await update.message.reply_text("Unknown field.")
     except Exception as e:
@@ -584,13 +642,22 @@ async def handle_broker_choice(update, ctx):
     if not (parsed.get("symbol") and side and entry_min):
         return await q.edit_message_text("❌ Invalid order payload. Try editing again.")
 
+    # Lot size from the follower's sizing settings and the chosen account's balance
+    account = (sb.table("accounts").select("id,broker,balance")
+                 .eq("id", account_id).limit(1).execute().data or [{}])[0]
+    size = size_one(parsed, _load_user_settings(uim["user_id"]), account)
+    if size <= 0:
+        return await q.message.reply_text(
+            "❌ Your risk settings give a size below the broker's minimum lot for this signal. "
+            "Raise risk % or switch to fixed sizing with /sizing.")
+
     group_source_id = inbound.get("source_id")  # this will be your group_sources.id
     # Create signal (now with group_source_id)
     sig_id = (sb.rpc("rpc_create_signal", {
         "p_master_id": uim["user_id"],
         "p_symbol": parsed["symbol"],
         "p_side": (parsed.get("side") or parsed.get("action")),   # normalize
-        "p_size": 0.01,                                            # TODO: user setting
+        "p_size": size,
         "p_sl": parsed.get("sl"),
         "p_tp": parsed.get("tp"),
         "p_group_source_id": group_source_id
@@ -639,7 +706,10 @@ async def log_chat_id(update: Update, ctx: ContextTypes.DEFAULT_TYPE):
                                reply_markup=main_menu())
 
 # ========== Setup ==========
-app = ApplicationBuilder().token(BOT_TOKEN).build()
+async def _start_bus(application):
+    await bus.start()
+
+app = ApplicationBuilder().token(BOT_TOKEN).post_init(_start_bus).build()
 
 
 
@@ -663,6 +733,8 @@ app.add_handler(CommandHandler("start", start))
 app.add_handler(CommandHandler("buy", buy))
 app.add_handler(CommandHandler("sell", sell))
 app.add_handler(CommandHandler("setcopymode", set_copy_mode))
+app.add_handler(CommandHandler("collapse", set_collapse))
+app.add_handler(CommandHandler("sizing", set_sizing))
 app.add_handler(CommandHandler("sources", sources))
 
 # ONE catch-all, LAST
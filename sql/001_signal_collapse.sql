@@ -0,0 +1,29 @@
+-- 001_signal_collapse.sql
+-- Cross-source duplicate collapsing (lib/signal_index.py).
+-- A follower's first card for a trade keeps the row; later copies of the same trade
+-- from other sources are appended to extra_sources instead of creating new rows.
+
+alter table public.user_inbound_messages
+  add column if not exists extra_sources jsonb not null default '[]'::jsonb;
+
+-- Per-follower settings (NULL / missing row -> COLLAPSE_* env defaults in tele_agent)
+alter table public.user_settings
+  add column if not exists collapse_duplicates boolean,
+  add column if not exists collapse_window_secs integer,
+  add column if not exists collapse_tolerance numeric;
+
+-- Atomic append (two copies may be attached concurrently); idempotent per inbound message
+create or replace function public.rpc_uim_add_extra_source(p_uim_id bigint, p_source jsonb)
+returns jsonb
+language sql
+as $$
+  update public.user_inbound_messages u
+     set extra_sources = coalesce(u.extra_sources, '[]'::jsonb) || jsonb_build_array(p_source)
+   where u.id = p_uim_id
+     and not exists (
+       select 1
+         from jsonb_array_elements(coalesce(u.extra_sources, '[]'::jsonb)) e
+        where e->>'inbound_message_id' = p_source->>'inbound_message_id'
+     )
+  returning u.extra_sources;
+$$;
@@ -0,0 +1,25 @@
+-- 002_group_sources_updated_at.sql
+-- Watermark for the shared chat whitelist (lib/whitelist.py): the agent fetches only
+-- group_sources rows with updated_at past its last sync instead of one query per session.
+-- Deleted rows are picked up by the periodic full resync (WHITELIST_FULL_SYNC_SECS).
+
+alter table public.group_sources
+  add column if not exists updated_at timestamptz not null default now();
+
+create index if not exists group_sources_updated_at_idx
+  on public.group_sources (updated_at, id);
+
+create or replace function public.tg_set_updated_at()
+returns trigger
+language plpgsql
+as $$
+begin
+  new.updated_at := now();
+  return new;
+end;
+$$;
+
+drop trigger if exists group_sources_set_updated_at on public.group_sources;
+create trigger group_sources_set_updated_at
+  before update on public.group_sources
+  for each row execute function public.tg_set_updated_at();
@@ -0,0 +1,50 @@
+-- 003_invalidation_notify.sql
+-- Row-change notifications for the config tables the bot and the agent cache
+-- (lib/invalidation.py). Each trigger sends the key columns named in its arguments,
+-- so payloads stay far below pg_notify's 8000 byte limit. Notifications are delivered
+-- at commit; a rolled back change sends nothing.
+
+create or replace function public.tg_notify_invalidation()
+returns trigger
+language plpgsql
+as $$
+declare
+  v_row jsonb := '{}'::jsonb;
+  v_old jsonb := '{}'::jsonb;
+begin
+  if tg_op <> 'DELETE' then
+    select coalesce(jsonb_object_agg(k, to_jsonb(new) -> k), '{}'::jsonb) into v_row from unnest(tg_argv) k;
+  end if;
+  if tg_op <> 'INSERT' then
+    select coalesce(jsonb_object_agg(k, to_jsonb(old) -> k), '{}'::jsonb) into v_old from unnest(tg_argv) k;
+  end if;
+  perform pg_notify('cache_invalidation', jsonb_build_object(
+    'table', tg_table_name,
+    'op',    tg_op,
+    'row',   v_row,
+    'old',   v_old,
+    'ts',    extract(epoch from clock_timestamp())
+  )::text);
+  return null;
+end;
+$$;
+
+drop trigger if exists group_sources_notify on public.group_sources;
+create trigger group_sources_notify
+  after insert or update or delete on public.group_sources
+  for each row execute function public.tg_notify_invalidation('id', 'owner_user_id', 'chat_id', 'platform', 'updated_at');
+
+drop trigger if exists copy_routes_notify on public.copy_routes;
+create trigger copy_routes_notify
+  after insert or update or delete on public.copy_routes
+  for each row execute function public.tg_notify_invalidation('id', 'source_id', 'follower_user_id', 'active');
+
+drop trigger if exists user_settings_notify on public.user_settings;
+create trigger user_settings_notify
+  after insert or update or delete on public.user_settings
+  for each row execute function public.tg_notify_invalidation('user_id');
+
+drop trigger if exists accounts_notify on public.accounts;
+create trigger accounts_notify
+  after insert or update or delete on public.accounts
+  for each row execute function public.tg_notify_invalidation('id', 'user_id', 'status');
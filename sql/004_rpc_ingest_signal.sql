@@ -0,0 +1,77 @@
+-- 004_rpc_ingest_signal.sql
+-- One round trip per signal (lib/ingest_db.py, INGEST_DB_MODE=rpc) instead of
+-- 3 + 2N PostgREST calls: upsert inbound_messages, read the source's active
+-- copy_routes and upsert one user_inbound_messages row per follower, all in the
+-- function's transaction.
+--
+-- p_collapse maps follower_user_id -> id of the card a duplicate of this trade already
+-- has (lib/signal_index.py); those followers get p_extra_source appended to that card
+-- instead of a new row. A null id means "no row, the caller decides later" (the first
+-- card is still being created). Requires 001_signal_collapse.sql.
+--
+-- Returns {"inbound_id": ..., "routes": [{follower_user_id, target_chat_id, uim_id, collapsed}]}
+
+create or replace function public.rpc_ingest_signal(
+  p_source_id     public.group_sources.id%type,
+  p_message_id    text,
+  p_message_ts    timestamptz,
+  p_raw_text      text,
+  p_normalized    jsonb,
+  p_parsed        jsonb,
+  p_collapse      jsonb default '{}'::jsonb,
+  p_extra_source  jsonb default null
+)
+returns jsonb
+language plpgsql
+as $$
+declare
+  v_inbound_id public.inbound_messages.id%type;
+  v_collapse   jsonb := coalesce(p_collapse, '{}'::jsonb);
+  v_routes     jsonb;
+begin
+  insert into public.inbound_messages as m
+         (source_id, message_id, message_ts, raw_text, normalized_json, parsed_json)
+  values (p_source_id, p_message_id, p_message_ts, p_raw_text, p_normalized, p_parsed)
+  on conflict (source_id, message_id) do update
+     set message_ts      = excluded.message_ts,
+         raw_text        = excluded.raw_text,
+         normalized_json = excluded.normalized_json,
+         parsed_json     = excluded.parsed_json
+  returning m.id into v_inbound_id;
+
+  if p_extra_source is not null then
+    perform public.rpc_uim_add_extra_source(
+              c.value::bigint,
+              p_extra_source || jsonb_build_object('inbound_message_id', v_inbound_id))
+       from jsonb_each_text(v_collapse) c
+      where c.value is not null;
+  end if;
+
+  with routes as (
+    select r.follower_user_id, r.target_chat_id
+      from public.copy_routes r
+     where r.source_id = p_source_id
+       and r.active
+  ), ins as (
+    -- one row per follower even with several active routes (target chats) on this source:
+    -- ON CONFLICT DO UPDATE may not touch the same row twice in one statement
+    insert into public.user_inbound_messages as u (user_id, inbound_message_id, status)
+    select distinct rt.follower_user_id, v_inbound_id, 'pending'
+      from routes rt
+     where not v_collapse ? rt.follower_user_id::text
+    on conflict (user_id, inbound_message_id) do update
+       set status = excluded.status
+    returning u.id, u.user_id
+  )
+  select coalesce(jsonb_agg(jsonb_build_object(
+           'follower_user_id', rt.follower_user_id,
+           'target_chat_id',   rt.target_chat_id,
+           'uim_id',           coalesce(i.id, (v_collapse ->> rt.follower_user_id::text)::bigint),
+           'collapsed',        i.id is null)), '[]'::jsonb)
+    into v_routes
+    from routes rt
+    left join ins i on i.user_id = rt.follower_user_id;
+
+  return jsonb_build_object('inbound_id', v_inbound_id, 'routes', v_routes);
+end;
+$$;
@@ -0,0 +1,64 @@
+-- 005_rpc_auto_copy_orders.sql
+-- Auto copy-mode (user_settings.copy_mode = 'auto'): tele_agent creates the signal and
+-- the order for every auto follower of a message in one call (lib/auto_copy.py) instead
+-- of waiting for the review -> brokerlist -> broker callbacks in main.py.
+--
+-- Per follower this runs the same rpc_create_signal / rpc_create_order pair as
+-- main.handle_broker_choice (client order id "tg:<uim_id>", so a later manual
+-- approval of the same card is idempotent) and marks the card executed. Each
+-- follower runs in its own subtransaction: one failure does not roll back the others.
+-- The calls go through format(%L) so the arguments take the existing functions'
+-- parameter types, whatever they are.
+--
+-- p_orders: [{"user_id", "account_id", "uim_id", "size"}]
+-- Returns:  [{"user_id", "uim_id", "ok", "signal_id", "order", "error", "created_at"}]
+
+create or replace function public.rpc_auto_copy_orders(
+  p_group_source_id  public.group_sources.id%type,
+  p_parsed           jsonb,
+  p_orders           jsonb
+)
+returns jsonb
+language plpgsql
+as $$
+declare
+  o           jsonb;
+  v_sig       jsonb;
+  v_order     jsonb;
+  v_signal_id text;
+  v_out       jsonb := '[]'::jsonb;
+begin
+  for o in select value from jsonb_array_elements(p_orders) loop
+    begin
+      execute format(
+        'select to_jsonb(public.rpc_create_signal(p_master_id => %L, p_symbol => %L, p_side => %L, '
+        'p_size => %L, p_sl => %L, p_tp => %L, p_group_source_id => %L))',
+        o->>'user_id', p_parsed->>'symbol', coalesce(p_parsed->>'side', p_parsed->>'action'),
+        o->>'size', p_parsed->>'sl', coalesce(p_parsed->'tp', '[]'::jsonb)::text, p_group_source_id)
+      into v_sig;
+      -- rpc_create_signal may return the id or the row
+      v_signal_id := coalesce(v_sig->>'id', v_sig #>> '{}');
+
+      execute format(
+        'select to_jsonb(public.rpc_create_order(p_user_id => %L, p_account_id => %L, p_signal_id => %L, '
+        'p_client_order_id => %L, p_meta => %L))',
+        o->>'user_id', o->>'account_id', v_signal_id, 'tg:' || (o->>'uim_id'),
+        jsonb_build_object('uim_id', (o->>'uim_id')::bigint, 'auto', true)::text)
+      into v_order;
+
+      update public.user_inbound_messages
+         set status = 'executed', decided_at = now()
+       where id = (o->>'uim_id')::bigint;
+
+      v_out := v_out || jsonb_build_array(jsonb_build_object(
+        'user_id', o->>'user_id', 'uim_id', (o->>'uim_id')::bigint, 'ok', true,
+        'signal_id', v_signal_id, 'order', v_order,
+        'created_at', extract(epoch from clock_timestamp())));
+    exception when others then
+      v_out := v_out || jsonb_build_array(jsonb_build_object(
+        'user_id', o->>'user_id', 'uim_id', (o->>'uim_id')::bigint, 'ok', false, 'error', sqlerrm));
+    end;
+  end loop;
+  return v_out;
+end;
+$$;
@@ -0,0 +1,14 @@
+-- 006_position_sizing.sql
+-- Per-follower position sizing (lib/sizing.py). NULL = not set: fixed mode with
+-- SIZING_DEFAULT_LOTS, no symbol cap.
+
+alter table public.user_settings
+  add column if not exists sizing_mode text check (sizing_mode in ('fixed', 'risk')),
+  add column if not exists fixed_lots numeric check (fixed_lots > 0),
+  add column if not exists risk_pct numeric check (risk_pct > 0 and risk_pct <= 100),
+  add column if not exists max_symbol_lots numeric check (max_symbol_lots > 0);
+
+-- Balance in the account currency (SIZING_ACCOUNT_CCY), kept up to date by the executor
+alter table public.accounts
+  add column if not exists balance numeric,
+  add column if not exists balance_updated_at timestamptz;
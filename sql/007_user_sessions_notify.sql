@@ -0,0 +1,10 @@
+-- 007_user_sessions_notify.sql
+-- Change notifications for user_sessions, so the agent's session supervisor
+-- (lib/session_supervisor.py) starts a new login or stops a deactivated session right
+-- away instead of at its next SESSION_RECONCILE_SECS poll. Key columns only: the
+-- session string never goes into a notification.
+
+drop trigger if exists user_sessions_notify on public.user_sessions;
+create trigger user_sessions_notify
+  after insert or update or delete on public.user_sessions
+  for each row execute function public.tg_notify_invalidation('id', 'owner_user_id', 'is_active');
@@ -1,3 +1,4 @@
 #!/bin/sh
 python main.py &
-python lib/tele_agent.py run
+# exec: the agent gets the container's SIGTERM and stops its shards
+exec python lib/tele_agent.py run
@@ -0,0 +1,288 @@
+# tests/test_ingest_db.py
+# lib/ingest_db.py against a real Postgres with sql/001-004 applied.
+#
+#   TEST_DATABASE_URL=postgresql://postgres@localhost:5432/scratch python -m pytest tests
+#
+# Skipped without TEST_DATABASE_URL. Use a scratch database: the minimal Supabase tables
+# the migrations alter are created if missing, then 001-004 are applied on top. Every
+# test works on its own source/followers (random uuids) and deletes them afterwards.
+#
+# IngestDB talks PostgREST through supabase-py; _SqlClient runs the handful of query
+# builder calls it makes (table().upsert/select/eq/maybe_single, rpc()) as plain SQL on
+# the same database, the way PostgREST would, so rpc and legacy mode can be compared.
+import os
+import sys
+import json
+import uuid
+import asyncio
+from pathlib import Path
+from types import SimpleNamespace
+
+import pytest
+
+ROOT = Path(__file__).resolve().parents[1]
+sys.path.insert(0, str(ROOT))
+
+from lib.ingest_db import IngestDB  # noqa: E402
+
+TEST_DATABASE_URL = os.getenv("TEST_DATABASE_URL", "")
+MIGRATIONS = ["001_signal_collapse.sql", "002_group_sources_updated_at.sql",
+              "003_invalidation_notify.sql", "004_rpc_ingest_signal.sql"]
+
+pytestmark = pytest.mark.skipif(not TEST_DATABASE_URL, reason="TEST_DATABASE_URL not set")
+
+BASE_SCHEMA = """
+create table if not exists public.group_sources (
+  id uuid primary key default gen_random_uuid(),
+  owner_user_id uuid, platform text default 'telegram', chat_id text, title text);
+create table if not exists public.copy_routes (
+  id uuid primary key default gen_random_uuid(),
+  source_id uuid references public.group_sources(id) on delete cascade,
+  follower_user_id uuid, target_chat_id text, active boolean not null default true);
+create table if not exists public.inbound_messages (
+  id bigserial primary key,
+  source_id uuid references public.group_sources(id) on delete cascade,
+  message_id text, message_ts timestamptz, raw_text text,
+  normalized_json jsonb, parsed_json jsonb, unique (source_id, message_id));
+create table if not exists public.user_inbound_messages (
+  id bigserial primary key, user_id uuid,
+  inbound_message_id bigint references public.inbound_messages(id) on delete cascade,
+  status text, unique (user_id, inbound_message_id));
+create table if not exists public.user_settings (user_id uuid primary key);
+create table if not exists public.accounts (
+  id uuid primary key default gen_random_uuid(), user_id uuid, status text);
+"""
+
+PARSED = {"symbol": "XAUUSD", "action": "buy", "entry_min": 2350, "entry_max": 2360, "sl": 2340, "tp": [2370]}
+
+
+class Db:
+    """Blocking asyncpg connection on a private loop (IngestDB itself is synchronous)."""
+
+    def __init__(self, dsn: str):
+        asyncpg = pytest.importorskip("asyncpg")
+        self.loop = asyncio.new_event_loop()
+        self.conn = self.loop.run_until_complete(asyncpg.connect(dsn))
+        self.loop.run_until_complete(self.conn.set_type_codec(
+            "jsonb", encoder=json.dumps, decoder=json.loads, schema="pg_catalog"))
+
+    def execute(self, sql: str, *args):
+        return self.loop.run_until_complete(self.conn.execute(sql, *args))
+
+    def fetch(self, sql: str, *args):
+        return [dict(r) for r in self.loop.run_until_complete(self.conn.fetch(sql, *args))]
+
+    def fetchval(self, sql: str, *args):
+        return self.loop.run_until_complete(self.conn.fetchval(sql, *args))
+
+    def close(self):
+        self.loop.run_until_complete(self.conn.close())
+        self.loop.close()
+
+
+def _text(v) -> str:
+    return ("true" if v else "false") if isinstance(v, bool) else str(v)
+
+
+class _Query:
+    def __init__(self, db: Db, table: str):
+        self.db, self.table = db, table
+        self.filters, self.cols, self.single, self.row, self.on_conflict = [], "*", False, None, None
+
+    def select(self, cols: str = "*"):
+        self.cols = cols
+        return self
+
+    def eq(self, col: str, value):
+        self.filters.append((col, _text(value)))
+        return self
+
+    def maybe_single(self):
+        self.single = True
+        return self
+
+    def upsert(self, row: dict, on_conflict: str = "", returning: str = "representation"):
+        self.row, self.on_conflict = row, on_conflict
+        return self
+
+    def execute(self):
+        t = f"public.{self.table}"
+        if self.row is not None:
+            cols = ", ".join(self.row)
+            keys = [c.strip() for c in self.on_conflict.split(",")]
+            update = ", ".join(f"{c} = excluded.{c}" for c in self.row if c not in keys)
+            rows = self.db.fetch(
+                f"insert into {t} as x ({cols}) select {cols} from jsonb_populate_record(null::{t}, $1::jsonb)"
+                f" on conflict ({', '.join(keys)}) do update set {update} returning to_jsonb(x) as r",
+                self.row)
+        else:
+            where = " and ".join(f"x.{c}::text = ${i + 1}" for i, (c, _) in enumerate(self.filters)) or "true"
+            rows = self.db.fetch(f"select to_jsonb(x) as r from {t} x where {where}",
+                                 *[v for _, v in self.filters])
+        data = [r["r"] for r in rows]
+        if self.cols != "*":
+            data = [{c.strip(): d[c.strip()] for c in self.cols.split(",")} for d in data]
+        if self.single:
+            data = data[0] if data else None
+        return SimpleNamespace(data=data)
+
+
+class _Rpc:
+    def __init__(self, db: Db, fn: str, params: dict):
+        self.db, self.fn, self.params = db, fn, params
+
+    def execute(self):
+        types = {r["name"]: r["type"] for r in self.db.fetch(
+            "select unnest(p.proargnames) as name, unnest(p.proargtypes::regtype[])::text as type"
+            " from pg_proc p where p.proname = $1 and p.pronamespace = 'public'::regnamespace", self.fn)}
+        args = ", ".join(
+            f"{k} => ($1::jsonb -> '{k}')" if types[k] == "jsonb" else f"{k} => ($1::jsonb ->> '{k}')::{types[k]}"
+            for k in self.params)
+        return SimpleNamespace(data=self.db.fetchval(f"select to_jsonb(public.{self.fn}({args}))", self.params))
+
+
+class _SqlClient:
+    def __init__(self, db: Db):
+        self.db = db
+
+    def table(self, name: str) -> _Query:
+        return _Query(self.db, name)
+
+    def rpc(self, fn: str, params: dict) -> _Rpc:
+        return _Rpc(self.db, fn, params)
+
+
+@pytest.fixture(scope="module")
+def db():
+    db = Db(TEST_DATABASE_URL)
+    db.execute(BASE_SCHEMA)
+    for name in MIGRATIONS:
+        db.execute((ROOT / "sql" / name).read_text())
+    yield db
+    db.close()
+
+
+@pytest.fixture
+def source(db):
+    """A source with three active routes and one inactive one; removed afterwards."""
+    source_ids = []
+
+    def make(followers=None):
+        source_id = db.fetchval("insert into public.group_sources (owner_user_id, chat_id, title)"
+                                " values ($1, $2, 'test') returning id::text", uuid.uuid4(), str(uuid.uuid4()))
+        followers = followers or [str(uuid.uuid4()) for _ in range(3)]
+        for i, f in enumerate(followers):
+            db.execute("insert into public.copy_routes (source_id, follower_user_id, target_chat_id)"
+                       " values ($1::uuid, $2::uuid, $3)", source_id, f, f"chat-{i}")
+        db.execute("insert into public.copy_routes (source_id, follower_user_id, target_chat_id, active)"
+                   " values ($1::uuid, $2, 'chat-off', false)", source_id, uuid.uuid4())
+        source_ids.append(source_id)
+        return source_id, followers
+
+    yield make
+    for source_id in source_ids:
+        db.execute("delete from public.group_sources where id = $1::uuid", source_id)
+
+
+def payload(source_id: str, message_id: str) -> dict:
+    return {"source_id": source_id, "message_id": message_id, "message_ts": "2026-01-05T10:00:00+00:00",
+            "raw_text": "BUY XAUUSD 2350-2360 SL 2340 TP 2370", "normalized_json": {"v": 1}, "parsed_json": PARSED}
+
+
+def routes_of(result):
+    return {(r.follower_user_id, r.target_chat_id, r.uim_id, r.collapsed) for r in result.routes}
+
+
+def uim_rows(db, inbound_id: int):
+    return {(r["user_id"], r["id"]) for r in db.fetch(
+        "select user_id::text, id from public.user_inbound_messages where inbound_message_id = $1", inbound_id)}
+
+
+@pytest.mark.parametrize("mode", ["rpc", "legacy"])
+def test_reingest_is_idempotent(db, source, mode):
+    source_id, followers = source()
+    ingest = IngestDB(_SqlClient(db), mode=mode)
+    first = ingest.ingest(payload(source_id, "m1"))
+    again = ingest.ingest(payload(source_id, "m1"))
+
+    assert ingest.mode == mode
+    assert again.inbound_id == first.inbound_id
+    assert routes_of(again) == routes_of(first)
+    assert {r.follower_user_id for r in first.routes} == set(followers)   # inactive route left out
+    assert uim_rows(db, first.inbound_id) == {(r.follower_user_id, r.uim_id) for r in first.routes}
+    assert db.fetchval("select count(*) from public.inbound_messages where source_id = $1::uuid", source_id) == 1
+
+
+def test_collapse_attaches_through_p_collapse(db, source):
+    a_id, followers = source()
+    b_id, _ = source(followers)
+    ingest = IngestDB(_SqlClient(db), mode="rpc")
+    first = ingest.ingest(payload(a_id, "m1"))
+    card = {r.follower_user_id: r.uim_id for r in first.routes}
+    attached, pending, fresh = followers
+
+    extra = {"source_id": b_id, "title": "b", "message_id": "m9", "at": "2026-01-05T10:00:01+00:00"}
+    collapse = {attached: card[attached], pending: None}
+    dup = ingest.ingest(payload(b_id, "m9"), collapse, extra)
+    again = ingest.ingest(payload(b_id, "m9"), collapse, extra)
+
+    by_follower = {r.follower_user_id: r for r in dup.routes}
+    assert (by_follower[attached].uim_id, by_follower[attached].collapsed) == (card[attached], True)
+    assert (by_follower[pending].uim_id, by_follower[pending].collapsed) == (None, True)
+    assert not by_follower[fresh].collapsed and by_follower[fresh].uim_id is not None
+    assert routes_of(again) == routes_of(dup)
+    # only the uncollapsed follower got a row for the duplicate
+    assert uim_rows(db, dup.inbound_id) == {(fresh, by_follower[fresh].uim_id)}
+    # appended once to the first card, even though the duplicate was ingested twice
+    extra_sources = db.fetchval("select extra_sources from public.user_inbound_messages where id = $1",
+                                card[attached])
+    assert extra_sources == [dict(extra, inbound_message_id=dup.inbound_id)]
+
+
+def test_legacy_and_rpc_agree(db, source):
+    results = {}
+    for mode in ("rpc", "legacy"):
+        first_id, followers = source()
+        dup_id, _ = source(followers)
+        ingest = IngestDB(_SqlClient(db), mode=mode)
+        first = ingest.ingest(payload(first_id, "m1"))
+        card = {r.follower_user_id: r.uim_id for r in first.routes}
+        extra = {"source_id": dup_id, "title": "dup", "message_id": "m2", "at": "2026-01-05T10:00:01+00:00"}
+        collapse = {followers[0]: card[followers[0]], followers[1]: None}
+        dup = ingest.ingest(payload(dup_id, "m2"), collapse, extra)
+
+        # compare by position: each mode has its own followers and row ids
+        pos = {f: i for i, f in enumerate(followers)}
+        rows = uim_rows(db, dup.inbound_id)
+        results[mode] = {
+            "routes": sorted((pos[r.follower_user_id], r.target_chat_id, r.collapsed,
+                              "card" if r.uim_id == card.get(r.follower_user_id)
+                              else "new" if (r.follower_user_id, r.uim_id) in rows
+                              else r.uim_id) for r in dup.routes),
+            "uim_followers": sorted(pos[u] for u, _ in rows),
+            "extra_sources": db.fetchval(
+                "select jsonb_array_length(extra_sources) from public.user_inbound_messages where id = $1",
+                card[followers[0]]),
+        }
+    assert results["legacy"] == results["rpc"]
+    assert results["rpc"]["routes"] == [(0, "chat-0", True, "card"), (1, "chat-1", True, None),
+                                        (2, "chat-2", False, "new")]
+
+
+@pytest.mark.parametrize("mode", ["rpc", "legacy"])
+def test_follower_with_two_routes_on_one_source(db, source, mode):
+    source_id, followers = source()
+    db.execute("insert into public.copy_routes (source_id, follower_user_id, target_chat_id)"
+               " values ($1::uuid, $2::uuid, 'chat-0b')", source_id, followers[0])
+    ingest = IngestDB(_SqlClient(db), mode=mode)
+    result = ingest.ingest(payload(source_id, "m1"))
+    again = ingest.ingest(payload(source_id, "m1"))
+
+    assert ingest.mode == mode
+    both = [r for r in result.routes if r.follower_user_id == followers[0]]
+    assert sorted(r.target_chat_id for r in both) == ["chat-0", "chat-0b"]
+    assert both[0].uim_id == both[1].uim_id is not None
+    # one inbox row per follower, whatever the number of target chats
+    assert uim_rows(db, result.inbound_id) == {(r.follower_user_id, r.uim_id) for r in result.routes}
+    assert len(uim_rows(db, result.inbound_id)) == len(followers)
+    assert routes_of(again) == routes_of(result)
@@ -0,0 +1,32 @@
+# tests/test_symbols.py
+# Symbol resolution with the bundled catalog (lib/data/symbols/default.json).
+import sys
+import json
+from pathlib import Path
+
+import pytest
+
+ROOT = Path(__file__).resolve().parents[1]
+sys.path.insert(0, str(ROOT))
+
+from lib.symbols import SYMBOL_CATALOG_DIR, find_symbol, resolve_symbol  # noqa: E402
+
+DEFAULT = json.loads((Path(SYMBOL_CATALOG_DIR) / "default.json").read_text())
+
+
+@pytest.mark.parametrize("suffix", DEFAULT["suffixes"])
+def test_every_catalog_suffix_resolves(suffix):
+    for raw in (f"EURUSD{suffix}", f"#eurusd{suffix.lower()}", f"xauusd{suffix}"):
+        assert resolve_symbol(raw, "default") == raw.lstrip("#")[:6].upper(), raw
+    assert find_symbol(f"BUY XAUUSD{suffix} 2350 SL 2340", "default") == "XAUUSD"
+
+
+@pytest.mark.parametrize("raw", ["EURUSD.", "EURUSD.x", "EURUSD.mx", "EURUSDX", "EURUSD.proz"])
+def test_unknown_decoration_is_not_exact(raw):
+    assert resolve_symbol(raw, "default") is None
+
+
+def test_plain_and_aliases():
+    assert resolve_symbol("gold", "default") == "XAUUSD"
+    assert find_symbol("Gold buy now 2350 sl 2340. tp 2370", "default") == "XAUUSD"
+    assert find_symbol("eurusd. buy", "default") == "EURUSD"